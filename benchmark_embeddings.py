@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Benchmark quantized embedding storage on the documents in the vector store
+Compares memory, recall@k against exact float32 search, and query latency
+"""
+
+import sys
+import os
+import random
+import tempfile
+import time
+sys.path.insert(0, os.path.join(os.getcwd(), 'src'))
+
+from src.rag_system.retrieval.dense_index import DenseIndex
+from src.rag_system.retrieval.vector_store import VectorStore
+
+DEFAULT_QUERIES = [
+    "dehumidifier sizing formula",
+    "moisture load per person",
+    "room capacity calculation",
+    "moisture removal in kg/hr",
+    "humidity ratio in g/kg",
+    "air changes per hour for a swimming pool hall"
+]
+
+# (label, dtype, quantization, rescore_factor)
+VARIANTS = [
+    ("float32 exact", "float32", "none", 1),
+    ("float16 exact", "float16", "none", 1),
+    ("int8, no rescoring", "float32", "int8", 1),
+    ("int8 + rescoring", "float32", "int8", None),
+    ("binary, no rescoring", "float32", "binary", 1),
+    ("binary + rescoring", "float32", "binary", None),
+]
+
+def load_collection():
+    """Read every chunk with its stored embedding"""
+    vs = VectorStore()
+    vs.initialize_collection()
+    data = vs.collection.get(include=['documents', 'metadatas', 'embeddings'])
+    return vs, data
+
+def build_queries(vs, data, sample, extra_queries):
+    """Default questions plus the opening words of randomly sampled chunks"""
+    queries = list(extra_queries or DEFAULT_QUERIES)
+    rng = random.Random(0)
+    documents = data['documents']
+    for content in rng.sample(documents, min(sample, len(documents))):
+        queries.append(" ".join(content.split()[:12]))
+    return queries, vs.embed_queries(queries)
+
+def run_variant(data, query_embeddings, k, dtype, quantization, rescore_factor, directory):
+    index = DenseIndex(
+        os.path.join(directory, f"{dtype}_{quantization}_{rescore_factor}"),
+        dtype=dtype,
+        quantization=quantization,
+        rescore_factor=rescore_factor
+    )
+    index.add(data['ids'], data['embeddings'], data['documents'], data['metadatas'])
+    # Saving reopens the float matrix memory-mapped, as in the server
+    index.save()
+
+    start = time.perf_counter()
+    results = [index.search([embedding], k=k)[0] for embedding in query_embeddings]
+    elapsed = time.perf_counter() - start
+    return [[doc['id'] for doc in result] for result in results], elapsed, index.memory_usage()
+
+def benchmark(k=8, sample=200, rescore_factor=4, extra_queries=None):
+    print("[*] Loading chunks and embeddings from the vector store...")
+    vs, data = load_collection()
+    if not data['ids']:
+        print("[ERROR] The vector store is empty - ingest documents first")
+        return
+    print(f"[OK] {len(data['ids'])} chunks, {len(data['embeddings'][0])} dimensions")
+
+    queries, query_embeddings = build_queries(vs, data, sample, extra_queries)
+    print(f"[OK] {len(queries)} queries, k={k}, rescore factor={rescore_factor}\n")
+
+    with tempfile.TemporaryDirectory() as directory:
+        truth = None
+        baseline_bytes = None
+        print(f"{'Variant':<24}{'Search memory':>16}{'Reduction':>12}{'Recall@k':>11}{'ms/query':>11}")
+        print("-" * 74)
+        for label, dtype, quantization, factor in VARIANTS:
+            ids, elapsed, memory = run_variant(
+                data, query_embeddings, k, dtype, quantization, factor or rescore_factor, directory
+            )
+            if truth is None:
+                truth, baseline_bytes = ids, memory['search_bytes']
+            recall = sum(
+                len(set(found) & set(expected)) / len(expected)
+                for found, expected in zip(ids, truth) if expected
+            ) / len(truth)
+            print(
+                f"{label:<24}{memory['search_bytes'] / 1024:>13,.0f} KB"
+                f"{baseline_bytes / memory['search_bytes']:>11.1f}x"
+                f"{recall:>11.3f}"
+                f"{1000 * elapsed / len(queries):>11.3f}"
+            )
+
+    print("\nSearch memory is what stays in RAM and is scanned per query; with")
+    print("rescoring, only the candidates' float vectors are read from the")
+    print("memory-mapped matrix on disk.")
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark int8/binary embedding quantization")
+    parser.add_argument('--count', '-k', type=int, default=8,
+                        help='Number of chunks to retrieve (default: 8)')
+    parser.add_argument('--sample', '-s', type=int, default=200,
+                        help='Chunks sampled as extra queries (default: 200)')
+    parser.add_argument('--rescore-factor', '-r', type=int, default=4,
+                        help='Candidates rescored per result (default: 4)')
+    parser.add_argument('--query', '-q', action='append',
+                        help='Query to include (repeatable; replaces the default questions)')
+
+    args = parser.parse_args()
+    benchmark(args.count, args.sample, args.rescore_factor, args.query)
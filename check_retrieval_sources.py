@@ -12,15 +12,25 @@ from src.rag_system.retrieval.vector_store import VectorStore
 
 def check_query_sources(query, k=8):
     """See which source documents are retrieved for a query"""
-    print(f"\n{'='*80}")
-    print(f"QUERY: {query}")
-    print(f"{'='*80}\n")
+    check_queries_sources([query], k)
 
+def check_queries_sources(queries, k=8):
+    """Retrieve for several queries in one batched search, then report each"""
     vs = VectorStore()
     vs.initialize_collection()
 
-    # Search
-    results = vs.similarity_search(query, k=k)
+    # One embedding pass and one vector store query for all questions
+    all_results = vs.similarity_search_batch(queries, k=k)
+
+    for query, results in zip(queries, all_results):
+        show_query_sources(query, results)
+        print("\n")
+
+def show_query_sources(query, results):
+    """Print the source breakdown for one query's retrieved chunks"""
+    print(f"\n{'='*80}")
+    print(f"QUERY: {query}")
+    print(f"{'='*80}\n")
 
     print(f"Retrieved {len(results)} chunks:\n")
 
@@ -129,8 +139,6 @@ if __name__ == "__main__":
                 "room capacity calculation"
             ]
             print("Testing default queries...\n")
-            for q in queries:
-                check_query_sources(q, args.count)
-                print("\n")
+            check_queries_sources(queries, args.count)
         else:
             check_query_sources(args.query, args.count)
@@ -1,11 +1,15 @@
 import datetime
 import os
 import psutil
-import torch
 import traceback
 import atexit
 import signal
 import sys
+import threading
+
+def _loaded_torch():
+    """torch if something already imported it, else None (GPU memory is then zero anyway)."""
+    return sys.modules.get("torch")
 
 class CrashMonitor:
     def __init__(self):
@@ -18,7 +22,10 @@ class CrashMonitor:
         # Register cleanup on normal exit
         atexit.register(self.log_normal_exit)
         
-        # Register signal handlers for crashes
+        # Register signal handlers for crashes (only possible on the main
+        # thread; background startup loaders skip this)
+        if threading.current_thread() is not threading.main_thread():
+            return
         signal.signal(signal.SIGTERM, self.signal_handler)
         signal.signal(signal.SIGINT, self.signal_handler)
         if hasattr(signal, 'SIGBREAK'):  # Windows
@@ -35,6 +42,7 @@ class CrashMonitor:
             f.write(f"Python: {sys.version}\n")
             f.write(f"RAM: {psutil.virtual_memory().total / (1024**3):.1f}GB\n")
             
+            import torch
             if torch.cuda.is_available():
                 f.write(f"GPU: {torch.cuda.get_device_name(0)}\n")
                 f.write(f"GPU Memory: {torch.cuda.get_device_properties(0).total_memory / (1024**3):.1f}GB\n")
@@ -50,7 +58,8 @@ class CrashMonitor:
             
             f.write(f"[{elapsed:6.1f}s] {step_name} | RAM: {ram_percent:.1f}%")
             
-            if torch.cuda.is_available():
+            torch = _loaded_torch()
+            if torch is not None and torch.cuda.is_available():
                 try:
                     gpu_mem = torch.cuda.memory_allocated() / (1024**3)
                     f.write(f" | GPU: {gpu_mem:.1f}GB")
@@ -66,7 +75,8 @@ class CrashMonitor:
             f.write(f"Reason: {reason}\n")
             f.write(f"RAM usage: {psutil.virtual_memory().percent:.1f}%\n")
             
-            if torch.cuda.is_available():
+            torch = _loaded_torch()
+            if torch is not None and torch.cuda.is_available():
                 try:
                     f.write(f"GPU memory: {torch.cuda.memory_allocated() / (1024**3):.1f}GB\n")
                 except:
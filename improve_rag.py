@@ -40,7 +40,8 @@ def reingest_with_better_chunks(chunk_size=1500, overlap=300):
 
     documents = document_processor.process_directory(
         str(input_path),
-        chunk_size=chunk_size
+        chunk_size=chunk_size,
+        overlap=overlap
     )
 
     print(f"[*] Found {len(documents)} chunks (was 291 with size 800)")
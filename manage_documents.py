@@ -9,6 +9,7 @@ sys.path.insert(0, os.path.join(os.getcwd(), 'src'))
 
 from src.rag_system.generation.rag_pipeline import RAGPipeline
 from src.rag_system.utils.document_processor import DocumentProcessor
+from src.rag_system.utils.incremental_ingest import incremental_ingest
 from pathlib import Path
 
 def clear_vectorstore():
@@ -29,17 +30,17 @@ def clear_vectorstore():
     rag.vector_store.initialize_collection()
     print("[OK] New empty collection created")
 
-def ingest_documents(input_path, chunk_size=1500):
+def ingest_documents(input_path, chunk_size=1500, workers=None, chunk_unit=None):
     """Ingest documents from a specific directory"""
     print("\n" + "="*80)
     print(f"INGESTING DOCUMENTS")
     print(f"Source: {input_path}")
-    print(f"Chunk size: {chunk_size}")
+    doc_processor = DocumentProcessor(chunk_unit=chunk_unit)
+    print(f"Chunk size: {chunk_size} {doc_processor.chunk_unit}")
     print("="*80)
 
     # Initialize
     rag = RAGPipeline()
-    doc_processor = DocumentProcessor()
 
     # Initialize vector store (doesn't delete existing)
     rag.vector_store.initialize_collection()
@@ -57,43 +58,26 @@ def ingest_documents(input_path, chunk_size=1500):
 
     print(f"\n[DIR] Processing documents from: {input_path}")
 
-    documents = doc_processor.process_directory(
+    # Only new or changed files are re-chunked; stale chunks are removed
+    stats = incremental_ingest(
         str(input_path),
-        chunk_size=chunk_size
+        rag.vector_store,
+        doc_processor,
+        chunk_size=chunk_size,
+        workers=workers,
+        verbose=True
     )
 
-    if not documents:
-        print("\n[WARNING]  No documents found to process")
-        return
-
-    print(f"[FILE] Found {len(documents)} new chunks to add")
-
-    # Show what files were found
-    sources = {}
-    for doc in documents:
-        source = doc['metadata']['source']
-        if source not in sources:
-            sources[source] = 0
-        sources[source] += 1
-
-    print(f"\n[DOCS] Files to be added:")
-    for source, count in sources.items():
-        print(f"   - {source}: {count} chunks")
-
-    # Add to vector store
-    texts = [doc['content'] for doc in documents]
-    metadatas = [doc['metadata'] for doc in documents]
-    ids = [f"{doc['metadata']['source']}_{doc['metadata']['chunk_id']}" for doc in documents]
-
-    print(f"\n[SAVE] Adding {len(documents)} chunks to vector store...")
-    rag.add_documents(texts, metadatas, ids)
+    print(f"\n[DOCS] Files: {stats['added']} added, {stats['updated']} updated, "
+          f"{stats['unchanged']} unchanged, {stats['removed']} removed, {stats['failed']} failed")
 
     # Get new count
     new_count = rag.vector_store.collection.count()
     print(f"\n[OK] Success!")
-    print(f"   Before: {current_count} chunks")
-    print(f"   Added:  {len(documents)} chunks")
-    print(f"   Total:  {new_count} chunks")
+    print(f"   Before:  {current_count} chunks")
+    print(f"   Written: {stats['chunks_written']} chunks")
+    print(f"   Deleted: {stats['chunks_deleted']} stale chunks")
+    print(f"   Total:   {new_count} chunks")
 
 def show_current_documents():
     """Show what documents are currently in the vector store"""
@@ -135,6 +119,14 @@ if __name__ == "__main__":
                        type=int,
                        default=1500,
                        help='Chunk size (default: 1500)')
+    parser.add_argument('--workers', '-w',
+                       type=int,
+                       default=None,
+                       help='Parallel parsing processes (default: INGEST_WORKERS or 1)')
+    parser.add_argument('--chunk-unit',
+                       choices=['chars', 'tokens'],
+                       default=None,
+                       help='Measure chunk size in characters or tokens (default: CHUNK_UNIT or chars)')
 
     args = parser.parse_args()
 
@@ -150,7 +142,7 @@ if __name__ == "__main__":
             print("[ERROR] Error: --input required for add action")
             print("Example: python manage_documents.py add --input data/new_docs")
         else:
-            ingest_documents(args.input, args.chunk_size)
+            ingest_documents(args.input, args.chunk_size, args.workers, args.chunk_unit)
 
     elif args.action == 'show':
         show_current_documents()
@@ -163,6 +155,6 @@ if __name__ == "__main__":
             confirm = input("[WARNING] This will DELETE all existing documents and replace with new ones. Continue? (yes/no): ")
             if confirm.lower() == 'yes':
                 clear_vectorstore()
-                ingest_documents(args.input, args.chunk_size)
+                ingest_documents(args.input, args.chunk_size, args.workers, args.chunk_unit)
             else:
                 print("[ERROR] Cancelled")
@@ -1,9 +1,14 @@
-from fastapi import FastAPI, HTTPException
+import asyncio
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 import uvicorn
 from rag_system.generation.rag_pipeline import RAGPipeline
+from rag_system.models.errors import QueueFullError
+from rag_system.utils.disconnect import ClientDisconnected, cancel_on_disconnect
 from rag_system.utils.document_processor import DocumentProcessor
+from rag_system.utils.sse import format_sse, stream_answer_events
 
 app = FastAPI(title="RAG System API", version="1.0.0")
 
@@ -13,6 +18,9 @@ document_processor = DocumentProcessor()
 class QueryRequest(BaseModel):
     question: str
     k: Optional[int] = 5
+    # Chroma-style metadata filter, e.g. {"file_type": ".pdf"} or
+    # {"source": {"$in": ["data/documents/a.pdf", "data/documents/b.pdf"]}}
+    where: Optional[Dict[str, Any]] = None
 
 class QueryResponse(BaseModel):
     answer: str
@@ -22,42 +30,113 @@ class DocumentUpload(BaseModel):
     content: str
     metadata: Optional[dict] = None
 
-@app.on_event("startup")
-async def startup_event():
+def load_rag_pipeline():
     try:
         rag_pipeline.initialize()
         print("RAG pipeline initialized successfully")
     except Exception as e:
         print(f"Failed to initialize RAG pipeline: {e}")
-        raise
+
+@app.on_event("startup")
+async def startup_event():
+    # Load in the background; /status reports progress and /query answers 503 until ready
+    asyncio.get_running_loop().run_in_executor(None, load_rag_pipeline)
+
+def not_ready_error() -> HTTPException:
+    return HTTPException(status_code=503, detail="RAG pipeline is still loading", headers={"Retry-After": "10"})
 
 @app.get("/")
 async def root():
     return {"message": "RAG System API is running"}
 
+def busy_error(e: QueueFullError) -> HTTPException:
+    return HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "5"})
+
 @app.post("/query", response_model=QueryResponse)
-async def query_documents(request: QueryRequest):
+async def query_documents(request: QueryRequest, http_request: Request):
+    if not rag_pipeline.model_loaded:
+        raise not_ready_error()
     try:
-        result = rag_pipeline.query(request.question, k=request.k)
+        result = await cancel_on_disconnect(
+            http_request, rag_pipeline.aquery(request.question, k=request.k, where=request.where)
+        )
         return QueryResponse(
             answer=result["answer"],
             sources=result["sources"]
         )
+    except ClientDisconnected:
+        # Nobody is listening any more; the generation was cancelled
+        return Response(status_code=499)
+    except QueueFullError as e:
+        raise busy_error(e)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Timed out waiting for the answer")
+    except ValueError as e:
+        # Malformed metadata filter
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/query/stream")
+async def query_documents_stream(request: QueryRequest):
+    """Stream the answer as server-sent events (sources, tokens, done)."""
+    if not rag_pipeline.model_loaded:
+        raise not_ready_error()
+    # Retrieve and queue up front so a full queue is a 429, not a broken stream
+    try:
+        result = await asyncio.to_thread(
+            rag_pipeline.query_stream, request.question, k=request.k, where=request.where
+        )
+    except QueueFullError as e:
+        raise busy_error(e)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    def event_stream():
+        try:
+            for event in stream_answer_events(result):
+                yield format_sse(event)
+        except Exception as e:
+            yield format_sse({"type": "error", "detail": str(e)})
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
 @app.post("/add_document")
 async def add_document(document: DocumentUpload):
+    if not rag_pipeline.model_loaded:
+        raise not_ready_error()
     try:
         chunks = document_processor.chunk_text(document.content)
         metadatas = [document.metadata or {} for _ in chunks]
         ids = [f"{document.metadata.get('source', 'unknown')}_{i}" for i in range(len(chunks))]
         
-        rag_pipeline.add_documents(chunks, metadatas, ids)
+        await asyncio.to_thread(rag_pipeline.add_documents, chunks, metadatas, ids)
         return {"message": f"Added {len(chunks)} chunks to the vector store"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/cache_stats")
+async def cache_stats():
+    """Hit/miss counters for the exact and semantic answer caches."""
+    return rag_pipeline.cache_stats()
+
+@app.get("/queue_stats")
+async def queue_stats():
+    """Requests currently being decoded and waiting for a slot."""
+    return rag_pipeline.queue_stats()
+
+@app.get("/generation_stats")
+async def generation_stats():
+    """Draft-token acceptance rate and tokens per main-model forward pass."""
+    return rag_pipeline.generation_stats()
+
+@app.get("/status")
+async def status():
+    """Startup progress: overall status plus each loading stage."""
+    return rag_pipeline.readiness()
+
 @app.get("/health")
 async def health_check():
     return {"status": "healthy"}
@@ -0,0 +1,126 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Dict, List, Optional
+
+
+class AnswerCache:
+    """
+    LRU + TTL cache of generated answers, optionally persisted to SQLite.
+
+    Keys are built by make_key() from everything that determines the prompt and
+    the decode: normalized question, k, the retrieved chunks (IDs and content
+    hashes), the model name and the generation parameters. A change in what
+    retrieval returns therefore never serves a stale answer.
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl_seconds: float = 86400, persist_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.persist_path = persist_path
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = Lock()
+        self._conn = None
+        self.hits = 0
+        self.misses = 0
+
+        if persist_path:
+            os.makedirs(os.path.dirname(os.path.abspath(persist_path)), exist_ok=True)
+            self._conn = sqlite3.connect(persist_path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS answers ("
+                " key TEXT PRIMARY KEY, created REAL NOT NULL, value TEXT NOT NULL)"
+            )
+            self._conn.commit()
+            self._load()
+
+    @staticmethod
+    def normalize_question(question: str) -> str:
+        return " ".join(question.lower().split()).rstrip("?!. ")
+
+    @staticmethod
+    def make_key(
+        question: str,
+        k: int,
+        retrieved_docs: List[Dict[str, Any]],
+        model_name: str,
+        generation_params: Dict[str, Any]
+    ) -> str:
+        chunks = [
+            [doc.get('id'), hashlib.sha256(doc.get('content', '').encode('utf-8')).hexdigest()]
+            for doc in retrieved_docs
+        ]
+        payload = json.dumps({
+            'question': AnswerCache.normalize_question(question),
+            'k': k,
+            'chunks': chunks,
+            'model': model_name,
+            'params': generation_params
+        }, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry[0]):
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: str, value: Dict[str, Any]):
+        created = time.time()
+        with self._lock:
+            self._entries[key] = (created, value)
+            self._entries.move_to_end(key)
+            if self._conn is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO answers (key, created, value) VALUES (?, ?, ?)",
+                    (key, created, json.dumps(value))
+                )
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+            if self._conn is not None:
+                self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM answers")
+                self._conn.commit()
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+    def _expired(self, created: float) -> bool:
+        return self.ttl_seconds > 0 and time.time() - created > self.ttl_seconds
+
+    def _remove(self, key: str):
+        self._entries.pop(key, None)
+        if self._conn is not None:
+            self._conn.execute("DELETE FROM answers WHERE key = ?", (key,))
+
+    def _load(self):
+        rows = self._conn.execute(
+            "SELECT key, created, value FROM answers ORDER BY created DESC LIMIT ?",
+            (self.max_entries,)
+        ).fetchall()
+        # Oldest first so the most recent entries end up at the LRU tail
+        for key, created, value in reversed(rows):
+            if not self._expired(created):
+                self._entries[key] = (created, json.loads(value))
+        self._conn.execute(
+            "DELETE FROM answers WHERE key NOT IN (SELECT key FROM answers ORDER BY created DESC LIMIT ?)",
+            (self.max_entries,)
+        )
+        self._conn.commit()
@@ -0,0 +1,119 @@
+import os
+from typing import Any, Callable, Dict, List, Optional
+
+from .session_store import format_history
+
+
+class ContextBudget:
+    """
+    Fits a RAG prompt into a token budget.
+
+    The fixed parts (system header, instructions, question) are always kept.
+    Earlier conversation turns may use up to history_share of what remains,
+    newest turns first, with the oldest dropped in blocks. Retrieved chunks fill the rest from the highest score
+    down; the first chunk that does not fit is truncated if at least
+    min_chunk_tokens are left, and everything after it is dropped.
+    """
+
+    def __init__(
+        self,
+        count_tokens: Callable[[str], int],
+        history_share: Optional[float] = None,
+        min_chunk_tokens: Optional[int] = None
+    ):
+        self.count_tokens = count_tokens
+        self.history_share = history_share if history_share is not None else float(os.getenv("HISTORY_TOKEN_SHARE", "0.3"))
+        self.min_chunk_tokens = min_chunk_tokens or int(os.getenv("MIN_CHUNK_TOKENS", "64"))
+
+    def fit(
+        self,
+        max_tokens: int,
+        fixed_text: str,
+        history: List[Dict[str, Any]],
+        docs: List[Dict[str, Any]],
+        format_doc: Callable[[int, Dict[str, Any]], str]
+    ) -> Dict[str, Any]:
+        """
+        Choose the history turns and chunks that fit in max_tokens.
+
+        Args:
+            max_tokens: Token budget for the whole prompt
+            fixed_text: The prompt without history and context
+            history: Earlier turns, oldest first
+            docs: Retrieved chunks (dicts with 'id', 'content' and 'score')
+            format_doc: Renders chunk i (1-based) the way it appears in the prompt
+
+        Returns:
+            {"history": kept turns, "docs": kept chunks (the last one possibly
+            with truncated content), "report": token counts and what was cut}
+        """
+        fixed_tokens = self.count_tokens(fixed_text)
+        remaining = max(max_tokens - fixed_tokens, 0)
+
+        # Newest turns matter most for a follow-up question. Replaying the
+        # conversation turn by turn, the history is cut only when it outgrows
+        # its budget, and then down to half of it (like SessionStore), so the
+        # kept turns (and the session prefix whose KV is reused) stay the same
+        # for the next several turns instead of sliding by one every request.
+        history_budget = int(remaining * self.history_share)
+        turn_tokens = [self.count_tokens(format_history([turn])) for turn in history]
+        start, history_tokens = 0, 0
+        for end, tokens in enumerate(turn_tokens):
+            history_tokens += tokens
+            if history_tokens > history_budget:
+                while start <= end and history_tokens > history_budget // 2:
+                    history_tokens -= turn_tokens[start]
+                    start += 1
+        kept_history = history[start:]
+        remaining -= history_tokens
+
+        kept_docs, dropped, truncated = [], [], []
+        context_tokens = 0
+        separator_tokens = self.count_tokens("\n\n")
+        for doc in sorted(docs, key=lambda d: d.get('score', 0.0), reverse=True):
+            if dropped:
+                dropped.append(doc.get('id'))
+                continue
+            tokens = self.count_tokens(format_doc(len(kept_docs) + 1, doc)) + separator_tokens
+            if context_tokens + tokens <= remaining:
+                kept_docs.append(doc)
+                context_tokens += tokens
+                continue
+
+            available = remaining - context_tokens - separator_tokens
+            header_tokens = self.count_tokens(format_doc(len(kept_docs) + 1, {**doc, 'content': ''}))
+            if available - header_tokens >= self.min_chunk_tokens:
+                content = self._truncate(doc.get('content', ''), available - header_tokens)
+                kept_docs.append({**doc, 'content': content})
+                context_tokens += header_tokens + self.count_tokens(content) + separator_tokens
+                truncated.append(doc.get('id'))
+            else:
+                dropped.append(doc.get('id'))
+
+        return {
+            "history": kept_history,
+            "docs": kept_docs,
+            "report": {
+                "budget_tokens": max_tokens,
+                "fixed_tokens": fixed_tokens,
+                "history_tokens": history_tokens,
+                "context_tokens": context_tokens,
+                "dropped_turns": len(history) - len(kept_history),
+                "dropped_chunks": dropped,
+                "truncated_chunks": truncated
+            }
+        }
+
+    def _truncate(self, text: str, max_tokens: int) -> str:
+        """Longest prefix of text (cut at whitespace) within max_tokens, by binary search."""
+        low, high = 0, len(text)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.count_tokens(text[:middle] + " ...") <= max_tokens:
+                low = middle
+            else:
+                high = middle - 1
+        cut = text[:low]
+        if low < len(text) and ' ' in cut:
+            cut = cut[:cut.rindex(' ')]
+        return cut.rstrip() + " ..."
@@ -1,43 +1,30 @@
-from typing import List, Dict, Any, Optional
-from ..models.llama import LlamaModel
+from typing import List, Dict, Any, Callable, Iterator, Optional, Union
+from .answer_cache import AnswerCache
+from .context_budget import ContextBudget
+from .semantic_cache import SemanticCache
+from .session_store import format_history
+from ..models.errors import QueueFullError
+from ..retrieval.chunk_merger import ChunkMerger
+from ..retrieval.reranker import CrossEncoderReranker
 from ..retrieval.vector_store import VectorStore
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from threading import BoundedSemaphore, Event, Lock
+import asyncio
 import os
+import queue
+import time
 from dotenv import load_dotenv
 
 load_dotenv()
 
-class RAGPipeline:
-    def __init__(self, model_name: Optional[str] = None, quantization: Optional[str] = None):
-        """
-        Initialize RAG pipeline.
+# Marks the end of a stream_generation() delta queue
+_STREAM_END = object()
 
-        Args:
-            model_name: Model identifier (defaults to MODEL_NAME in .env)
-            quantization: Quantization type - "4bit", "8bit", or "none" (defaults to QUANTIZATION in .env)
-        """
-        quant = quantization or os.getenv("QUANTIZATION", "4bit")
-        self.llama_model = LlamaModel(model_name, quantization=quant)
-        self.vector_store = VectorStore()
-        self.max_tokens = int(os.getenv("MAX_TOKENS", "512"))
-        self.temperature = float(os.getenv("TEMPERATURE", "0.7"))
-        self.model_loaded = False
-        
-    def initialize(self):
-        self.llama_model.load_model()
-        self.vector_store.initialize_collection()
-        self.model_loaded = True
-        
-    def format_context(self, retrieved_docs: List[Dict[str, Any]]) -> str:
-        context_parts = []
-        for i, doc in enumerate(retrieved_docs, 1):
-            source = doc.get('metadata', {}).get('source', 'Unknown')
-            content = doc.get('content', '')
-            context_parts.append(f"[Document {i} - Source: {source}]\n{content}")
-        
-        return "\n\n".join(context_parts)
-    
-    def create_prompt(self, query: str, context: str) -> str:
-        prompt_template = """<|begin_of_text|><|start_header_id|>system<|end_header_id|>
+NO_CONTEXT_ANSWER = "I don't have any relevant information to answer your question."
+
+# Constant system header shared by every RAG prompt; its KV cache is
+# precomputed once so each request only prefills the part after it.
+SYSTEM_PROMPT_PREFIX = """<|begin_of_text|><|start_header_id|>system<|end_header_id|>
 
 You are a specialized HVAC dehumidification engineer providing consultation. Be interactive and helpful.
 
@@ -58,7 +45,9 @@ RESPONSE FORMAT when information is missing:
 
 <|eot_id|><|start_header_id|>user<|end_header_id|>
 
-Technical Documentation Context:
+"""
+
+USER_PROMPT_TEMPLATE = """Technical Documentation Context:
 {context}
 
 User Question: {query}
@@ -68,40 +57,613 @@ Instructions: Answer using ONLY the documentation formulas. If you need addition
 <|eot_id|><|start_header_id|>assistant<|end_header_id|>
 
 """
-        return prompt_template.format(context=context, query=query)
+
+class RAGPipeline:
+    def __init__(self, model_name: Optional[str] = None, quantization: Optional[str] = None):
+        """
+        Initialize RAG pipeline.
+
+        Args:
+            model_name: Model identifier (defaults to MODEL_NAME in .env)
+            quantization: Quantization type - "4bit", "8bit", or "none" (defaults to QUANTIZATION in .env)
+        """
+        self.model_name = model_name
+        self.quantization = quantization or os.getenv("QUANTIZATION", "4bit")
+        # Created by initialize(); torch/transformers are not imported before that
+        self.llama_model = None
+        self.vector_store = VectorStore()
+        self.max_tokens = int(os.getenv("MAX_TOKENS", "512"))
+        self.temperature = float(os.getenv("TEMPERATURE", "0.7"))
+        # Prompt token budget (0 = unlimited); also capped by the model's window
+        self.prompt_token_budget = int(os.getenv("PROMPT_TOKEN_BUDGET", "4096"))
+        self.context_budget = ContextBudget(count_tokens=lambda text: self.llama_model.count_tokens(text))
+        self.use_scheduler = os.getenv("BATCH_SCHEDULER", "true").lower() == "true"
+        self.scheduler = None
+        # Seconds a request may wait for its answer (0 = no limit)
+        self.request_timeout = float(os.getenv("REQUEST_TIMEOUT", "300")) or None
+        # Without the scheduler, generation runs on one dedicated worker thread
+        # with at most MAX_QUEUE_SIZE requests waiting
+        self.max_queue_size = int(os.getenv("MAX_QUEUE_SIZE", "32"))
+        self._generation_worker = None
+        self._generation_slots = BoundedSemaphore(self.max_queue_size + 1)
+        self._generation_lock = Lock()
+        self.generation_ready = False
+        self.answer_cache = None
+        if os.getenv("ANSWER_CACHE", "true").lower() == "true":
+            self.answer_cache = AnswerCache(
+                max_entries=int(os.getenv("ANSWER_CACHE_SIZE", "1000")),
+                ttl_seconds=float(os.getenv("ANSWER_CACHE_TTL", "86400")),
+                persist_path=os.getenv("ANSWER_CACHE_PATH") or None
+            )
+        self.semantic_cache = None
+        if os.getenv("SEMANTIC_CACHE", "true").lower() == "true":
+            self.semantic_cache = SemanticCache(
+                threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95")),
+                max_entries=int(os.getenv("SEMANTIC_CACHE_SIZE", "1000"))
+            )
+        # Merge overlapping neighbours and drop near-duplicates among the top-k
+        self.chunk_merger = None
+        if os.getenv("CHUNK_MERGE", "true").lower() == "true":
+            self.chunk_merger = ChunkMerger(
+                text_threshold=float(os.getenv("DEDUP_TEXT_THRESHOLD", "0.85")),
+                embedding_threshold=float(os.getenv("DEDUP_EMBEDDING_THRESHOLD", "0.97"))
+            )
+        # Over-fetch RERANK_CANDIDATES chunks and keep the k best by cross-encoder score
+        self.reranker = None
+        if os.getenv("RERANK", "true").lower() == "true":
+            self.reranker = CrossEncoderReranker(
+                model_name=os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2"),
+                batch_size=int(os.getenv("RERANK_BATCH_SIZE", "32")),
+                cache_size=int(os.getenv("RERANK_CACHE_SIZE", "10000"))
+            )
+        self.rerank_candidates = int(os.getenv("RERANK_CANDIDATES", "20"))
+        # Chunks the chat UIs put into the prompt; reranked chunks are precise enough for fewer
+        self.default_k = int(os.getenv("RAG_TOP_K", "4" if self.reranker is not None else "8"))
+        self._cache_revision = self.vector_store.revision
+        self.model_loaded = False
+        # Readiness of each startup stage: pending, loading, ready or failed
+        stage_names = ("llm", "embedding_model", "vector_store") + (("reranker",) if self.reranker else ())
+        self.stages = {name: {"state": "pending"} for name in stage_names}
+        self._init_lock = Lock()
+        
+    def initialize(self):
+        """
+        Load the LLM, the embedding model, the Chroma collection and the
+        reranker concurrently.
+
+        Safe to call from several threads: later callers wait for the first
+        and return once the pipeline is ready. Progress is reported in
+        self.stages; the first stage failure is re-raised, except for the
+        reranker, without which retrieval still works.
+        """
+        with self._init_lock:
+            if self.model_loaded:
+                return
+
+            with ThreadPoolExecutor(max_workers=len(self.stages), thread_name_prefix="startup") as pool:
+                futures = [
+                    pool.submit(self.initialize_generation),
+                    pool.submit(self._run_stage, "embedding_model", self.vector_store.load_embedding_model),
+                    pool.submit(self._run_stage, "vector_store", self.vector_store.prepare_search)
+                ]
+                if self.reranker is not None:
+                    futures.append(pool.submit(self._load_reranker))
+            for future in futures:
+                future.result()
+            self.model_loaded = True
+
+    def initialize_generation(self):
+        """
+        Load only the LLM and start the generation scheduler (or worker).
+
+        Enough for plain chat without retrieval (submit_generation() and
+        friends); initialize() calls it as its "llm" stage.
+        """
+        with self._generation_lock:
+            if self.generation_ready:
+                return
+            if self.llama_model is None:
+                self._run_stage("llm", self._load_llm)
+
+            # Continuous batching needs the transformers backend and no draft model
+            if self.use_scheduler and self.llama_model.supports_batching:
+                from ..models.scheduler import GenerationScheduler
+                self.scheduler = GenerationScheduler(self.llama_model, max_queue_size=self.max_queue_size)
+                self.scheduler.start()
+            else:
+                self._generation_worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="generation")
+            self.generation_ready = True
+
+    def _load_llm(self):
+        # Shared with any other user of the same model in this process
+        from ..models.registry import get_model
+        llama_model = get_model(self.model_name, self.quantization)
+        llama_model.register_prefix(SYSTEM_PROMPT_PREFIX)
+        self.llama_model = llama_model
+
+    def _load_reranker(self):
+        try:
+            self._run_stage("reranker", self.reranker.load_model)
+        except Exception as e:
+            # E.g. offline with no cached model: retrieve without reranking
+            print(f"Warning: Could not load reranker, continuing without it: {e}")
+            self.reranker = None
+            self.default_k = int(os.getenv("RAG_TOP_K", "8"))
+
+    def _run_stage(self, name: str, load):
+        stage = self.stages[name]
+        stage.update(state="loading", error=None)
+        start = time.perf_counter()
+        try:
+            load()
+        except Exception as e:
+            stage.update(state="failed", error=str(e))
+            raise
+        finally:
+            stage["seconds"] = round(time.perf_counter() - start, 2)
+        stage["state"] = "ready"
+
+    def readiness(self) -> Dict[str, Any]:
+        """Overall status plus per-stage state and load time, for /status endpoints."""
+        states = [stage["state"] for stage in self.stages.values()]
+        if self.model_loaded:
+            status = "ready"
+        elif "failed" in states:
+            status = "failed"
+        elif "loading" in states:
+            status = "loading"
+        else:
+            status = "pending"
+        return {"status": status, "stages": {name: dict(stage) for name, stage in self.stages.items()}}
+        
+    def format_context(self, retrieved_docs: List[Dict[str, Any]]) -> str:
+        context_parts = []
+        for i, doc in enumerate(retrieved_docs, 1):
+            context_parts.append(self.format_document(i, doc))
+        
+        return "\n\n".join(context_parts)
+
+    @staticmethod
+    def format_document(i: int, doc: Dict[str, Any]) -> str:
+        source = doc.get('metadata', {}).get('source', 'Unknown')
+        content = doc.get('content', '')
+        return f"[Document {i} - Source: {source}]\n{content}"
+
+    def prompt_token_limit(self) -> Optional[int]:
+        """Tokens the prompt may use: PROMPT_TOKEN_BUDGET, within the model's window minus the answer."""
+        limits = [self.prompt_token_budget] if self.prompt_token_budget > 0 else []
+        window = self.llama_model.context_window()
+        if window:
+            limits.append(window - self.max_tokens)
+        return min(limits) if limits else None
+
+    def fit_context(
+        self,
+        question: str,
+        history: Optional[List[Dict[str, Any]]],
+        retrieved_docs: List[Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        """
+        Trim history and retrieved chunks to the prompt token budget
+        (lowest-scoring chunks are truncated or dropped first).
+        """
+        limit = self.prompt_token_limit()
+        if limit is None:
+            return {"history": history or [], "docs": retrieved_docs, "report": None}
+        fixed_text = SYSTEM_PROMPT_PREFIX + USER_PROMPT_TEMPLATE.format(context="", query=question)
+        return self.context_budget.fit(limit, fixed_text, history or [], retrieved_docs, self.format_document)
+    
+    def create_prompt(self, query: str, context: str, history: Optional[List[Dict[str, Any]]] = None) -> str:
+        return self.session_prefix(history) + USER_PROMPT_TEMPLATE.format(context=context, query=query)
+
+    @staticmethod
+    def session_prefix(history: Optional[List[Dict[str, Any]]] = None) -> str:
+        """The prompt up to the current turn: system header plus earlier turns."""
+        return SYSTEM_PROMPT_PREFIX + format_history(history or [])
     
-    def query(self, question: str, k: int = 8) -> Dict[str, Any]:
+    def plan_query(
+        self,
+        question: str,
+        k: int = 8,
+        history: Optional[List[Dict[str, Any]]] = None,
+        where: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """
+        Everything that happens before generation: semantic cache lookup,
+        retrieval, exact answer cache lookup and prompt construction.
+
+        Returns {"result": ...} when the answer is already known (no context
+        found or a cache hit); otherwise the prompt plus what is needed to
+        build and cache the final result.
+
+        With history (earlier turns of a conversation) or a metadata filter,
+        the answer depends on more than the question, so both answer caches
+        are bypassed.
+        """
         if not self.model_loaded:
             raise RuntimeError("Pipeline not initialized. Call initialize() first.")
-        
-        retrieved_docs = self.vector_store.similarity_search(question, k=k)
-        
+
+        self._sync_caches()
+
+        # Embed once: the same vector drives the semantic cache and retrieval
+        query_embedding = self.vector_store.embed_query(question)
+
+        cacheable = not history and not where
+
+        if cacheable and self.semantic_cache is not None:
+            cached = self.semantic_cache.lookup(question, query_embedding, k)
+            if cached is not None:
+                return {"result": {**cached, "cached": True}}
+
+        retrieved_docs = self.retrieve(question, k, query_embedding, where)
+
         if not retrieved_docs:
-            return {
-                "answer": "I don't have any relevant information to answer your question.",
+            return {"result": {
+                "answer": NO_CONTEXT_ANSWER,
                 "sources": [],
                 "retrieved_docs": []
-            }
-        
-        context = self.format_context(retrieved_docs)
-        prompt = self.create_prompt(question, context)
-        
-        answer = self.llama_model.generate_response(
+            }}
+
+        cache_key = self.answer_cache_key(question, k, retrieved_docs) if cacheable else None
+        cached = self.answer_cache.get(cache_key) if cache_key else None
+        if cached is not None:
+            return {"result": {
+                "answer": cached["answer"],
+                "sources": cached["sources"],
+                "retrieved_docs": retrieved_docs,
+                "cached": True
+            }}
+
+        fitted = self.fit_context(question, history, retrieved_docs)
+        history = fitted["history"]
+        context = self.format_context(fitted["docs"])
+        return {
+            "question": question,
+            "k": k,
+            "prompt": self.create_prompt(question, context, history),
+            # The retrieved context sits in the current turn, which the next
+            # prompt renders as question and answer only, so the session KV
+            # can only cover the turns before it: worth keeping once there are some
+            "session_prefix": self.session_prefix(history) if history else None,
+            "retrieved_docs": retrieved_docs,
+            # Sources of the chunks that made it into the prompt
+            "sources": self.get_sources(fitted["docs"]),
+            "context_budget": fitted["report"],
+            "query_embedding": query_embedding,
+            "cache_key": cache_key,
+            "cacheable": cacheable
+        }
+
+    def _sync_caches(self):
+        if self.vector_store.revision != self._cache_revision:
+            # The collection was written to; drop answers built on the old contents
+            if self.answer_cache is not None:
+                self.answer_cache.clear()
+            if self.semantic_cache is not None:
+                self.semantic_cache.clear()
+            if self.reranker is not None:
+                self.reranker.clear()
+            self._cache_revision = self.vector_store.revision
+
+    def retrieve(
+        self,
+        question: str,
+        k: int,
+        query_embedding: Optional[List[float]] = None,
+        where: Optional[Dict[str, Any]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Top-k chunks for the question (only those whose metadata matches
+        `where`, if given): overlapping and duplicate chunks are merged away,
+        then (with the reranker) the best k of RERANK_CANDIDATES are kept.
+        """
+        fetch_k = max(self.rerank_candidates, k) if self.reranker is not None else k
+        docs = self.vector_store.similarity_search(
+            question, k=fetch_k, query_embedding=query_embedding,
+            include_embeddings=self.chunk_merger is not None and self.chunk_merger.uses_embeddings,
+            where=where
+        )
+        if self.chunk_merger is not None:
+            docs = self.chunk_merger.process(docs)
+        if self.reranker is not None:
+            docs = self.reranker.rerank(question, docs, top_k=k)
+        return docs
+
+    def answer_cache_key(self, question: str, k: int, retrieved_docs: List[Dict[str, Any]]) -> Optional[str]:
+        if self.answer_cache is None:
+            return None
+        return AnswerCache.make_key(
+            question,
+            k,
+            retrieved_docs,
+            self.llama_model.model_name,
+            {"max_tokens": self.max_tokens, "temperature": self.temperature}
+        )
+
+    def _finish(self, plan: Dict[str, Any], answer: str) -> Dict[str, Any]:
+        """Build the result for a freshly generated answer and cache it."""
+        if plan["cache_key"]:
+            self.answer_cache.put(plan["cache_key"], {"answer": answer, "sources": plan["sources"]})
+        if plan["cacheable"] and self.semantic_cache is not None:
+            self.semantic_cache.add(plan["question"], plan["query_embedding"], plan["k"], {
+                "answer": answer,
+                "sources": plan["sources"],
+                "retrieved_docs": plan["retrieved_docs"]
+            })
+        return {
+            "answer": answer,
+            "sources": plan["sources"],
+            "retrieved_docs": plan["retrieved_docs"],
+            "context_budget": plan["context_budget"]
+        }
+
+    def drop_session(self, session_id: str):
+        """Free the KV cache kept for a chat session."""
+        if self.llama_model is not None and self.llama_model.prefix_cache is not None:
+            self.llama_model.prefix_cache.drop_session(session_id)
+
+    def generation_stats(self) -> Dict[str, Any]:
+        """Speculative decoding acceptance metrics (None when it is off)."""
+        return {
+            "speculative": self.llama_model.speculative_stats() if self.llama_model is not None else None
+        }
+
+    def queue_stats(self) -> Dict[str, Any]:
+        if self.scheduler is not None:
+            return self.scheduler.stats()
+        return {"max_queue_size": self.max_queue_size}
+
+    def cache_stats(self) -> Dict[str, Any]:
+        return {
+            "answer_cache": self.answer_cache.stats() if self.answer_cache is not None else None,
+            "semantic_cache": self.semantic_cache.stats() if self.semantic_cache is not None else None,
+            "rerank_cache": self.reranker.stats() if self.reranker is not None else None
+        }
+
+    def submit_generation(
+        self,
+        prompt: str,
+        session_id: Optional[str] = None,
+        session_prefix: Union[str, Callable[[str], str], None] = None,
+        on_text: Optional[Callable[[str], None]] = None,
+        cancelled: Optional[Event] = None
+    ) -> Future:
+        """
+        Queue a prompt for generation and return a future for the answer.
+
+        on_text receives text deltas as they are decoded; setting `cancelled`
+        stops the generation at its next token. Raises QueueFullError when
+        MAX_QUEUE_SIZE requests are already waiting.
+        """
+        if not self.generation_ready:
+            raise RuntimeError("Generation not initialized. Call initialize() first.")
+        if self.scheduler is not None:
+            return self.scheduler.submit(
+                prompt,
+                max_tokens=self.max_tokens,
+                temperature=self.temperature,
+                session_id=session_id,
+                session_prefix=session_prefix,
+                on_text=on_text,
+                cancelled=cancelled
+            )
+
+        self._acquire_generation_slot()
+        future = self._generation_worker.submit(
+            self.llama_model.generate_response,
             prompt=prompt,
             max_tokens=self.max_tokens,
-            temperature=self.temperature
+            temperature=self.temperature,
+            session_id=session_id,
+            session_prefix=session_prefix,
+            on_text=on_text,
+            cancelled=cancelled
         )
+        # Also runs if the job is cancelled before it starts
+        future.add_done_callback(lambda _: self._generation_slots.release())
+        return future
+
+    def _acquire_generation_slot(self):
+        if not self._generation_slots.acquire(blocking=False):
+            raise QueueFullError(f"Generation queue is full ({self.max_queue_size} requests waiting)")
+
+    def generate(self, prompt: str, session_id: Optional[str] = None, session_prefix: Union[str, Callable[[str], str], None] = None) -> str:
+        cancelled = Event()
+        future = self.submit_generation(prompt, session_id, session_prefix, cancelled=cancelled)
+        try:
+            return future.result(timeout=self.request_timeout)
+        except FutureTimeoutError:
+            cancelled.set()
+            raise
+
+    async def agenerate(
+        self,
+        prompt: str,
+        session_id: Optional[str] = None,
+        session_prefix: Union[str, Callable[[str], str], None] = None
+    ) -> str:
+        """
+        Await generation without blocking the event loop.
+
+        Raises QueueFullError when the generation queue is full and
+        asyncio.TimeoutError after REQUEST_TIMEOUT seconds; on a timeout or
+        when the awaiting task is cancelled (e.g. on client disconnect), the
+        generation stops at its next token.
+        """
+        cancelled = Event()
+        future = self.submit_generation(prompt, session_id, session_prefix, cancelled=cancelled)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), self.request_timeout)
+        except (asyncio.CancelledError, asyncio.TimeoutError):
+            cancelled.set()
+            raise
+
+    def stream_generation(
+        self,
+        prompt: str,
+        session_id: Optional[str] = None,
+        session_prefix: Union[str, Callable[[str], str], None] = None
+    ) -> Iterator[str]:
+        """
+        Yield text deltas of a generation as they are decoded.
+
+        The prompt is queued immediately, so QueueFullError is raised here
+        rather than on the first read. Reading raises TimeoutError once the
+        answer has taken REQUEST_TIMEOUT seconds. Closing the iterator, or
+        dropping it, stops the generation at its next token.
+        """
+        deltas: "queue.Queue" = queue.Queue()
+        cancelled = Event()
+        future = self.submit_generation(
+            prompt, session_id, session_prefix, on_text=deltas.put, cancelled=cancelled
+        )
+        future.add_done_callback(lambda _: deltas.put(_STREAM_END))
+        return _GenerationStream(future, deltas, cancelled, self.request_timeout)
+
+    def query(
+        self,
+        question: str,
+        k: int = 8,
+        history: Optional[List[Dict[str, Any]]] = None,
+        session_id: Optional[str] = None,
+        where: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """
+        Answer a question from the document collection.
+
+        Args:
+            question: The user's question
+            k: Number of chunks to retrieve
+            history: Earlier turns of the conversation ({"user": ..., "assistant": ...})
+            session_id: Conversation ID; its KV cache is reused across turns
+            where: Metadata filter for retrieval, e.g. {"file_type": ".pdf"}
+                (Chroma syntax; raises ValueError if malformed)
+        """
+        plan = self.plan_query(question, k, history, where)
+        if "result" in plan:
+            return plan["result"]
         
-        sources = list(set([
-            doc.get('metadata', {}).get('source', 'Unknown') 
-            for doc in retrieved_docs
-        ]))
-        
+        answer = self.generate(plan["prompt"], session_id, plan["session_prefix"])
+        return self._finish(plan, answer)
+
+    async def aquery(
+        self,
+        question: str,
+        k: int = 8,
+        history: Optional[List[Dict[str, Any]]] = None,
+        session_id: Optional[str] = None,
+        where: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """
+        Async query() for FastAPI handlers: retrieval runs in a worker thread
+        and generation is awaited on the generation worker, so the event loop
+        stays free to serve other requests.
+
+        Raises QueueFullError when the generation queue is full and
+        asyncio.TimeoutError after REQUEST_TIMEOUT seconds. Cancelling the
+        awaiting task (e.g. on client disconnect) stops the generation.
+        """
+        plan = await asyncio.to_thread(self.plan_query, question, k, history, where)
+        if "result" in plan:
+            return plan["result"]
+
+        answer = await self.agenerate(plan["prompt"], session_id, plan["session_prefix"])
+        return self._finish(plan, answer)
+
+    def query_stream(
+        self,
+        question: str,
+        k: int = 8,
+        history: Optional[List[Dict[str, Any]]] = None,
+        session_id: Optional[str] = None,
+        where: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """
+        Like query(), but the answer is produced incrementally.
+
+        Retrieval runs and generation is queued eagerly, so sources are
+        available before the first token; "answer_stream" yields text deltas
+        as they are decoded, and closing it stops the generation.
+        """
+        plan = self.plan_query(question, k, history, where)
+        if "result" in plan:
+            result = dict(plan["result"])
+            result["answer_stream"] = iter([result.pop("answer")])
+            return result
+
+        answer_stream = self.stream_generation(plan["prompt"], session_id, plan["session_prefix"])
+
         return {
-            "answer": answer,
-            "sources": sources,
-            "retrieved_docs": retrieved_docs
+            "answer_stream": self._caching_stream(answer_stream, plan),
+            "sources": plan["sources"],
+            "retrieved_docs": plan["retrieved_docs"],
+            "context_budget": plan["context_budget"]
         }
+
+    def _caching_stream(self, answer_stream: Iterator[str], plan: Dict[str, Any]) -> Iterator[str]:
+        """Pass deltas through and cache the answer once the stream completes."""
+        parts = []
+        try:
+            for delta in answer_stream:
+                parts.append(delta)
+                yield delta
+        finally:
+            # Stops the generation right away if the consumer went away
+            answer_stream.close()
+        # Only reached if the consumer read the whole answer
+        self._finish(plan, "".join(parts).strip())
+
+    @staticmethod
+    def get_sources(retrieved_docs: List[Dict[str, Any]]) -> List[str]:
+        return list(set([
+            doc.get('metadata', {}).get('source', 'Unknown')
+            for doc in retrieved_docs
+        ]))
     
     def add_documents(self, texts: List[str], metadatas: List[Dict[str, Any]] = None, ids: List[str] = None):
-        self.vector_store.add_documents(texts, metadatas, ids)
\ No newline at end of file
+        self.vector_store.add_documents(texts, metadatas, ids)
+
+
+class _GenerationStream:
+    """
+    Iterator over the text deltas of a queued generation. Closing it, or
+    dropping it unread, cancels the generation at its next token; so does
+    running past `timeout` seconds, which raises TimeoutError.
+    """
+
+    def __init__(self, future: Future, deltas: "queue.Queue", cancelled: Event, timeout: Optional[float] = None):
+        self._future = future
+        self._deltas = deltas
+        self._cancelled = cancelled
+        self._timeout = timeout
+        self._deadline = time.monotonic() + timeout if timeout else None
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        if self._closed:
+            raise StopIteration
+        try:
+            if self._deadline is None:
+                delta = self._deltas.get()
+            else:
+                delta = self._deltas.get(timeout=max(self._deadline - time.monotonic(), 0))
+        except queue.Empty:
+            self.close()
+            raise TimeoutError(f"No answer within {self._timeout:g} seconds")
+        if delta is _STREAM_END:
+            self.close()
+            # Surface generation errors to the consumer
+            self._future.result()
+            raise StopIteration
+        return delta
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._cancelled.set()
+
+    def __del__(self):
+        self.close()
@@ -0,0 +1,88 @@
+import re
+from threading import Lock
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+_NUMBER = re.compile(r'\d+(?:[.,]\d+)?')
+
+
+class SemanticCache:
+    """
+    Answer cache matched by query-embedding similarity instead of exact text.
+
+    A lookup returns the stored answer of the most similar previously answered
+    question when the cosine similarity reaches `threshold`. Questions must
+    also mention exactly the same numbers: "a 50 m² room" and "an 80 m² room"
+    embed almost identically but need different answers.
+    """
+
+    def __init__(self, threshold: float = 0.95, max_entries: int = 1000):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._lock = Lock()
+        self._vectors = np.empty((0, 0), dtype=np.float32)
+        self._entries: List[Dict[str, Any]] = []
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _numbers(question: str) -> frozenset:
+        return frozenset(number.replace(',', '.') for number in _NUMBER.findall(question))
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def lookup(self, question: str, embedding: List[float], k: int) -> Optional[Dict[str, Any]]:
+        """Return the cached entry for the closest matching question, or None."""
+        query = self._normalize(embedding)
+        numbers = self._numbers(question)
+
+        with self._lock:
+            if self._entries:
+                similarities = self._vectors @ query
+                # Best candidates first; stop at the first one that is compatible
+                for index in np.argsort(-similarities):
+                    if similarities[index] < self.threshold:
+                        break
+                    entry = self._entries[index]
+                    if entry['k'] == k and entry['numbers'] == numbers:
+                        entry['hits'] += 1
+                        self.hits += 1
+                        return {**entry['value'], 'similarity': float(similarities[index])}
+            self.misses += 1
+            return None
+
+    def add(self, question: str, embedding: List[float], k: int, value: Dict[str, Any]):
+        vector = self._normalize(embedding)
+        entry = {'question': question, 'k': k, 'numbers': self._numbers(question), 'value': value, 'hits': 0}
+
+        with self._lock:
+            if not self._entries:
+                self._vectors = vector[np.newaxis, :]
+            else:
+                self._vectors = np.vstack([self._vectors, vector])
+            self._entries.append(entry)
+
+            if len(self._entries) > self.max_entries:
+                # Evict the least useful entry: fewest hits, oldest first
+                evict = min(range(len(self._entries)), key=lambda i: self._entries[i]['hits'])
+                del self._entries[evict]
+                self._vectors = np.delete(self._vectors, evict, axis=0)
+
+    def clear(self):
+        with self._lock:
+            self._entries = []
+            self._vectors = np.empty((0, 0), dtype=np.float32)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
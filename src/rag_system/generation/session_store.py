@@ -0,0 +1,200 @@
+import json
+import os
+import sqlite3
+import time
+import uuid
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# One earlier exchange, rendered after a user header and ending in a fresh
+# user header, so prior turns slot in front of the current message.
+HISTORY_TURN_TEMPLATE = """{user}<|eot_id|><|start_header_id|>assistant<|end_header_id|>
+
+{assistant}<|eot_id|><|start_header_id|>user<|end_header_id|>
+
+"""
+
+DIRECT_PROMPT_PREFIX = "<|begin_of_text|><|start_header_id|>user<|end_header_id|>\n\n"
+
+ASSISTANT_HEADER = "<|eot_id|><|start_header_id|>assistant<|end_header_id|>\n\n"
+
+
+def format_history(history: List[Dict[str, Any]]) -> str:
+    """Render turns ({"user": ..., "assistant": ...}) in the Llama 3 chat format."""
+    return "".join(
+        HISTORY_TURN_TEMPLATE.format(user=turn["user"], assistant=turn["assistant"])
+        for turn in history
+    )
+
+
+def create_direct_prompt(message: str, history: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+    """
+    Build a plain chat prompt (no retrieval) for a message and its history.
+
+    Returns {"prompt": ..., "session_prefix": ..., "next_session_prefix": ...}:
+    the session prefix is the part of the prompt covering earlier turns, and
+    next_session_prefix(answer) the one the next turn's prompt starts with.
+    The prompt and answer render like that turn, so generation leaves the KV
+    of nearly all of it for the session.
+    """
+    session_prefix = DIRECT_PROMPT_PREFIX + format_history(history or [])
+    return {
+        "prompt": session_prefix + message + ASSISTANT_HEADER,
+        "session_prefix": session_prefix,
+        "next_session_prefix": lambda answer: session_prefix + format_history(
+            [{"user": message, "assistant": answer}]
+        )
+    }
+
+
+class SessionStore:
+    """
+    Bounded conversation history, one entry per chat session.
+
+    Per session only the most recent turns are kept: at most max_turns, and
+    fewer if their text exceeds max_chars. Over either limit, the oldest
+    turns are dropped in one block down to half of it, so the kept history
+    (and with it the prompt prefix whose KV cache the session reuses) stays
+    the same for the next several turns; on_trim(session_id) is called when
+    that happens, as the session's cached prefix no longer matches. At most max_sessions sessions are
+    held in memory; the least recently used one is evicted beyond that, as is
+    any session idle for longer than idle_ttl seconds. With persist_path,
+    evicted sessions are spilled to SQLite and restored when they come back
+    (spilled sessions are deleted after retention seconds); otherwise they
+    are dropped. on_evict(session_id) is called whenever a session leaves
+    memory, e.g. to free its KV cache.
+    """
+
+    def __init__(
+        self,
+        max_turns: Optional[int] = None,
+        max_chars: Optional[int] = None,
+        max_sessions: Optional[int] = None,
+        idle_ttl: Optional[float] = None,
+        persist_path: Optional[str] = None,
+        retention: Optional[float] = None,
+        on_evict: Optional[Callable[[str], None]] = None,
+        on_trim: Optional[Callable[[str], None]] = None
+    ):
+        self.max_turns = max_turns or int(os.getenv("MAX_HISTORY_TURNS", "6"))
+        self.max_chars = max_chars or int(os.getenv("SESSION_MAX_CHARS", "20000"))
+        self.max_sessions = max_sessions or int(os.getenv("SESSION_MAX_ACTIVE", "500"))
+        self.idle_ttl = idle_ttl if idle_ttl is not None else float(os.getenv("SESSION_IDLE_TTL", "3600"))
+        self.persist_path = persist_path or os.getenv("SESSION_STORE_PATH") or None
+        self.retention = retention if retention is not None else float(os.getenv("SESSION_RETENTION", "604800"))
+        self.on_evict = on_evict
+        self.on_trim = on_trim
+        self._sessions: "OrderedDict[str, Tuple[float, List[Dict[str, Any]]]]" = OrderedDict()
+        self._lock = Lock()
+        self._conn = None
+        self.evictions = 0
+
+        if self.persist_path:
+            os.makedirs(os.path.dirname(os.path.abspath(self.persist_path)), exist_ok=True)
+            self._conn = sqlite3.connect(self.persist_path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                " session_id TEXT PRIMARY KEY, updated REAL NOT NULL, turns TEXT NOT NULL)"
+            )
+            self._conn.commit()
+
+    @staticmethod
+    def new_session_id() -> str:
+        return uuid.uuid4().hex
+
+    def history(self, session_id: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self._touch(session_id))
+
+    def append(self, session_id: str, turn: Dict[str, Any]):
+        with self._lock:
+            turns = self._touch(session_id)
+            turns.append(turn)
+            trimmed = self._trim(turns)
+            self._enforce_limits()
+        if trimmed and self.on_trim is not None:
+            self.on_trim(session_id)
+
+    def remove(self, session_id: str):
+        """Forget a session entirely, in memory and on disk."""
+        with self._lock:
+            if self._sessions.pop(session_id, None) is not None and self.on_evict is not None:
+                self.on_evict(session_id)
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+                self._conn.commit()
+
+    def turn_count(self) -> int:
+        with self._lock:
+            return sum(len(turns) for _, turns in self._sessions.values())
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            self._enforce_limits()
+            stats = {
+                "active_sessions": len(self._sessions),
+                "turns": sum(len(turns) for _, turns in self._sessions.values()),
+                "evictions": self.evictions
+            }
+            if self._conn is not None:
+                stats["spilled_sessions"] = self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+            return stats
+
+    def _trim(self, turns: List[Dict[str, Any]]) -> bool:
+        """Drop the oldest turns in one block once over a limit; True if any were dropped."""
+        chars = sum(self._turn_chars(t) for t in turns)
+        if len(turns) <= self.max_turns and chars <= self.max_chars:
+            return False
+        # Keep the newest turn even if it alone is over the text budget
+        while len(turns) > 1 and (len(turns) > self.max_turns // 2 or chars > self.max_chars // 2):
+            chars -= self._turn_chars(turns.pop(0))
+        return True
+
+    @staticmethod
+    def _turn_chars(turn: Dict[str, Any]) -> int:
+        return len(turn.get("user", "")) + len(turn.get("assistant", ""))
+
+    def _touch(self, session_id: str) -> List[Dict[str, Any]]:
+        """Return the session's turns (restoring a spilled session) and mark it as used."""
+        entry = self._sessions.pop(session_id, None)
+        turns = entry[1] if entry is not None else self._restore(session_id)
+        self._sessions[session_id] = (time.time(), turns)
+        return turns
+
+    def _restore(self, session_id: str) -> List[Dict[str, Any]]:
+        if self._conn is None:
+            return []
+        row = self._conn.execute(
+            "SELECT turns FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        if row is None:
+            return []
+        self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+        self._conn.commit()
+        return json.loads(row[0])
+
+    def _enforce_limits(self):
+        now = time.time()
+        # Least recently used first; stop at the first session that may stay
+        while self._sessions:
+            session_id, (last_used, _) = next(iter(self._sessions.items()))
+            idle = self.idle_ttl > 0 and now - last_used > self.idle_ttl
+            if not idle and len(self._sessions) <= self.max_sessions:
+                break
+            self._evict(session_id)
+
+        if self._conn is not None and self.retention > 0:
+            self._conn.execute("DELETE FROM sessions WHERE updated < ?", (now - self.retention,))
+            self._conn.commit()
+
+    def _evict(self, session_id: str):
+        last_used, turns = self._sessions.pop(session_id)
+        self.evictions += 1
+        if self._conn is not None and turns:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, updated, turns) VALUES (?, ?, ?)",
+                (session_id, last_used, json.dumps(turns))
+            )
+        if self.on_evict is not None:
+            self.on_evict(session_id)
@@ -0,0 +1,2 @@
+class QueueFullError(RuntimeError):
+    """Raised when a request arrives while the generation queue is full."""
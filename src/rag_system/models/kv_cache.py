@@ -0,0 +1,146 @@
+import os
+from collections import OrderedDict
+from threading import Lock
+from typing import List, Optional, Tuple
+
+import torch
+
+from transformers import DynamicCache
+
+
+def cache_layers(cache) -> tuple:
+    """
+    The (key, value) tensors of each layer of a transformers Cache, without
+    the to_legacy_cache() API that transformers 5 removed.
+    """
+    if cache is None or isinstance(cache, tuple):
+        return cache
+    if hasattr(cache, "layers"):  # transformers >= 4.56
+        return tuple((layer.keys, layer.values) for layer in cache.layers)
+    return tuple(zip(cache.key_cache, cache.value_cache))
+
+
+def make_cache(layers: Optional[tuple]) -> Optional[DynamicCache]:
+    """
+    Build a new DynamicCache from (key, value) tensors per layer. The model
+    appends to it by concatenating into fresh tensors, so the tensors passed
+    in are never modified and can be shared between requests.
+    """
+    if layers is None:
+        return None
+    cache = DynamicCache()
+    for layer_idx, (key, value) in enumerate(layers):
+        cache.update(key, value, layer_idx)
+    return cache
+
+
+def slice_cache(cache: tuple, positions: Optional[torch.Tensor] = None, length: Optional[int] = None) -> tuple:
+    """
+    Copy part of a per-layer (key, value) cache: row 0 at the given sequence positions (or the
+    first `length` positions) so the rest of the original can be freed.
+    """
+    def take(tensor):
+        if positions is not None:
+            return tensor.index_select(2, positions.to(tensor.device)).clone()
+        return tensor[:, :, :length].clone()
+
+    return tuple((take(key), take(value)) for key, value in cache)
+
+
+def expand_cache(cache: tuple, batch_size: int) -> tuple:
+    """Repeat a batch-1 per-layer cache batch_size times (a view, no copy)."""
+    return tuple(
+        (key.expand(batch_size, -1, -1, -1), value.expand(batch_size, -1, -1, -1))
+        for key, value in cache
+    )
+
+
+def cache_bytes(layers: tuple) -> int:
+    """Memory held by the key/value tensors of a per-layer cache."""
+    return sum(
+        key.numel() * key.element_size() + value.numel() * value.element_size()
+        for key, value in layers
+    )
+
+
+class PrefixCache:
+    """
+    KV caches for token prefixes that many prompts start with, such as the
+    constant system header of the RAG prompt, plus one rolling entry per chat
+    session holding the conversation so far.
+
+    A prompt whose token IDs start with a cached prefix only needs the
+    remaining tokens prefilled; the prefix keys/values are reused as-is.
+    Session entries are evicted least-recently-used first once the size of
+    their key/value tensors exceeds max_session_bytes.
+    """
+
+    def __init__(self, llama_model, max_session_bytes: Optional[int] = None):
+        self.llama_model = llama_model
+        self.max_session_bytes = max_session_bytes or int(float(os.getenv("SESSION_KV_MAX_MB", "256")) * 1024 ** 2)
+        self._entries: List[Tuple[Tuple[int, ...], tuple]] = []
+        self._sessions: "OrderedDict[str, Tuple[Tuple[int, ...], tuple, int]]" = OrderedDict()
+        self._session_bytes = 0
+        self._lock = Lock()
+
+    def register(self, prefix: str):
+        """Run prefill once over `prefix` and keep its KV cache."""
+        tokenizer = self.llama_model.tokenizer
+        ids = tokenizer(prefix)["input_ids"]
+        if any(entry_ids == tuple(ids) for entry_ids, _ in self._entries):
+            return
+
+        input_ids = torch.tensor([ids], device=self.llama_model.device)
+        with torch.no_grad():
+            outputs = self.llama_model.model(input_ids=input_ids, use_cache=True)
+        cache = cache_layers(outputs.past_key_values)
+
+        with self._lock:
+            self._entries.append((tuple(ids), cache))
+
+    def put_session(self, session_id: str, ids: List[int], cache: tuple):
+        """Keep the KV cache of a session's conversation so far (replacing the previous one)."""
+        size = cache_bytes(cache)
+        with self._lock:
+            self._drop_session(session_id)
+            if size > self.max_session_bytes:
+                return
+            self._sessions[session_id] = (tuple(ids), cache, size)
+            self._session_bytes += size
+            while self._session_bytes > self.max_session_bytes:
+                self._drop_session(next(iter(self._sessions)))
+
+    def drop_session(self, session_id: str):
+        with self._lock:
+            self._drop_session(session_id)
+
+    def _drop_session(self, session_id: str):
+        entry = self._sessions.pop(session_id, None)
+        if entry is not None:
+            self._session_bytes -= entry[2]
+
+    def match(self, input_ids: List[int], session_id: Optional[str] = None) -> Optional[Tuple[int, tuple]]:
+        """
+        Return (prefix_length, cache) for the longest cached prefix of
+        input_ids (registered prefixes and the session's conversation),
+        leaving at least one token to prefill; None if none match.
+        """
+        with self._lock:
+            candidates = list(self._entries)
+            if session_id is not None and session_id in self._sessions:
+                self._sessions.move_to_end(session_id)
+                candidates.append(self._sessions[session_id][:2])
+
+        best = None
+        for entry_ids, cache in candidates:
+            length = len(entry_ids)
+            if length < len(input_ids) and tuple(input_ids[:length]) == entry_ids:
+                if best is None or length > best[0]:
+                    best = (length, cache)
+        return best
+
+    def clear(self):
+        with self._lock:
+            self._entries = []
+            self._sessions.clear()
+            self._session_bytes = 0
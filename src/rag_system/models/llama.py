@@ -1,28 +1,93 @@
 import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig
-from typing import Optional
+from transformers import (
+    AutoModelForCausalLM,
+    AutoTokenizer,
+    BitsAndBytesConfig,
+    StoppingCriteria,
+    StoppingCriteriaList,
+    TextIteratorStreamer,
+    TextStreamer,
+)
+from threading import Event, Thread
+from typing import Any, Callable, Dict, Iterator, List, Optional, Union
 import os
 from dotenv import load_dotenv
+from .kv_cache import PrefixCache, cache_layers, make_cache, slice_cache
+from .speculative import SpeculativeStats
 
 load_dotenv()
 
+# transformers: HF weights with bitsandbytes quantization (GPU)
+# llamacpp: GGUF file via llama-cpp-python (CPU, optional GPU offload)
+# onnx / openvino: optimum-exported models on ONNX Runtime / OpenVINO (CPU)
+BACKENDS = ("transformers", "llamacpp", "onnx", "openvino")
+
 class LlamaModel:
-    def __init__(self, model_name: Optional[str] = None, quantization: str = "4bit"):
+    def __init__(self, model_name: Optional[str] = None, quantization: str = "4bit", backend: Optional[str] = None):
         """
         Initialize Llama model with configurable quantization.
 
         Args:
             model_name: Model identifier from HuggingFace
-            quantization: Quantization type - "4bit", "8bit", or "none"
+            quantization: Quantization type - "4bit", "8bit", or "none" (transformers backend)
+            backend: Inference backend, one of BACKENDS (defaults to MODEL_BACKEND in .env)
         """
         self.model_name = model_name or os.getenv("MODEL_NAME", "meta-llama/Llama-3.1-8B-Instruct")
         self.quantization = quantization
+        self.backend = (backend or os.getenv("MODEL_BACKEND", "transformers")).lower()
+        if self.backend not in BACKENDS:
+            raise ValueError(f"Unknown MODEL_BACKEND {self.backend!r}; expected one of {', '.join(BACKENDS)}")
         self.model = None
         self.tokenizer = None
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.runner = None  # LlamaCppRunner for the llamacpp backend
+        self.device = "cuda" if self.backend == "transformers" and torch.cuda.is_available() else "cpu"
+        # KV reuse relies on transformers cache objects
+        use_prefix_cache = self.backend == "transformers" and os.getenv("PREFIX_CACHE", "true").lower() == "true"
+        self.prefix_cache = PrefixCache(self) if use_prefix_cache else None
+        # Optional small model of the same family (same tokenizer) that drafts
+        # tokens for the main model to verify: speculative decoding
+        self.draft_model_name = (os.getenv("DRAFT_MODEL_NAME") or None) if self.backend == "transformers" else None
+        self.num_assistant_tokens = int(os.getenv("NUM_ASSISTANT_TOKENS", "5"))
+        self.draft_model = None
+        self.speculative = SpeculativeStats()
+
+    @property
+    def supports_batching(self) -> bool:
+        """
+        Whether GenerationScheduler should drive this model: transformers
+        backend without a draft model (speculative decoding runs per request).
+        """
+        return self.backend == "transformers" and self.draft_model_name is None
+
+    def count_tokens(self, text: str) -> int:
+        """Number of model tokens in text (no BOS)."""
+        if self.runner is not None:
+            return len(self.runner.llm.tokenize(text.encode("utf-8"), add_bos=False, special=True))
+        return len(self.tokenizer(text, add_special_tokens=False)["input_ids"])
+
+    def context_window(self) -> Optional[int]:
+        """Maximum sequence length the loaded model accepts, if known."""
+        if self.runner is not None:
+            return self.runner.n_ctx
+        config = getattr(self.model, "config", None)
+        return getattr(config, "max_position_embeddings", None)
+
+    def is_loaded(self) -> bool:
+        if self.backend == "llamacpp":
+            return self.runner is not None and self.runner.llm is not None
+        return self.model is not None and self.tokenizer is not None
 
     def load_model(self):
         """Load model with specified quantization configuration."""
+        if self.backend == "llamacpp":
+            from .llamacpp_backend import LlamaCppRunner
+            self.runner = LlamaCppRunner()
+            self.runner.load()
+            return
+        if self.backend in ("onnx", "openvino"):
+            self._load_optimum_model()
+            return
+
         # Configure quantization based on setting
         quantization_config = None
         load_in_8bit = False
@@ -65,31 +130,289 @@ class LlamaModel:
             self.model_name,
             **model_kwargs
         )
+
+        if self.draft_model_name:
+            # Quantized like the main model so it adds little memory
+            self.draft_model = AutoModelForCausalLM.from_pretrained(
+                self.draft_model_name,
+                **model_kwargs
+            )
+            # Initial draft length; transformers adapts it to the acceptance rate
+            self.draft_model.generation_config.num_assistant_tokens = self.num_assistant_tokens
+            self.speculative.attach(self.model, self.draft_model)
+
+    def _load_optimum_model(self):
+        """
+        Load an ONNX Runtime or OpenVINO model through optimum. These expose the
+        transformers generate() API, so generation shares the code below.
+
+        OPTIMUM_MODEL_PATH should point to an already exported (ideally int8
+        quantized) model directory; without it MODEL_NAME is exported on load,
+        which is slow and, for ONNX, unquantized.
+        """
+        model_path = os.getenv("OPTIMUM_MODEL_PATH") or self.model_name
+        export = not os.path.isdir(model_path)
+        try:
+            if self.backend == "onnx":
+                from optimum.onnxruntime import ORTModelForCausalLM
+                kwargs = {"provider": "CPUExecutionProvider"}
+                if os.getenv("ONNX_FILE_NAME"):
+                    # e.g. model_quantized.onnx written by optimum-cli onnxruntime quantize
+                    kwargs["file_name"] = os.getenv("ONNX_FILE_NAME")
+                self.model = ORTModelForCausalLM.from_pretrained(model_path, export=export, **kwargs)
+            else:
+                from optimum.intel import OVModelForCausalLM
+                # int8 weight compression when exporting here
+                kwargs = {"load_in_8bit": True} if export else {}
+                self.model = OVModelForCausalLM.from_pretrained(model_path, export=export, **kwargs)
+        except ImportError:
+            extra = "onnxruntime" if self.backend == "onnx" else "openvino"
+            raise RuntimeError(f"MODEL_BACKEND={self.backend} requires optimum (pip install optimum[{extra}])")
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_path, token=os.getenv("HF_TOKEN"))
+        self.tokenizer.pad_token = self.tokenizer.eos_token
         
+    def register_prefix(self, prefix: str):
+        """Precompute the KV cache of a prompt prefix shared by many requests."""
+        if self.prefix_cache is not None:
+            self.prefix_cache.register(prefix)
+
+    def _generation_inputs(self, prompt: str, session_id: Optional[str] = None) -> Dict[str, Any]:
+        """Tokenize a prompt, attaching the cached KV of its longest cached prefix if it has one."""
+        inputs = self.tokenizer(prompt, return_tensors="pt").to(self.device)
+        if self.prefix_cache is not None:
+            match = self.prefix_cache.match(inputs["input_ids"][0].tolist(), session_id)
+            if match is not None:
+                # generate() only prefills the tokens past the cached prefix
+                inputs["past_key_values"] = make_cache(match[1])
+        return inputs
+
+    def _decoding_kwargs(self) -> Dict[str, Any]:
+        """Extra generate() arguments: the draft model when speculative decoding is on."""
+        return {"assistant_model": self.draft_model} if self.draft_model is not None else {}
+
+    def speculative_stats(self) -> Optional[Dict[str, Any]]:
+        """Draft acceptance metrics, or None without a draft model."""
+        return self.speculative.snapshot() if self.draft_model is not None else None
+
+    def retain_session_cache(
+        self,
+        session_id: Optional[str],
+        session_prefix: Union[str, Callable[[str], str], None],
+        token_ids: List[int],
+        cache,
+        answer: str = "",
+        positions=None
+    ):
+        """
+        Keep the KV of the session's conversation so far, so the next turn
+        only prefills what is new.
+
+        `session_prefix` is the text the session's next prompt starts with, or
+        a function of `answer` returning it (the conversation including this
+        exchange). `cache` covers the leading tokens of token_ids (prompt plus
+        generated tokens); `positions` selects their slots when the cache row
+        also contains padding. The KV kept is that of the longest common
+        prefix of the two, so an answer that tokenizes differently when
+        re-rendered only loses the tokens past the difference.
+        """
+        if self.prefix_cache is None or not session_id or not session_prefix or cache is None:
+            return
+        if callable(session_prefix):
+            session_prefix = session_prefix(answer)
+        prefix_ids = self.tokenizer(session_prefix)["input_ids"]
+        cache = cache_layers(cache)
+        cached = len(positions) if positions is not None else cache[0][0].shape[-2]
+        length = 0
+        for prefix_id, token_id in zip(prefix_ids, token_ids[:cached]):
+            if prefix_id != token_id:
+                break
+            length += 1
+        if length == 0:
+            return
+        if positions is not None:
+            kept = slice_cache(cache, positions=positions[:length])
+        else:
+            kept = slice_cache(cache, length=length)
+        self.prefix_cache.put_session(session_id, prefix_ids[:length], kept)
+
     def generate_response(
         self, 
         prompt: str, 
         max_tokens: int = 512, 
         temperature: float = 0.7,
-        do_sample: bool = True
+        do_sample: bool = True,
+        session_id: Optional[str] = None,
+        session_prefix: Union[str, Callable[[str], str], None] = None,
+        on_text: Optional[Callable[[str], None]] = None,
+        cancelled: Optional[Event] = None
     ) -> str:
-        if self.model is None or self.tokenizer is None:
+        """
+        Generate a response for a prompt.
+
+        With session_id, a cached KV for the session's earlier turns is reused,
+        and the KV of session_prefix (the text the next prompt starts with, or
+        a function of the answer returning it) is kept for the session's next
+        call, as far as this call's prompt and answer cover it. on_text is called with text
+        deltas as they are decoded, on the calling thread; setting `cancelled`
+        stops generation at the next token.
+        """
+        if not self.is_loaded():
             raise RuntimeError("Model not loaded. Call load_model() first.")
+        if self.runner is not None:
+            if on_text is None and cancelled is None:
+                return self.runner.generate(prompt, max_tokens, temperature, do_sample)
+            parts = []
+            stream = self.runner.stream(prompt, max_tokens, temperature, do_sample)
+            try:
+                for text in stream:
+                    if cancelled is not None and cancelled.is_set():
+                        break
+                    parts.append(text)
+                    if on_text is not None:
+                        on_text(text)
+            finally:
+                stream.close()
+            return "".join(parts).strip()
             
-        inputs = self.tokenizer(prompt, return_tensors="pt").to(self.device)
+        inputs = self._generation_inputs(prompt, session_id)
         input_length = inputs['input_ids'].shape[1]
+        extra_kwargs = {}
+        if on_text is not None:
+            extra_kwargs["streamer"] = _CallbackStreamer(self.tokenizer, on_text)
+        if cancelled is not None:
+            extra_kwargs["stopping_criteria"] = StoppingCriteriaList([_CancelledCriteria(cancelled)])
         
-        with torch.no_grad():
+        with torch.no_grad(), self.speculative.tracking():
             outputs = self.model.generate(
                 **inputs,
                 max_new_tokens=max_tokens,
                 temperature=temperature,
                 do_sample=do_sample,
                 pad_token_id=self.tokenizer.eos_token_id,
-                eos_token_id=self.tokenizer.eos_token_id
+                eos_token_id=self.tokenizer.eos_token_id,
+                return_dict_in_generate=True,
+                **extra_kwargs,
+                **self._decoding_kwargs()
             )
-        
+        if self.draft_model is not None:
+            self.speculative.record(outputs.sequences.shape[1] - input_length)
+
         # Decode only the new tokens (after the input)
-        new_tokens = outputs[0][input_length:]
-        response = self.tokenizer.decode(new_tokens, skip_special_tokens=True)
-        return response.strip()
\ No newline at end of file
+        new_tokens = outputs.sequences[0][input_length:]
+        response = self.tokenizer.decode(new_tokens, skip_special_tokens=True).strip()
+
+        self.retain_session_cache(
+            session_id, session_prefix, outputs.sequences[0].tolist(), outputs.past_key_values, response
+        )
+        return response
+
+    def stream_response(
+        self,
+        prompt: str,
+        max_tokens: int = 512,
+        temperature: float = 0.7,
+        do_sample: bool = True,
+        session_id: Optional[str] = None,
+        session_prefix: Union[str, Callable[[str], str], None] = None
+    ) -> Iterator[str]:
+        """
+        Generate a response and yield decoded text deltas as they are produced.
+
+        Generation runs on a background thread. Closing the iterator early
+        (e.g. the client disconnected) stops generation at the next token.
+        Session arguments behave as in generate_response().
+        """
+        if not self.is_loaded():
+            raise RuntimeError("Model not loaded. Call load_model() first.")
+        if self.runner is not None:
+            yield from self.runner.stream(prompt, max_tokens, temperature, do_sample)
+            return
+
+        inputs = self._generation_inputs(prompt, session_id)
+        streamer = TextIteratorStreamer(
+            self.tokenizer,
+            skip_prompt=True,
+            skip_special_tokens=True
+        )
+        cancelled = Event()
+
+        generation_kwargs = dict(
+            **inputs,
+            max_new_tokens=max_tokens,
+            temperature=temperature,
+            do_sample=do_sample,
+            pad_token_id=self.tokenizer.eos_token_id,
+            eos_token_id=self.tokenizer.eos_token_id,
+            streamer=streamer,
+            stopping_criteria=StoppingCriteriaList([_CancelledCriteria(cancelled)]),
+            return_dict_in_generate=True,
+            **self._decoding_kwargs()
+        )
+
+        errors = []
+        results = []
+
+        def _generate():
+            try:
+                with torch.no_grad(), self.speculative.tracking():
+                    results.append(self.model.generate(**generation_kwargs))
+            except Exception as e:
+                errors.append(e)
+                # Unblock the consumer waiting on the streamer queue
+                streamer.end()
+
+        thread = Thread(target=_generate, daemon=True)
+        thread.start()
+
+        parts = []
+        try:
+            started = False
+            for text in streamer:
+                if not started:
+                    # Match generate_response, which strips leading whitespace
+                    text = text.lstrip()
+                    started = bool(text)
+                if text:
+                    parts.append(text)
+                    yield text
+        finally:
+            cancelled.set()
+            thread.join()
+
+        if errors:
+            raise errors[0]
+
+        if self.draft_model is not None:
+            self.speculative.record(results[0].sequences.shape[1] - inputs['input_ids'].shape[1])
+        self.retain_session_cache(
+            session_id, session_prefix, results[0].sequences[0].tolist(), results[0].past_key_values,
+            "".join(parts).strip()
+        )
+
+
+class _CancelledCriteria(StoppingCriteria):
+    """Stops generation once its cancel event is set (e.g. the consumer went away)."""
+
+    def __init__(self, cancelled: Event):
+        self.cancelled = cancelled
+
+    def __call__(self, input_ids, scores, **kwargs) -> bool:
+        return self.cancelled.is_set()
+
+
+class _CallbackStreamer(TextStreamer):
+    """Passes decoded text deltas to a callback instead of printing them."""
+
+    def __init__(self, tokenizer, on_text: Callable[[str], None]):
+        super().__init__(tokenizer, skip_prompt=True, skip_special_tokens=True)
+        self.on_text = on_text
+        self.started = False
+
+    def on_finalized_text(self, text: str, stream_end: bool = False):
+        if not self.started:
+            # Match the returned response, which strips leading whitespace
+            text = text.lstrip()
+            self.started = bool(text)
+        if text:
+            self.on_text(text)
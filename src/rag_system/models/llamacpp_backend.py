@@ -0,0 +1,91 @@
+import os
+from threading import Lock
+from typing import Iterator, Optional
+
+BEGIN_OF_TEXT = "<|begin_of_text|>"
+END_OF_TURN = "<|eot_id|>"
+
+
+class LlamaCppRunner:
+    """
+    GGUF model run with llama-cpp-python: quantized (e.g. Q4_K_M) CPU inference
+    for machines without a GPU.
+
+    Prompts use the same Llama 3 chat format as the transformers backend.
+    llama.cpp keeps the KV of the previous prompt and only evaluates the
+    tokens after the longest common prefix, so the constant system header is
+    not re-evaluated between requests.
+    """
+
+    def __init__(
+        self,
+        model_path: Optional[str] = None,
+        n_ctx: Optional[int] = None,
+        n_threads: Optional[int] = None,
+        n_gpu_layers: Optional[int] = None
+    ):
+        self.model_path = model_path or os.getenv("GGUF_MODEL_PATH")
+        self.n_ctx = n_ctx or int(os.getenv("LLAMA_CPP_N_CTX", "8192"))
+        self.n_threads = n_threads or int(os.getenv("LLAMA_CPP_THREADS", "0")) or os.cpu_count()
+        self.n_gpu_layers = n_gpu_layers if n_gpu_layers is not None else int(os.getenv("LLAMA_CPP_GPU_LAYERS", "0"))
+        self.llm = None
+        # A llama.cpp context is not thread-safe; one generation at a time
+        self._lock = Lock()
+
+    def load(self):
+        try:
+            from llama_cpp import Llama
+        except ImportError:
+            raise RuntimeError("MODEL_BACKEND=llamacpp requires llama-cpp-python (pip install llama-cpp-python)")
+        if not self.model_path or not os.path.exists(self.model_path):
+            raise RuntimeError(f"GGUF model not found: {self.model_path!r} (set GGUF_MODEL_PATH in .env)")
+
+        self.llm = Llama(
+            model_path=self.model_path,
+            n_ctx=self.n_ctx,
+            n_threads=self.n_threads,
+            n_gpu_layers=self.n_gpu_layers,
+            verbose=False
+        )
+
+    @staticmethod
+    def _prompt(prompt: str) -> str:
+        # llama.cpp adds BOS itself
+        return prompt[len(BEGIN_OF_TEXT):] if prompt.startswith(BEGIN_OF_TEXT) else prompt
+
+    def _completion(self, prompt: str, max_tokens: int, temperature: float, do_sample: bool, stream: bool):
+        return self.llm.create_completion(
+            self._prompt(prompt),
+            max_tokens=max_tokens,
+            # Greedy when sampling is off, like transformers' do_sample=False
+            temperature=temperature if do_sample else 0.0,
+            stop=[END_OF_TURN],
+            stream=stream
+        )
+
+    def generate(self, prompt: str, max_tokens: int = 512, temperature: float = 0.7, do_sample: bool = True) -> str:
+        with self._lock:
+            result = self._completion(prompt, max_tokens, temperature, do_sample, stream=False)
+        return result["choices"][0]["text"].strip()
+
+    def stream(
+        self,
+        prompt: str,
+        max_tokens: int = 512,
+        temperature: float = 0.7,
+        do_sample: bool = True
+    ) -> Iterator[str]:
+        """Yield text deltas; closing the iterator stops generation."""
+        with self._lock:
+            chunks = self._completion(prompt, max_tokens, temperature, do_sample, stream=True)
+            started = False
+            try:
+                for chunk in chunks:
+                    text = chunk["choices"][0]["text"]
+                    if not started:
+                        text = text.lstrip()
+                        started = bool(text)
+                    if text:
+                        yield text
+            finally:
+                chunks.close()
@@ -0,0 +1,53 @@
+import os
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+from .llama import LlamaModel
+
+_models: Dict[Tuple[str, str, str], LlamaModel] = {}
+_load_locks: Dict[Tuple[str, str, str], Lock] = {}
+_registry_lock = Lock()
+
+
+def get_model(
+    model_name: Optional[str] = None,
+    quantization: Optional[str] = None,
+    backend: Optional[str] = None
+) -> LlamaModel:
+    """
+    Return the loaded LlamaModel for a model/quantization/backend combination, loading it on
+    the first request. Every caller in the process (RAG pipeline, direct chat,
+    ...) shares the same weights and tokenizer, so a model is never loaded twice.
+
+    Args:
+        model_name: Model identifier (defaults to MODEL_NAME in .env)
+        quantization: "4bit", "8bit" or "none" (defaults to QUANTIZATION in .env)
+        backend: Inference backend (defaults to MODEL_BACKEND in .env)
+    """
+    candidate = LlamaModel(
+        model_name,
+        quantization=quantization or os.getenv("QUANTIZATION", "4bit"),
+        backend=backend
+    )
+    key = (candidate.model_name, candidate.quantization, candidate.backend)
+
+    with _registry_lock:
+        if key in _models:
+            return _models[key]
+        load_lock = _load_locks.setdefault(key, Lock())
+
+    # Load outside the registry lock so different models can load concurrently
+    with load_lock:
+        if key not in _models:
+            candidate.load_model()
+            with _registry_lock:
+                _models[key] = candidate
+    return _models[key]
+
+
+def loaded_models() -> List[Dict[str, str]]:
+    with _registry_lock:
+        return [
+            {"model_name": name, "quantization": quant, "backend": backend}
+            for name, quant, backend in _models
+        ]
@@ -0,0 +1,495 @@
+import asyncio
+import os
+import queue
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from threading import Event, Thread
+from typing import Callable, Iterator, List, Optional, Tuple, Union
+
+import torch
+from transformers import (
+    DynamicCache,
+    LogitsProcessorList,
+    RepetitionPenaltyLogitsProcessor,
+    TemperatureLogitsWarper,
+    TopKLogitsWarper,
+    TopPLogitsWarper
+)
+
+try:
+    from transformers import MinPLogitsWarper
+except ImportError:  # transformers < 4.39
+    MinPLogitsWarper = None
+
+from .errors import QueueFullError
+from .kv_cache import cache_layers, expand_cache, make_cache
+from .llama import LlamaModel
+
+
+@dataclass
+class _Sequence:
+    """One queued or in-flight generation request."""
+    prompt: str
+    max_tokens: int
+    temperature: float
+    do_sample: bool
+    future: Future
+    on_text: Optional[Callable[[str], None]] = None
+    session_id: Optional[str] = None
+    session_prefix: Union[str, Callable[[str], str], None] = None
+    cancelled: Event = field(default_factory=Event)
+    prompt_ids: List[int] = field(default_factory=list)
+    token_ids: List[int] = field(default_factory=list)
+    emitted: int = 0
+    logits_processor: Optional[LogitsProcessorList] = None
+
+
+_STOP = object()
+
+
+class GenerationScheduler:
+    """
+    Continuous-batching scheduler in front of a loaded LlamaModel.
+
+    Requests are queued from any thread (or awaited from the event loop) and a
+    single worker thread decodes every active sequence together, one token per
+    forward pass. Finished sequences leave the batch immediately and queued ones
+    are prefilled and merged into the running batch, so concurrent users share
+    each decode step instead of waiting for each other's full answers.
+    """
+
+    def __init__(
+        self,
+        llama_model: LlamaModel,
+        max_batch_size: Optional[int] = None,
+        max_queue_size: Optional[int] = None
+    ):
+        self.llama_model = llama_model
+        self.max_batch_size = max_batch_size or int(os.getenv("MAX_BATCH_SIZE", "4"))
+        # Requests waiting for a batch slot; beyond this submit() refuses new ones
+        self.max_queue_size = max_queue_size or int(os.getenv("MAX_QUEUE_SIZE", "32"))
+        self._queue: "queue.Queue" = queue.Queue(maxsize=self.max_queue_size)
+        self._thread: Optional[Thread] = None
+
+        # Running batch state: one row per active sequence
+        self._active: List[_Sequence] = []
+        self._cache = None          # DynamicCache, one row per sequence
+        self._attention_mask = None  # [batch, cached_len]
+        self._next_tokens = None     # [batch, 1]
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = Thread(target=self._run, name="generation-scheduler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
+
+    def stats(self) -> dict:
+        return {
+            "active": len(self._active),
+            "queued": self._queue.qsize(),
+            "max_batch_size": self.max_batch_size,
+            "max_queue_size": self.max_queue_size
+        }
+
+    def submit(
+        self,
+        prompt: str,
+        max_tokens: int = 512,
+        temperature: float = 0.7,
+        do_sample: bool = True,
+        session_id: Optional[str] = None,
+        session_prefix: Union[str, Callable[[str], str], None] = None,
+        on_text: Optional[Callable[[str], None]] = None,
+        cancelled: Optional[Event] = None
+    ) -> Future:
+        """
+        Queue a prompt; the returned future resolves to the full response.
+
+        Session, on_text and cancelled arguments behave as in
+        LlamaModel.generate_response() (on_text runs on the worker thread).
+        Raises QueueFullError if max_queue_size requests are already waiting.
+        """
+        return self._enqueue(
+            prompt, max_tokens, temperature, do_sample, on_text=on_text,
+            session_id=session_id, session_prefix=session_prefix, cancelled=cancelled
+        ).future
+
+    def _enqueue(
+        self,
+        prompt: str,
+        max_tokens: int,
+        temperature: float,
+        do_sample: bool,
+        on_text: Optional[Callable[[str], None]] = None,
+        session_id: Optional[str] = None,
+        session_prefix: Union[str, Callable[[str], str], None] = None,
+        cancelled: Optional[Event] = None
+    ) -> _Sequence:
+        self.start()
+        sequence = _Sequence(
+            prompt=prompt,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            do_sample=do_sample,
+            future=Future(),
+            on_text=on_text,
+            session_id=session_id,
+            session_prefix=session_prefix,
+            cancelled=cancelled or Event()
+        )
+        sequence.future.set_running_or_notify_cancel()
+        try:
+            self._queue.put_nowait(sequence)
+        except queue.Full:
+            raise QueueFullError(f"Generation queue is full ({self.max_queue_size} requests waiting)")
+        return sequence
+
+    async def generate(
+        self,
+        prompt: str,
+        max_tokens: int = 512,
+        temperature: float = 0.7,
+        do_sample: bool = True,
+        session_id: Optional[str] = None,
+        session_prefix: Union[str, Callable[[str], str], None] = None,
+        timeout: Optional[float] = None
+    ) -> str:
+        """
+        Await a response without blocking the event loop.
+
+        If the caller is cancelled (e.g. the client disconnected) or timeout
+        seconds pass (asyncio.TimeoutError), the sequence leaves the batch.
+        """
+        sequence = self._enqueue(
+            prompt, max_tokens, temperature, do_sample,
+            session_id=session_id, session_prefix=session_prefix
+        )
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(sequence.future), timeout)
+        except (asyncio.CancelledError, asyncio.TimeoutError):
+            sequence.cancelled.set()
+            raise
+
+    def stream(
+        self,
+        prompt: str,
+        max_tokens: int = 512,
+        temperature: float = 0.7,
+        do_sample: bool = True,
+        session_id: Optional[str] = None,
+        session_prefix: Union[str, Callable[[str], str], None] = None
+    ) -> Iterator[str]:
+        """
+        Yield text deltas for a batched request as they are decoded.
+
+        The request is queued immediately, so QueueFullError is raised here
+        rather than on the first read. Closing the iterator early drops the
+        sequence from the batch.
+        """
+        deltas: "queue.Queue" = queue.Queue()
+        sequence = self._enqueue(
+            prompt, max_tokens, temperature, do_sample, on_text=deltas.put,
+            session_id=session_id, session_prefix=session_prefix
+        )
+        sequence.future.add_done_callback(lambda _: deltas.put(_STOP))
+        return self._iter_deltas(sequence, deltas)
+
+    @staticmethod
+    def _iter_deltas(sequence: _Sequence, deltas: "queue.Queue") -> Iterator[str]:
+        try:
+            while True:
+                delta = deltas.get()
+                if delta is _STOP:
+                    break
+                yield delta
+        finally:
+            sequence.cancelled.set()
+
+        # Surface generation errors to the consumer
+        sequence.future.result()
+
+    # ------------------------------------------------------------------
+    # Worker thread
+    # ------------------------------------------------------------------
+
+    def _run(self):
+        with torch.inference_mode():
+            while True:
+                if not self._active:
+                    # Idle: block until something arrives
+                    item = self._queue.get()
+                    if item is _STOP:
+                        return
+                    waiting = [item]
+                else:
+                    waiting = []
+
+                stop = False
+                while len(self._active) + len(waiting) < self.max_batch_size:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is _STOP:
+                        stop = True
+                        break
+                    waiting.append(item)
+
+                try:
+                    if waiting:
+                        self._admit(waiting)
+                    if self._active:
+                        self._step()
+                except Exception as e:
+                    for sequence in waiting:
+                        if not sequence.future.done():
+                            sequence.future.set_exception(e)
+                    self._fail_all(e)
+
+                if stop:
+                    self._fail_all(RuntimeError("Generation scheduler stopped"))
+                    return
+
+    def _admit(self, sequences: List[_Sequence]):
+        """Prefill new sequences and merge them into the running batch."""
+        for sequence in sequences:
+            if sequence.cancelled.is_set():
+                sequence.future.set_result("")
+        sequences = [s for s in sequences if not s.future.done()]
+        if not sequences:
+            return
+
+        tokenizer = self.llama_model.tokenizer
+        prefix_cache = self.llama_model.prefix_cache
+
+        # Group by cached prefix so each group prefills only its suffixes
+        groups = {}
+        for sequence in sequences:
+            ids = tokenizer(sequence.prompt)["input_ids"]
+            sequence.prompt_ids = ids
+            sequence.logits_processor = self._logits_processor(sequence)
+            match = prefix_cache.match(ids, sequence.session_id) if prefix_cache is not None else None
+            key = id(match[1]) if match is not None else None
+            groups.setdefault(key, (match, []))[1].append((sequence, ids))
+
+        for match, members in groups.values():
+            self._prefill_group(match, members)
+
+    def _prefill_group(self, match: Optional[Tuple[int, tuple]], members: List[Tuple[_Sequence, List[int]]]):
+        tokenizer = self.llama_model.tokenizer
+        device = self.llama_model.device
+        prefix_length, prefix_kv = match if match is not None else (0, None)
+        sequences = [sequence for sequence, _ in members]
+        encoded = [ids[prefix_length:] for _, ids in members]
+        length = max(len(ids) for ids in encoded)
+        pad_id = tokenizer.pad_token_id
+
+        # Left-pad the uncached part so every row's last position is its last
+        # prompt token. With a shared prefix the padding sits between prefix
+        # and suffix; it is masked out and skipped by the position IDs.
+        input_ids = torch.tensor(
+            [[pad_id] * (length - len(ids)) + ids for ids in encoded], device=device
+        )
+        attention_mask = torch.tensor(
+            [[1] * prefix_length + [0] * (length - len(ids)) + [1] * len(ids) for ids in encoded],
+            device=device
+        )
+        past = make_cache(expand_cache(prefix_kv, len(members))) if prefix_kv is not None else None
+
+        outputs = self._forward(input_ids, attention_mask, past)
+        cache = outputs.past_key_values
+        next_tokens = self._sample(outputs.logits[:, -1, :], sequences)
+
+        start = len(self._active)
+        if self._active:
+            self._cache, self._attention_mask = _merge_batches(
+                (self._cache, self._attention_mask),
+                (cache, attention_mask)
+            )
+            self._next_tokens = torch.cat([self._next_tokens, next_tokens], dim=0)
+        else:
+            self._cache, self._attention_mask, self._next_tokens = cache, attention_mask, next_tokens
+
+        self._active.extend(sequences)
+        self._record(start)
+
+    def _step(self):
+        """Decode one token for every active sequence."""
+        attention_mask = torch.cat(
+            [self._attention_mask, self._attention_mask.new_ones((len(self._active), 1))],
+            dim=1
+        )
+        # The model appends this step's keys/values to the cache in place
+        outputs = self._forward(self._next_tokens, attention_mask, self._cache)
+        self._cache = outputs.past_key_values
+        self._attention_mask = attention_mask
+        self._next_tokens = self._sample(outputs.logits[:, -1, :], self._active)
+        self._record(0)
+
+    def _forward(self, input_ids, attention_mask, cache):
+        # Positions count only real tokens, so padding never shifts RoPE
+        position_ids = attention_mask.long().cumsum(-1) - 1
+        position_ids.masked_fill_(attention_mask == 0, 1)
+        position_ids = position_ids[:, -input_ids.shape[1]:]
+
+        return self.llama_model.model(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            past_key_values=cache,
+            use_cache=True
+        )
+
+    def _logits_processor(self, sequence: _Sequence) -> LogitsProcessorList:
+        """
+        The processors generate() would apply for this request: repetition
+        penalty and, when sampling, temperature/top-k/top-p/min-p from the
+        model's generation_config.
+        """
+        config = self.llama_model.model.generation_config
+        processors = LogitsProcessorList()
+        repetition_penalty = getattr(config, "repetition_penalty", None)
+        if repetition_penalty is not None and repetition_penalty != 1.0:
+            processors.append(RepetitionPenaltyLogitsProcessor(repetition_penalty))
+        if not sequence.do_sample or sequence.temperature <= 0:
+            return processors
+
+        if sequence.temperature != 1.0:
+            processors.append(TemperatureLogitsWarper(sequence.temperature))
+        top_k = getattr(config, "top_k", None)
+        if top_k:
+            processors.append(TopKLogitsWarper(top_k))
+        top_p = getattr(config, "top_p", None)
+        if top_p is not None and top_p < 1.0:
+            processors.append(TopPLogitsWarper(top_p))
+        min_p = getattr(config, "min_p", None)
+        if min_p is not None and MinPLogitsWarper is not None:
+            processors.append(MinPLogitsWarper(min_p))
+        return processors
+
+    def _sample(self, logits: torch.Tensor, sequences: List[_Sequence]) -> torch.Tensor:
+        logits = logits.float()
+        tokens = []
+        for row, sequence in zip(logits, sequences):
+            if sequence.logits_processor:
+                input_ids = torch.tensor([sequence.prompt_ids + sequence.token_ids], device=logits.device)
+                row = sequence.logits_processor(input_ids, row.unsqueeze(0))[0]
+            if not sequence.do_sample or sequence.temperature <= 0:
+                tokens.append(int(row.argmax()))
+                continue
+            probs = torch.softmax(row, dim=-1)
+            tokens.append(int(torch.multinomial(probs, 1)))
+        return torch.tensor(tokens, device=logits.device).unsqueeze(1)
+
+    def _record(self, start: int):
+        """
+        Append the sampled tokens of rows start.. to their sequences, emit text,
+        and retire sequences that finished.
+        """
+        eos_token_id = self.llama_model.tokenizer.eos_token_id
+        tokens = self._next_tokens[start:, 0].tolist()
+        keep = list(range(start))
+        for row, token in enumerate(tokens, start):
+            sequence = self._active[row]
+            finished = token == eos_token_id
+            if not finished:
+                sequence.token_ids.append(token)
+                self._emit(sequence)
+            finished = (
+                finished
+                or len(sequence.token_ids) >= sequence.max_tokens
+                or sequence.cancelled.is_set()
+            )
+            if finished:
+                # Release text held back by _emit, so the stream ends with result()
+                self._emit(sequence, final=True)
+                answer = self._decode(sequence).strip()
+                self._retain_session(row, sequence, answer)
+                sequence.future.set_result(answer)
+            else:
+                keep.append(row)
+
+        if len(keep) < len(self._active):
+            self._retain(keep)
+
+    def _retain_session(self, row: int, sequence: _Sequence, answer: str):
+        """Hand the finished row's conversation KV (prompt and answer) to the session cache."""
+        if not sequence.session_id or not sequence.session_prefix:
+            return
+        # Real (unpadded) slots of this row, in token order
+        positions = self._attention_mask[row].nonzero().squeeze(-1)
+        row_cache = tuple((k[row:row + 1], v[row:row + 1]) for k, v in cache_layers(self._cache))
+        self.llama_model.retain_session_cache(
+            sequence.session_id, sequence.session_prefix, sequence.prompt_ids + sequence.token_ids,
+            row_cache, answer, positions
+        )
+
+    def _retain(self, rows: List[int]):
+        self._active = [self._active[i] for i in rows]
+        if not rows:
+            self._cache = self._attention_mask = self._next_tokens = None
+            return
+
+        index = torch.tensor(rows, device=self._attention_mask.device)
+        attention_mask = self._attention_mask.index_select(0, index)
+        # Drop columns that are padding for every remaining row
+        trim = int((attention_mask.cumsum(-1) == 0).all(dim=0).sum())
+        self._attention_mask = attention_mask[:, trim:]
+        self._next_tokens = self._next_tokens.index_select(0, index)
+        self._cache = make_cache(tuple(
+            (k.index_select(0, index.to(k.device))[:, :, trim:], v.index_select(0, index.to(v.device))[:, :, trim:])
+            for k, v in cache_layers(self._cache)
+        ))
+
+    def _decode(self, sequence: _Sequence) -> str:
+        return self.llama_model.tokenizer.decode(sequence.token_ids, skip_special_tokens=True)
+
+    def _emit(self, sequence: _Sequence, final: bool = False):
+        if sequence.on_text is None:
+            return
+        text = self._decode(sequence)
+        if sequence.emitted == 0:
+            # Match generate_response, which strips leading whitespace
+            stripped = text.lstrip()
+            sequence.emitted = len(text) - len(stripped)
+        # Hold back incomplete multi-byte characters until they are finished
+        if (text.endswith("�") and not final) or len(text) <= sequence.emitted:
+            return
+        sequence.on_text(text[sequence.emitted:])
+        sequence.emitted = len(text)
+
+    def _fail_all(self, error: Exception):
+        for sequence in self._active:
+            if not sequence.future.done():
+                sequence.future.set_exception(error)
+        self._active = []
+        self._cache = self._attention_mask = self._next_tokens = None
+
+
+def _merge_batches(
+    a: Tuple[DynamicCache, torch.Tensor],
+    b: Tuple[DynamicCache, torch.Tensor]
+) -> Tuple[DynamicCache, torch.Tensor]:
+    """Concatenate two (cache, attention_mask) batches, left-padding the shorter."""
+    (cache_a, mask_a), (cache_b, mask_b) = a, b
+    length = max(mask_a.shape[1], mask_b.shape[1])
+
+    def pad_mask(mask):
+        return torch.nn.functional.pad(mask, (length - mask.shape[1], 0), value=0)
+
+    def pad_kv(tensor):
+        # [batch, heads, seq, head_dim] -> pad the seq dimension on the left
+        return torch.nn.functional.pad(tensor, (0, 0, length - tensor.shape[2], 0))
+
+    cache = make_cache(tuple(
+        (torch.cat([pad_kv(ka), pad_kv(kb)], dim=0), torch.cat([pad_kv(va), pad_kv(vb)], dim=0))
+        for (ka, va), (kb, vb) in zip(cache_layers(cache_a), cache_layers(cache_b))
+    ))
+    mask = torch.cat([pad_mask(mask_a), pad_mask(mask_b)], dim=0)
+    return cache, mask
+
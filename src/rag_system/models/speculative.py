@@ -0,0 +1,63 @@
+from contextlib import contextmanager
+from threading import Lock
+from typing import Any, Dict
+
+
+class SpeculativeStats:
+    """
+    Acceptance counters for assisted (speculative) generation.
+
+    transformers does not report how many drafted tokens were accepted, so
+    they are derived from forward-pass counts: every draft forward proposes
+    one token, and every target forward verifies a run of proposals and
+    contributes exactly one token of its own. Hence
+
+        accepted = new_tokens - target_forwards
+
+    Counting only happens inside tracking(), so other uses of the models
+    (prefix prefill, plain generation) do not skew the numbers.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._active = 0
+        self.generations = 0
+        self.drafted_tokens = 0
+        self.target_forwards = 0
+        self.new_tokens = 0
+
+    def attach(self, model, draft_model):
+        model.register_forward_pre_hook(lambda module, args: self._count("target_forwards"))
+        draft_model.register_forward_pre_hook(lambda module, args: self._count("drafted_tokens"))
+
+    def _count(self, counter: str):
+        with self._lock:
+            if self._active:
+                setattr(self, counter, getattr(self, counter) + 1)
+
+    @contextmanager
+    def tracking(self):
+        with self._lock:
+            self._active += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._active -= 1
+
+    def record(self, new_tokens: int):
+        with self._lock:
+            self.generations += 1
+            self.new_tokens += new_tokens
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            accepted = max(self.new_tokens - self.target_forwards, 0)
+            return {
+                "generations": self.generations,
+                "drafted_tokens": self.drafted_tokens,
+                "accepted_tokens": accepted,
+                "acceptance_rate": accepted / self.drafted_tokens if self.drafted_tokens else 0.0,
+                # Tokens produced per forward pass of the large model (1.0 = no speedup)
+                "tokens_per_target_forward": self.new_tokens / self.target_forwards if self.target_forwards else 0.0
+            }
@@ -0,0 +1,93 @@
+import heapq
+import math
+import re
+from collections import Counter
+from threading import Lock
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# Keeps codes and units such as "kg/hr", "g/kg", "MX2" or "3.5" together
+_TOKEN = re.compile(r'\w+(?:[./\-]\w+)*')
+_SEPARATOR = re.compile(r'[./\-]')
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased terms; compound tokens also contribute their parts ("kg/hr" -> kg/hr, kg, hr)."""
+    terms = []
+    for token in _TOKEN.findall(text.lower()):
+        terms.append(token)
+        parts = _SEPARATOR.split(token)
+        if len(parts) > 1:
+            terms.extend(part for part in parts if part)
+    return terms
+
+
+class BM25Index:
+    """
+    In-memory inverted index scored with Okapi BM25.
+
+    Complements the dense (MiniLM) search for exact terms embeddings handle
+    poorly: product codes, formula names and units. Documents are keyed by the
+    same IDs as in Chroma; add() replaces a document with the same ID.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._doc_terms: Dict[str, Counter] = {}
+        self._doc_lengths: Dict[str, int] = {}
+        self._total_length = 0
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._doc_lengths)
+
+    def add(self, ids: Iterable[str], texts: Iterable[str]):
+        with self._lock:
+            for doc_id, text in zip(ids, texts):
+                self._remove(doc_id)
+                terms = Counter(tokenize(text))
+                for term, count in terms.items():
+                    self._postings.setdefault(term, {})[doc_id] = count
+                self._doc_terms[doc_id] = terms
+                length = sum(terms.values())
+                self._doc_lengths[doc_id] = length
+                self._total_length += length
+
+    def remove(self, ids: Iterable[str]):
+        with self._lock:
+            for doc_id in ids:
+                self._remove(doc_id)
+
+    def _remove(self, doc_id: str):
+        terms = self._doc_terms.pop(doc_id, None)
+        if terms is None:
+            return
+        for term in terms:
+            postings = self._postings[term]
+            del postings[doc_id]
+            if not postings:
+                del self._postings[term]
+        self._total_length -= self._doc_lengths.pop(doc_id)
+
+    def search(self, query: str, k: int = 5, allowed: Optional[Set[str]] = None) -> List[Tuple[str, float]]:
+        """Return up to k (id, score) pairs, best first, only among `allowed` IDs if given."""
+        with self._lock:
+            doc_count = len(self._doc_lengths)
+            if not doc_count:
+                return []
+            average_length = self._total_length / doc_count
+
+            scores: Dict[str, float] = {}
+            for term in set(tokenize(query)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, frequency in postings.items():
+                    if allowed is not None and doc_id not in allowed:
+                        continue
+                    norm = self.k1 * (1 - self.b + self.b * self._doc_lengths[doc_id] / average_length)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
@@ -0,0 +1,171 @@
+import re
+from typing import Any, Dict, List, Optional, Set
+
+import numpy as np
+
+_WORD = re.compile(r'\w+')
+
+
+class ChunkMerger:
+    """
+    Post-retrieval cleanup of the top-k chunks before they go into a prompt.
+
+    Chunks are cut with overlap, so a search often returns neighbouring chunks
+    of the same file that repeat each other's edges. Chunks of one source whose
+    character spans (start_char/end_char) overlap or touch are merged into one,
+    keeping the overlapping text once; chunks without offsets are merged when
+    their chunk_ids are consecutive and the text overlap can be found.
+
+    Afterwards, a chunk is dropped as a near-duplicate of a better-scoring one
+    when most of its word shingles appear in it (text_threshold), or when
+    their embeddings are nearly identical (embedding_threshold, only used when
+    the search returned embeddings).
+    """
+
+    SHINGLE_SIZE = 5
+
+    def __init__(self, text_threshold: float = 0.85, embedding_threshold: float = 0.97):
+        self.text_threshold = text_threshold
+        self.embedding_threshold = embedding_threshold
+        self.merged_chunks = 0
+        self.duplicate_chunks = 0
+
+    @property
+    def uses_embeddings(self) -> bool:
+        return self.embedding_threshold > 0
+
+    def process(self, docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Merge adjacent chunks and drop near-duplicates.
+
+        Args:
+            docs: Search results (dicts with 'id', 'content', 'metadata',
+                'score' and optionally 'embedding')
+
+        Returns:
+            Distinct chunks, best score first, without 'embedding'
+        """
+        merged = self.merge_adjacent(docs)
+        distinct = self.drop_duplicates(merged)
+        for doc in distinct:
+            doc.pop('embedding', None)
+        return distinct
+
+    def merge_adjacent(self, docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        by_source: Dict[Any, List[Dict[str, Any]]] = {}
+        for doc in docs:
+            by_source.setdefault(doc.get('metadata', {}).get('source'), []).append(doc)
+
+        result = []
+        for source, group in by_source.items():
+            if source is None or len(group) == 1:
+                result.extend(group)
+                continue
+            group.sort(key=self._position)
+            current = group[0]
+            for doc in group[1:]:
+                combined = self._join(current, doc)
+                if combined is None:
+                    result.append(current)
+                    current = doc
+                else:
+                    self.merged_chunks += 1
+                    current = combined
+            result.append(current)
+
+        result.sort(key=lambda d: d.get('score', 0.0), reverse=True)
+        return result
+
+    def drop_duplicates(self, docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        kept = []
+        kept_shingles: List[Set[tuple]] = []
+        kept_vectors: List[Optional[np.ndarray]] = []
+        for doc in sorted(docs, key=lambda d: d.get('score', 0.0), reverse=True):
+            shingles = self._shingles(doc.get('content', ''))
+            vector = self._normalize(doc.get('embedding')) if self.uses_embeddings else None
+            if any(self._is_duplicate(shingles, vector, other_shingles, other_vector)
+                   for other_shingles, other_vector in zip(kept_shingles, kept_vectors)):
+                self.duplicate_chunks += 1
+                continue
+            kept.append(doc)
+            kept_shingles.append(shingles)
+            kept_vectors.append(vector)
+        return kept
+
+    def stats(self) -> Dict[str, int]:
+        return {"merged_chunks": self.merged_chunks, "duplicate_chunks": self.duplicate_chunks}
+
+    @staticmethod
+    def _position(doc: Dict[str, Any]) -> tuple:
+        metadata = doc.get('metadata', {})
+        return (metadata.get('start_char', -1), metadata.get('chunk_id', -1))
+
+    def _join(self, first: Dict[str, Any], second: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Merge `second` onto the end of `first`, or None if they are not adjacent."""
+        a, b = first.get('metadata', {}), second.get('metadata', {})
+        first_text, second_text = first.get('content', ''), second.get('content', '')
+
+        if all(key in meta for meta in (a, b) for key in ('start_char', 'end_char')):
+            if b['start_char'] > a['end_char']:
+                return None
+            # Offsets index the same source text, so the overlap is known exactly
+            if b['end_char'] <= a['end_char']:
+                content = first_text
+            else:
+                content = first_text + second_text[a['end_char'] - b['start_char']:]
+            end_char = max(a['end_char'], b['end_char'])
+        elif a.get('chunk_id') is not None and b.get('chunk_id') == a['chunk_id'] + 1:
+            overlap = self._text_overlap(first_text, second_text)
+            if overlap == 0:
+                return None
+            content = first_text + second_text[overlap:]
+            end_char = None
+        else:
+            return None
+
+        metadata = dict(a)
+        if end_char is not None:
+            metadata['end_char'] = end_char
+        merged = {
+            **first,
+            'content': content,
+            'metadata': metadata,
+            'score': max(first.get('score', 0.0), second.get('score', 0.0)),
+            'merged_ids': first.get('merged_ids', [first.get('id')]) + [second.get('id')]
+        }
+        # Keep the embedding of the better match for duplicate detection
+        if second.get('score', 0.0) > first.get('score', 0.0) and 'embedding' in second:
+            merged['embedding'] = second['embedding']
+        return merged
+
+    @staticmethod
+    def _text_overlap(first: str, second: str) -> int:
+        """Length of the longest suffix of `first` that is a prefix of `second`."""
+        for length in range(min(len(first), len(second)), 0, -1):
+            if first.endswith(second[:length]):
+                return length
+        return 0
+
+    def _shingles(self, text: str) -> Set[tuple]:
+        words = _WORD.findall(text.lower())
+        if len(words) <= self.SHINGLE_SIZE:
+            return {tuple(words)}
+        return {tuple(words[i:i + self.SHINGLE_SIZE]) for i in range(len(words) - self.SHINGLE_SIZE + 1)}
+
+    @staticmethod
+    def _normalize(embedding) -> Optional[np.ndarray]:
+        if embedding is None:
+            return None
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _is_duplicate(self, shingles, vector, other_shingles, other_vector) -> bool:
+        if self.text_threshold > 0 and shingles and other_shingles:
+            # Containment rather than Jaccard, so a chunk inside a longer one counts
+            shared = len(shingles & other_shingles)
+            if shared / min(len(shingles), len(other_shingles)) >= self.text_threshold:
+                return True
+        if vector is not None and other_vector is not None:
+            return float(vector @ other_vector) >= self.embedding_threshold
+        return False
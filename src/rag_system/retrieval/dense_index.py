@@ -0,0 +1,359 @@
+import hashlib
+import json
+import os
+from threading import Lock
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+from .metadata_filter import MetadataIndex
+
+# Set bits per byte value, for Hamming distances between packed binary codes
+_POPCOUNT = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+
+def chunk_fingerprint(chunks: Iterable[Tuple[str, str, Dict[str, Any]]]) -> str:
+    """
+    Order-independent digest of (id, text, metadata) chunks, so a saved index
+    can tell whether the collection changed since it was written.
+    """
+    digests = sorted(
+        hashlib.sha256(json.dumps([doc_id, document, metadata], sort_keys=True, default=str).encode("utf-8")).digest()
+        for doc_id, document, metadata in chunks
+    )
+    return hashlib.sha256(b"".join(digests)).hexdigest()
+
+
+class DenseIndex:
+    """
+    Exact in-memory vector search over all chunk embeddings.
+
+    Normalized embeddings live in one contiguous float32 (or float16) matrix,
+    so a query is a single matrix product plus argpartition; at a few
+    thousand chunks this is exact and faster than a Chroma/HNSW round trip.
+    With faiss="flat" or "ivf" the matrix is searched through a FAISS index
+    instead, for larger corpora.
+
+    With quantization="int8" (per-dimension scalar quantization, 4x smaller)
+    or "binary" (sign bits, 32x smaller) the first pass runs over the compact
+    codes only; the best rescore_factor * k candidates are then rescored
+    with their exact float vectors, read from the memory-mapped matrix, so
+    the float matrix does not need to stay in RAM.
+
+    Chunk texts and metadata are held alongside, so search results need no
+    database reads. A `where` filter is resolved to matching rows through a
+    MetadataIndex over filter_fields first, and only those rows are scored.
+    The matrix is saved as a .npy file (opened memory-mapped) with the IDs,
+    texts, metadata and their chunk_fingerprint() in a JSON file next to it.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        dtype: str = "float32",
+        faiss: Optional[str] = None,
+        ivf_lists: int = 0,
+        ivf_probe: int = 8,
+        quantization: str = "none",
+        rescore_factor: int = 4,
+        filter_fields: Iterable[str] = ("source", "file_type", "file_name")
+    ):
+        self.matrix_path = path + ".npy"
+        self.records_path = path + ".json"
+        self.dtype = np.dtype(dtype)
+        self.faiss = faiss
+        self.ivf_lists = ivf_lists
+        self.ivf_probe = ivf_probe
+        self.quantization = quantization
+        self.rescore_factor = rescore_factor
+        self._matrix = None
+        self._codes = None
+        self._scale = None
+        self._ids: List[str] = []
+        self._positions: Dict[str, int] = {}
+        self._documents: List[str] = []
+        self._metadatas: List[Dict[str, Any]] = []
+        self._faiss_index = None
+        self.filter_fields = list(filter_fields)
+        self._metadata_index = MetadataIndex(self.filter_fields)
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def ids(self) -> List[str]:
+        return list(self._ids)
+
+    def documents(self) -> List[str]:
+        return list(self._documents)
+
+    def load(self, expected_fingerprint: Optional[str] = None) -> bool:
+        """
+        Open the saved index. Returns False (leaving the index empty) when
+        there is none, or its chunks do not match expected_fingerprint.
+        """
+        if not (os.path.exists(self.matrix_path) and os.path.exists(self.records_path)):
+            return False
+        with open(self.records_path, encoding="utf-8") as f:
+            records = json.load(f)
+        if expected_fingerprint is not None and records.get("fingerprint") != expected_fingerprint:
+            return False
+        matrix = np.load(self.matrix_path, mmap_mode="r")
+        if matrix.dtype != self.dtype or matrix.shape[0] != len(records["ids"]):
+            return False
+        with self._lock:
+            self._set(matrix, records["ids"], records["documents"], records["metadatas"])
+        return True
+
+    def save(self):
+        with self._lock:
+            matrix, ids, documents, metadatas = self._matrix, self._ids, self._documents, self._metadatas
+        if matrix is None:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.matrix_path)), exist_ok=True)
+        fingerprint = chunk_fingerprint(zip(ids, documents, metadatas))
+        # Write then rename, so a crash never leaves a half-written index
+        np.save(self.matrix_path + ".tmp.npy", np.asarray(matrix))
+        with open(self.records_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"ids": ids, "documents": documents, "metadatas": metadatas, "fingerprint": fingerprint}, f)
+        os.replace(self.matrix_path + ".tmp.npy", self.matrix_path)
+        os.replace(self.records_path + ".tmp", self.records_path)
+        with self._lock:
+            # Unchanged since the snapshot: serve it from the file so the OS can page it out
+            if self._matrix is matrix and not isinstance(matrix, np.memmap):
+                self._matrix = np.load(self.matrix_path, mmap_mode="r")
+
+    def memory_usage(self) -> Dict[str, int]:
+        """Bytes of the structure scanned per query, and of the full float matrix."""
+        with self._lock:
+            self._build_derived()
+            matrix, codes = self._matrix, self._codes
+        matrix_bytes = int(matrix.nbytes) if matrix is not None else 0
+        return {
+            "search_bytes": int(codes.nbytes) if codes is not None else matrix_bytes,
+            "matrix_bytes": matrix_bytes
+        }
+
+    def delete_files(self):
+        with self._lock:
+            self._set(None, [], [], [])
+        for path in (self.matrix_path, self.records_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def add(
+        self,
+        ids: List[str],
+        embeddings: Iterable[List[float]],
+        documents: List[str],
+        metadatas: List[Dict[str, Any]]
+    ):
+        """Add chunks; a chunk with an existing ID replaces the old one."""
+        vectors = self._normalize(np.asarray(embeddings, dtype=np.float32)).astype(self.dtype)
+        # Last occurrence wins for IDs repeated within one batch
+        latest = {doc_id: i for i, doc_id in enumerate(ids)}
+        with self._lock:
+            keep = [i for i, doc_id in enumerate(self._ids) if doc_id not in latest]
+            new = sorted(latest.values())
+            old = self._matrix[keep] if self._matrix is not None else np.empty((0, vectors.shape[1]), self.dtype)
+            self._set(
+                np.concatenate([old, vectors[new]]),
+                [self._ids[i] for i in keep] + [ids[i] for i in new],
+                [self._documents[i] for i in keep] + [documents[i] for i in new],
+                [self._metadatas[i] for i in keep] + [metadatas[i] for i in new]
+            )
+
+    def remove(self, ids: Iterable[str]):
+        removed = set(ids)
+        with self._lock:
+            keep = [i for i, doc_id in enumerate(self._ids) if doc_id not in removed]
+            if len(keep) == len(self._ids):
+                return
+            self._set(
+                self._matrix[keep],
+                [self._ids[i] for i in keep],
+                [self._documents[i] for i in keep],
+                [self._metadatas[i] for i in keep]
+            )
+
+    def get(self, ids: List[str], include_embeddings: bool = False) -> List[Dict[str, Any]]:
+        """Chunks by ID (unknown IDs are skipped), in the given order."""
+        with self._lock:
+            matrix, positions = self._matrix, self._positions
+            documents, metadatas = self._documents, self._metadatas
+        return [
+            self._record(positions[doc_id], doc_id, matrix, documents, metadatas, None, include_embeddings)
+            for doc_id in ids if doc_id in positions
+        ]
+
+    def ids_matching(self, where: Dict[str, Any]) -> Set[str]:
+        with self._lock:
+            self._build_derived()
+            ids, metadata_index = self._ids, self._metadata_index
+        return {ids[position] for position in metadata_index.positions(where)}
+
+    def search(
+        self,
+        query_embeddings: List[List[float]],
+        k: int = 5,
+        include_embeddings: bool = False,
+        where: Optional[Dict[str, Any]] = None
+    ) -> List[List[Dict[str, Any]]]:
+        """Top-k chunks per query by cosine similarity, best first, among those matching `where`."""
+        with self._lock:
+            self._build_derived()
+            matrix, ids = self._matrix, self._ids
+            documents, metadatas = self._documents, self._metadatas
+            faiss_index = self._faiss_index
+            codes, scale = self._codes, self._scale
+            metadata_index = self._metadata_index
+            if faiss_index is None and self.faiss and matrix is not None and not where:
+                faiss_index = self._faiss_index = self._build_faiss(matrix)
+
+        if matrix is None or not ids:
+            return [[] for _ in query_embeddings]
+        subset = metadata_index.positions(where) if where else None
+        if subset is not None and not len(subset):
+            return [[] for _ in query_embeddings]
+        queries = self._normalize(np.asarray(query_embeddings, dtype=np.float32))
+        k = min(k, len(ids) if subset is None else len(subset))
+
+        results = []
+        if faiss_index is not None and subset is None:
+            scores, positions = faiss_index.search(queries, k)
+            top_k = list(zip(positions, scores))
+        elif codes is not None:
+            top_k = self._rescored_top_k(queries, k, matrix, codes, scale, subset)
+        else:
+            # Filtered searches score only the matching rows, exactly
+            top_k = self._exact_top_k(queries, k, matrix, subset)
+
+        for query_positions, query_scores in top_k:
+            results.append([
+                self._record(position, ids[position], matrix, documents, metadatas, float(score), include_embeddings)
+                for position, score in zip(query_positions, query_scores) if position >= 0
+            ])
+        return results
+
+    def _exact_top_k(self, queries: np.ndarray, k: int, matrix, subset=None) -> List[Tuple[np.ndarray, np.ndarray]]:
+        rows = matrix if subset is None else matrix[subset]
+        # (chunks x queries) similarities in one product
+        similarities = np.asarray(rows @ queries.T.astype(self.dtype), dtype=np.float32)
+        results = []
+        for column in similarities.T:
+            positions, scores = self._best(column, k)
+            results.append((positions if subset is None else subset[positions], scores))
+        return results
+
+    def _rescored_top_k(
+        self,
+        queries: np.ndarray,
+        k: int,
+        matrix,
+        codes,
+        scale,
+        subset=None
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        if subset is not None:
+            codes = codes[subset]
+        candidates = min(len(codes), k * self.rescore_factor)
+        if self.quantization == "binary":
+            query_bits = np.packbits(queries > 0, axis=1)
+            # Fewer differing sign bits = more similar
+            approximate = np.stack(
+                [-_POPCOUNT[codes ^ bits].sum(axis=1, dtype=np.int32) for bits in query_bits], axis=1
+            )
+        else:
+            approximate = self._int8_scores(codes, queries * scale)
+
+        results = []
+        for query, column in zip(queries, approximate.T):
+            positions, _ = self._best(column, candidates)
+            if subset is not None:
+                positions = subset[positions]
+            # Sorted reads are friendlier to the memory-mapped matrix
+            positions = np.sort(positions)
+            exact = np.asarray(matrix[positions], dtype=np.float32) @ query
+            best, scores = self._best(exact, k)
+            results.append((positions[best], scores))
+        return results
+
+    @staticmethod
+    def _int8_scores(codes: np.ndarray, scaled_queries: np.ndarray, block_rows: int = 8192) -> np.ndarray:
+        # Dequantize a block at a time so no full float copy is made
+        return np.concatenate([
+            codes[start:start + block_rows].astype(np.float32) @ scaled_queries.T
+            for start in range(0, len(codes), block_rows)
+        ])
+
+    @staticmethod
+    def _best(scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return top, scores[top]
+
+    def _quantize(self, matrix) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+        if self.quantization == "none" or matrix is None or not len(matrix):
+            return None, None
+        if self.quantization == "binary":
+            return np.packbits(np.asarray(matrix) > 0, axis=1), None
+        vectors = np.asarray(matrix, dtype=np.float32)
+        scale = np.abs(vectors).max(axis=0) / 127
+        scale[scale == 0] = 1
+        return np.round(vectors / scale).astype(np.int8), scale
+
+    def _build_faiss(self, matrix):
+        try:
+            import faiss
+        except ImportError:
+            raise RuntimeError("VECTOR_INDEX=faiss requires faiss-cpu (pip install faiss-cpu)")
+
+        vectors = np.ascontiguousarray(matrix, dtype=np.float32)
+        dim = vectors.shape[1]
+        lists = self.ivf_lists or int(np.sqrt(len(vectors)))
+        if self.faiss == "ivf" and len(vectors) >= lists * 39:
+            # IVF needs enough vectors per list to train; smaller corpora stay exact
+            quantizer = faiss.IndexFlatIP(dim)
+            index = faiss.IndexIVFFlat(quantizer, dim, lists, faiss.METRIC_INNER_PRODUCT)
+            index.train(vectors)
+            index.nprobe = self.ivf_probe
+        else:
+            index = faiss.IndexFlatIP(dim)
+        index.add(vectors)
+        return index
+
+    def _set(self, matrix, ids, documents, metadatas):
+        # Searches hold references to the old arrays, so replace rather than mutate
+        self._matrix = matrix
+        self._ids = ids
+        self._positions = {doc_id: i for i, doc_id in enumerate(ids)}
+        self._documents = documents
+        self._metadatas = metadatas
+        self._faiss_index = None
+        # Built on first use, so a run of writes does not rebuild them each time
+        self._codes = self._scale = None
+        self._metadata_index = None
+
+    def _build_derived(self):
+        """Build the quantized codes and metadata index if missing. Call with _lock held."""
+        if self._metadata_index is None:
+            self._codes, self._scale = self._quantize(self._matrix)
+            self._metadata_index = MetadataIndex(self.filter_fields, self._metadatas)
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.where(norms > 0, norms, 1)
+
+    @staticmethod
+    def _record(position, doc_id, matrix, documents, metadatas, score, include_embeddings) -> Dict[str, Any]:
+        record = {
+            'id': doc_id,
+            'content': documents[position],
+            'metadata': metadatas[position]
+        }
+        if score is not None:
+            record['score'] = score
+        if include_embeddings:
+            record['embedding'] = np.asarray(matrix[position], dtype=np.float32).tolist()
+        return record
@@ -0,0 +1,123 @@
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+import numpy as np
+
+_COMPARISONS: Dict[str, Callable[[Any, Any], bool]] = {
+    "$eq": lambda value, target: value == target,
+    "$ne": lambda value, target: value != target,
+    "$gt": lambda value, target: value is not None and value > target,
+    "$gte": lambda value, target: value is not None and value >= target,
+    "$lt": lambda value, target: value is not None and value < target,
+    "$lte": lambda value, target: value is not None and value <= target,
+    "$in": lambda value, target: value in target,
+    "$nin": lambda value, target: value not in target,
+}
+
+
+def validate_where(where: Dict[str, Any]):
+    """Raise ValueError unless `where` is a Chroma-style metadata filter."""
+    if not isinstance(where, dict) or not where:
+        raise ValueError("where must be a non-empty object")
+    for key, condition in where.items():
+        if key in ("$and", "$or"):
+            if not isinstance(condition, list) or not condition:
+                raise ValueError(f"{key} takes a non-empty list of filters")
+            for clause in condition:
+                validate_where(clause)
+        elif key.startswith("$"):
+            raise ValueError(f"Unsupported filter operator: {key}")
+        elif isinstance(condition, dict):
+            if len(condition) != 1 or next(iter(condition)) not in _COMPARISONS:
+                raise ValueError(f"Filter on {key!r} needs exactly one of {', '.join(_COMPARISONS)}")
+            operator, target = next(iter(condition.items()))
+            if operator in ("$in", "$nin") and not isinstance(target, list):
+                raise ValueError(f"{operator} on {key!r} takes a list")
+
+
+def normalize_where(where: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Rewrite several top-level conditions ({"a": 1, "b": 2}) as one $and, the
+    only form Chroma accepts, recursively.
+    """
+    clauses = []
+    for key, condition in where.items():
+        if key in ("$and", "$or"):
+            condition = [normalize_where(clause) for clause in condition]
+            if len(condition) == 1:
+                clauses.append(condition[0])
+                continue
+        clauses.append({key: condition})
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+class MetadataIndex:
+    """
+    Inverted index (field -> value -> chunk positions) over chunk metadata.
+
+    Evaluates Chroma-style `where` filters ({"source": "a.pdf"},
+    {"chunk_size": {"$gte": 800}}, {"$and": [...]}, {"$or": [...]}) to the
+    positions of matching chunks, so vector scoring only runs over those.
+    Equality and $in conditions on indexed fields are answered from the
+    index; anything else scans the metadata of the remaining candidates.
+
+    Never modified after construction: build a new index when the metadata
+    changes, so searches holding the old one still see a consistent view.
+    """
+
+    def __init__(self, fields: Iterable[str], metadatas: Optional[List[Dict[str, Any]]] = None):
+        self.fields = set(fields)
+        self._metadatas: List[Dict[str, Any]] = metadatas or []
+        self._postings: Dict[str, Dict[Any, List[int]]] = {field: {} for field in self.fields}
+        for position, metadata in enumerate(self._metadatas):
+            for field in self.fields:
+                if field in metadata:
+                    self._postings[field].setdefault(metadata[field], []).append(position)
+
+    def positions(self, where: Dict[str, Any]) -> np.ndarray:
+        """Sorted positions of the chunks matching `where`."""
+        matched = self._match(where, None)
+        if matched is None:
+            return np.arange(len(self._metadatas))
+        return np.fromiter(sorted(matched), dtype=np.int64, count=len(matched))
+
+    def _match(self, where: Dict[str, Any], candidates: Optional[Set[int]]) -> Optional[Set[int]]:
+        # Indexed conditions first: they narrow the candidates the others scan
+        conditions = sorted(where.items(), key=lambda item: not self._indexed(*item))
+        for key, condition in conditions:
+            if key == "$and":
+                for clause in condition:
+                    candidates = self._match(clause, candidates)
+            elif key == "$or":
+                matched = set()
+                for clause in condition:
+                    clause_matches = self._match(clause, candidates)
+                    if clause_matches is None:
+                        clause_matches = set(range(len(self._metadatas)))
+                    matched |= clause_matches
+                candidates = matched
+            else:
+                candidates = self._match_field(key, condition, candidates)
+        return candidates
+
+    def _indexed(self, key: str, condition: Any) -> bool:
+        operator = next(iter(condition)) if isinstance(condition, dict) else "$eq"
+        return key in self.fields and operator in ("$eq", "$in")
+
+    def _match_field(self, field: str, condition: Any, candidates: Optional[Set[int]]) -> Set[int]:
+        operator, target = next(iter(condition.items())) if isinstance(condition, dict) else ("$eq", condition)
+        if self._indexed(field, condition):
+            values = target if operator == "$in" else [target]
+            matched = set()
+            for value in values:
+                matched.update(self._postings[field].get(value, ()))
+            return matched if candidates is None else matched & candidates
+
+        compare = _COMPARISONS[operator]
+        scan = range(len(self._metadatas)) if candidates is None else candidates
+        matched = set()
+        for position in scan:
+            metadata = self._metadatas[position]
+            # Like Chroma, a chunk without the field never matches
+            if field in metadata and compare(metadata[field], target):
+                matched.add(position)
+        return matched
@@ -0,0 +1,91 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class CrossEncoderReranker:
+    """
+    Re-scores retrieved chunks with a small cross-encoder on the CPU.
+
+    A cross-encoder reads the question and the chunk together, which ranks far
+    more precisely than comparing two independently computed embeddings, so a
+    larger candidate set can be cut down to the few chunks worth prompting
+    with. All uncached (question, chunk) pairs of a request are scored in one
+    batched predict() call; scores are kept in an LRU cache keyed by
+    (question, chunk id), which the owner clears when the collection changes.
+    """
+
+    def __init__(self, model_name: str = "cross-encoder/ms-marco-MiniLM-L-6-v2", batch_size: int = 32, cache_size: int = 10000):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self._model = None
+        self._model_lock = Lock()
+        self._cache: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        self._cache_lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def load_model(self):
+        """Load the CrossEncoder (imports sentence_transformers on first call)."""
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    from sentence_transformers import CrossEncoder
+                    # CPU like the embedding model; the GPU is kept for the LLM
+                    self._model = CrossEncoder(self.model_name, device='cpu')
+        return self._model
+
+    def rerank(self, query: str, docs: List[Dict[str, Any]], top_k: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Order docs by cross-encoder score and keep the best top_k.
+
+        Args:
+            query: The user's question
+            docs: Candidate chunks (dicts with 'id' and 'content')
+            top_k: Number of chunks to return (all when None)
+
+        Returns:
+            Copies of the best chunks, best first; 'score' holds the rerank
+            score and 'retrieval_score' the score from the search.
+        """
+        scores: Dict[int, float] = {}
+        pending = []
+        with self._cache_lock:
+            for i, doc in enumerate(docs):
+                key = (query, doc['id'])
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    scores[i] = self._cache[key]
+                    self.hits += 1
+                else:
+                    pending.append(i)
+                    self.misses += 1
+
+        if pending:
+            predicted = self.load_model().predict(
+                [(query, docs[i].get('content', '')) for i in pending],
+                batch_size=self.batch_size,
+                show_progress_bar=False
+            )
+            with self._cache_lock:
+                for i, score in zip(pending, predicted):
+                    scores[i] = float(score)
+                    self._cache[(query, docs[i]['id'])] = scores[i]
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+        order = sorted(range(len(docs)), key=lambda i: scores[i], reverse=True)[:top_k]
+        return [{**docs[i], 'score': scores[i], 'retrieval_score': docs[i].get('score')} for i in order]
+
+    def clear(self):
+        with self._cache_lock:
+            self._cache.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cache_lock:
+            return {
+                "entries": len(self._cache),
+                "hits": self.hits,
+                "misses": self.misses
+            }
@@ -1,20 +1,165 @@
-import chromadb
-from sentence_transformers import SentenceTransformer
-from typing import List, Dict, Any
+from itertools import islice
+from threading import Lock
+from typing import List, Dict, Any, Callable, Iterable, Optional
 import os
+import numpy as np
 from dotenv import load_dotenv
+from .bm25_index import BM25Index
+from .dense_index import DenseIndex, chunk_fingerprint
+from .embedding_cache import EmbeddingCache
+from .metadata_filter import normalize_where, validate_where
 
 load_dotenv()
 
 class VectorStore:
     def __init__(self, persist_directory: str = None):
         self.persist_directory = persist_directory or os.getenv("VECTOR_DB_PATH", "data/vectorstore")
-        self.client = chromadb.PersistentClient(path=self.persist_directory)
-        # Force embedding model to CPU to save GPU memory for LLM
-        self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2', device='cpu')
+        # The Chroma client and embedding model are created on first use (or by
+        # connect()/load_embedding_model()), so constructing a VectorStore is cheap
+        self._client = None
+        self._client_lock = Lock()
+        self.embedding_model_name = 'all-MiniLM-L6-v2'
+        self._embedding_model = None
+        self._embedding_model_lock = Lock()
+        self.embedding_cache = None
+        if os.getenv("EMBEDDING_CACHE", "true").lower() == "true":
+            self.embedding_cache = EmbeddingCache(
+                os.path.join(self.persist_directory, "embedding_cache.sqlite")
+            )
         self.collection_name = "documents"
         self.collection = None
+        # Written by incremental ingestion; describes what the collection holds
+        self.manifest_path = os.path.join(self.persist_directory, "ingest_manifest.json")
+        self.batch_size = int(os.getenv("EMBEDDING_BATCH_SIZE", "256"))
+        # Bumped on every write so caches built on search results can invalidate
+        self.revision = 0
+        # dense: embeddings only; hybrid: embeddings fused with BM25 keyword ranking
+        self.search_mode = os.getenv("RETRIEVAL_MODE", "hybrid").lower()
+        # Each ranking contributes this many times k candidates to the fusion
+        self.hybrid_candidates = int(os.getenv("HYBRID_CANDIDATE_FACTOR", "3"))
+        self.rrf_k = int(os.getenv("RRF_K", "60"))
+        # Built from the collection on first hybrid search, then kept in sync on writes
+        self.sparse_index = None
+        self._sparse_lock = Lock()
+        # Where dense search runs: chroma (HNSW), numpy (exact, in memory) or faiss
+        self.index_backend = os.getenv("VECTOR_INDEX", "chroma").lower()
+        self.dense_index = None
+        self._dense_lock = Lock()
+        # Saved as dense_index.npy/.json; checked against the collection on load
+        self.dense_index_path = os.path.join(self.persist_directory, "dense_index")
+        # Metadata fields the in-memory index keeps value -> chunk lookups for
+        self.filter_fields = [
+            field.strip() for field in os.getenv("FILTER_INDEX_FIELDS", "source,file_type,file_name").split(",")
+            if field.strip()
+        ]
         
+    @property
+    def client(self):
+        return self.connect()
+
+    @property
+    def embedding_model(self):
+        return self.load_embedding_model()
+
+    def connect(self):
+        """Open the Chroma client (imports chromadb on first call)."""
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    import chromadb
+                    self._client = chromadb.PersistentClient(path=self.persist_directory)
+        return self._client
+
+    def load_embedding_model(self):
+        """Load the SentenceTransformer (imports sentence_transformers on first call)."""
+        if self._embedding_model is None:
+            with self._embedding_model_lock:
+                if self._embedding_model is None:
+                    from sentence_transformers import SentenceTransformer
+                    # Force embedding model to CPU to save GPU memory for LLM
+                    self._embedding_model = SentenceTransformer(self.embedding_model_name, device='cpu')
+        return self._embedding_model
+
+    def prepare_search(self):
+        """Open the collection and load the in-memory search indexes in use."""
+        self.initialize_collection()
+        if self.index_backend != "chroma":
+            self.load_dense_index()
+        if self.search_mode == "hybrid":
+            self.load_sparse_index()
+
+    def load_dense_index(self) -> DenseIndex:
+        """
+        Open the in-memory dense index (VECTOR_INDEX=numpy/faiss), rebuilding
+        it from the collection when the saved copy is missing or out of date.
+        """
+        if self.dense_index is None:
+            with self._dense_lock:
+                if self.dense_index is None:
+                    if self.collection is None:
+                        self.initialize_collection()
+                    index = DenseIndex(
+                        self.dense_index_path,
+                        dtype=os.getenv("DENSE_INDEX_DTYPE", "float32"),
+                        faiss=os.getenv("FAISS_INDEX", "flat") if self.index_backend == "faiss" else None,
+                        ivf_lists=int(os.getenv("FAISS_IVF_LISTS", "0")),
+                        ivf_probe=int(os.getenv("FAISS_IVF_PROBE", "8")),
+                        quantization=os.getenv("EMBEDDING_QUANTIZATION", "none").lower(),
+                        rescore_factor=int(os.getenv("RESCORE_FACTOR", "4")),
+                        filter_fields=self.filter_fields
+                    )
+                    if not index.load(expected_fingerprint=self._collection_fingerprint()):
+                        for page in self._iter_collection(['documents', 'metadatas', 'embeddings']):
+                            index.add(page['ids'], page['embeddings'], page['documents'], page['metadatas'])
+                        index.save()
+                    self.dense_index = index
+        return self.dense_index
+
+    def _collection_fingerprint(self) -> str:
+        """chunk_fingerprint() of the collection's current IDs, texts and metadata."""
+        return chunk_fingerprint(
+            chunk
+            for page in self._iter_collection(['documents', 'metadatas'])
+            for chunk in zip(page['ids'], page['documents'], page['metadatas'])
+        )
+
+    def _invalidate_saved_dense_index(self):
+        """
+        Delete the saved dense index after a write it did not see (it is not
+        loaded in this process), so it is rebuilt rather than served stale.
+        Call with _dense_lock held.
+        """
+        if self.dense_index is None:
+            DenseIndex(self.dense_index_path).delete_files()
+
+    def _iter_collection(self, include: List[str]) -> Iterable[Dict[str, Any]]:
+        """Read the whole collection page by page."""
+        page_size = self.write_batch_size()
+        offset = 0
+        while True:
+            page = self.collection.get(include=include, limit=page_size, offset=offset)
+            if not page['ids']:
+                return
+            yield page
+            offset += len(page['ids'])
+
+    def load_sparse_index(self) -> BM25Index:
+        """Build the BM25 index from every chunk in the collection (once)."""
+        if self.sparse_index is None:
+            with self._sparse_lock:
+                if self.sparse_index is None:
+                    if self.collection is None:
+                        self.initialize_collection()
+                    index = BM25Index()
+                    if self.dense_index is not None:
+                        # Texts are already in memory
+                        index.add(self.dense_index.ids(), self.dense_index.documents())
+                    else:
+                        for page in self._iter_collection(['documents']):
+                            index.add(page['ids'], page['documents'])
+                    self.sparse_index = index
+        return self.sparse_index
+
     def initialize_collection(self):
         try:
             self.collection = self.client.get_collection(self.collection_name)
@@ -25,45 +170,330 @@ class VectorStore:
             )
     
     def add_documents(self, texts: List[str], metadatas: List[Dict[str, Any]] = None, ids: List[str] = None):
-        if self.collection is None:
-            self.initialize_collection()
-            
-        embeddings = self.embedding_model.encode(texts).tolist()
-        
         if ids is None:
             ids = [f"doc_{i}" for i in range(len(texts))]
         if metadatas is None:
             metadatas = [{"source": "unknown"} for _ in texts]
-            
-        self.collection.add(
+
+        for start in range(0, len(texts), self.write_batch_size()):
+            end = start + self.write_batch_size()
+            self._write_batch(texts[start:end], metadatas[start:end], ids[start:end], upsert=False)
+        self.save_dense_index()
+    
+    def upsert_documents(self, texts: List[str], metadatas: List[Dict[str, Any]], ids: List[str]):
+        """
+        Insert chunks, overwriting any existing chunks with the same IDs.
+
+        Does not save the dense index; call save_dense_index() once the
+        whole run of writes is done.
+        """
+        for start in range(0, len(texts), self.write_batch_size()):
+            end = start + self.write_batch_size()
+            self._write_batch(texts[start:end], metadatas[start:end], ids[start:end], upsert=True)
+
+    def add_documents_stream(
+        self,
+        documents: Iterable[Dict[str, Any]],
+        upsert: bool = True,
+        progress: Optional[Callable[[int], None]] = None
+    ) -> int:
+        """
+        Embed and write chunk dicts ({'id', 'content', 'metadata'}) from any
+        iterable, one fixed-size batch at a time, so memory stays bounded no
+        matter how large the corpus is.
+
+        Calls progress(total_written) after every batch and returns the total.
+        """
+        documents = iter(documents)
+        total = 0
+        while True:
+            batch = list(islice(documents, self.write_batch_size()))
+            if not batch:
+                self.save_dense_index()
+                return total
+            self._write_batch(
+                [doc['content'] for doc in batch],
+                [doc['metadata'] for doc in batch],
+                [doc['id'] for doc in batch],
+                upsert=upsert
+            )
+            total += len(batch)
+            if progress is not None:
+                progress(total)
+
+    def write_batch_size(self) -> int:
+        """Embedding batch size, capped at the most records Chroma accepts per call."""
+        return min(self.batch_size, self._max_chroma_batch_size())
+
+    def _max_chroma_batch_size(self) -> int:
+        if hasattr(self.client, "get_max_batch_size"):
+            return self.client.get_max_batch_size()
+        return getattr(self.client, "max_batch_size", self.batch_size)
+
+    def _write_batch(self, texts: List[str], metadatas: List[Dict[str, Any]], ids: List[str], upsert: bool):
+        if self.collection is None:
+            self.initialize_collection()
+        if not texts:
+            return
+
+        embeddings = self.embed_documents(texts)
+        write = self.collection.upsert if upsert else self.collection.add
+        write(
             embeddings=embeddings,
             documents=texts,
             metadatas=metadatas,
             ids=ids
         )
-    
-    def similarity_search(self, query: str, k: int = 5) -> List[Dict[str, Any]]:
+        self.revision += 1
+        # Chroma is written first, so a concurrent index build either saw the
+        # chunks already or finishes before these updates
+        with self._dense_lock:
+            if self.dense_index is not None:
+                self.dense_index.add(ids, embeddings, texts, metadatas)
+            else:
+                self._invalidate_saved_dense_index()
+        with self._sparse_lock:
+            if self.sparse_index is not None:
+                self.sparse_index.add(ids, texts)
+
+    def save_dense_index(self):
+        """Write the loaded dense index to disk (a no-op when it is not loaded)."""
+        with self._dense_lock:
+            if self.dense_index is not None:
+                self.dense_index.save()
+
+    def get_ids(self, where: Dict[str, Any] = None) -> List[str]:
+        if self.collection is None:
+            self.initialize_collection()
+        return self.collection.get(where=where, include=[])['ids']
+
+    def delete_ids(self, ids: List[str]):
+        """Delete chunks by ID. Like upsert_documents(), leaves saving the dense index to the caller."""
+        if self.collection is None:
+            self.initialize_collection()
+        if ids:
+            self.collection.delete(ids=ids)
+            self.revision += 1
+            with self._dense_lock:
+                if self.dense_index is not None:
+                    self.dense_index.remove(ids)
+                else:
+                    self._invalidate_saved_dense_index()
+            with self._sparse_lock:
+                if self.sparse_index is not None:
+                    self.sparse_index.remove(ids)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed chunk texts, encoding only those not already in the embedding cache."""
+        if self.embedding_cache is None:
+            return self.embedding_model.encode(texts).tolist()
+
+        hashes = [EmbeddingCache.text_hash(text) for text in texts]
+        cached = self.embedding_cache.get_many(self.embedding_model_name, hashes)
+
+        # Encode each distinct missing text once
+        missing = {}
+        for text_hash, text in zip(hashes, texts):
+            if text_hash not in cached and text_hash not in missing:
+                missing[text_hash] = text
+
+        if missing:
+            encoded = self.embedding_model.encode(list(missing.values()))
+            new_vectors = dict(zip(missing.keys(), np.asarray(encoded, dtype=np.float32)))
+            self.embedding_cache.put_many(self.embedding_model_name, new_vectors)
+            cached.update(new_vectors)
+
+        return [cached[text_hash].tolist() for text_hash in hashes]
+
+    def embed_query(self, query: str) -> List[float]:
+        return self.embed_queries([query])[0]
+
+    def embed_queries(self, queries: List[str]) -> List[List[float]]:
+        return self.embedding_model.encode(queries).tolist()
+
+    def similarity_search(
+        self,
+        query: str,
+        k: int = 5,
+        query_embedding: List[float] = None,
+        include_embeddings: bool = False,
+        mode: Optional[str] = None,
+        where: Optional[Dict[str, Any]] = None
+    ) -> List[Dict[str, Any]]:
+        query_embeddings = [query_embedding] if query_embedding is not None else None
+        return self.similarity_search_batch(
+            [query], k=k, query_embeddings=query_embeddings, include_embeddings=include_embeddings,
+            mode=mode, where=where
+        )[0]
+
+    def similarity_search_batch(
+        self,
+        queries: List[str],
+        k: int = 5,
+        query_embeddings: List[List[float]] = None,
+        include_embeddings: bool = False,
+        mode: Optional[str] = None,
+        where: Optional[Dict[str, Any]] = None
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        Search for several queries at once: all queries are embedded in a single
+        encode() call and sent to Chroma as one multi-embedding query.
+
+        Pass query_embeddings to reuse embeddings the caller already computed.
+        With include_embeddings, each result also carries its chunk 'embedding'.
+        mode overrides RETRIEVAL_MODE ("dense" or "hybrid").
+        where restricts results to chunks whose metadata matches a Chroma-style
+        filter, e.g. {"file_type": ".pdf"} or {"source": {"$in": [...]}}; it is
+        applied before scoring, so k results are still returned when enough
+        chunks match. Raises ValueError for a malformed filter.
+        Returns one result list per query, in the same order as `queries`.
+        """
         if self.collection is None:
             self.initialize_collection()
-            
-        query_embedding = self.embedding_model.encode([query]).tolist()
+
+        if not queries:
+            return []
+
+        if where:
+            validate_where(where)
+            where = normalize_where(where)
+        else:
+            where = None
+
+        if query_embeddings is None:
+            query_embeddings = self.embed_queries(queries)
         
+        hybrid = (mode or self.search_mode) == "hybrid"
+        dense = self._dense_search(
+            query_embeddings, k * self.hybrid_candidates if hybrid else k, include_embeddings, where
+        )
+        if not hybrid:
+            return dense
+
+        sparse_index = self.load_sparse_index()
+        allowed = self._matching_ids(where) if where is not None else None
+        return [
+            self._fuse(dense_docs, sparse_index.search(query, k * self.hybrid_candidates, allowed), k, include_embeddings)
+            for query, dense_docs in zip(queries, dense)
+        ]
+
+    def _matching_ids(self, where: Dict[str, Any]) -> set:
+        """IDs of all chunks matching a filter, to restrict the keyword search."""
+        if self.index_backend != "chroma":
+            return self.load_dense_index().ids_matching(where)
+        return set(self.get_ids(where=where))
+
+    def _dense_search(
+        self,
+        query_embeddings: List[List[float]],
+        k: int,
+        include_embeddings: bool,
+        where: Optional[Dict[str, Any]] = None
+    ) -> List[List[Dict[str, Any]]]:
+        if self.index_backend != "chroma":
+            return self.load_dense_index().search(query_embeddings, k, include_embeddings, where)
+
+        include = ['documents', 'metadatas', 'distances']
+        if include_embeddings:
+            include.append('embeddings')
+        # Chroma applies the filter to its metadata tables before the vector search
         results = self.collection.query(
-            query_embeddings=query_embedding,
-            n_results=k
+            query_embeddings=query_embeddings,
+            n_results=k,
+            where=where,
+            include=include
         )
-        
+        return [self._format_results(results, i) for i in range(len(query_embeddings))]
+
+    def get_documents(self, ids: List[str], include_embeddings: bool = False) -> List[Dict[str, Any]]:
+        """Chunks by ID as {'id', 'content', 'metadata'} dicts (unknown IDs are skipped)."""
+        if self.index_backend != "chroma":
+            return self.load_dense_index().get(ids, include_embeddings)
+
+        include = ['documents', 'metadatas'] + (['embeddings'] if include_embeddings else [])
+        fetched = self.collection.get(ids=ids, include=include)
         documents = []
-        for i in range(len(results['documents'][0])):
+        for i, doc_id in enumerate(fetched['ids']):
             documents.append({
-                'content': results['documents'][0][i],
-                'metadata': results['metadatas'][0][i],
-                'score': 1 - results['distances'][0][i]  # Convert distance to similarity
+                'id': doc_id,
+                'content': fetched['documents'][i],
+                'metadata': fetched['metadatas'][i]
             })
+            if fetched.get('embeddings') is not None:
+                documents[-1]['embedding'] = fetched['embeddings'][i]
+        return documents
+
+    def _fuse(
+        self,
+        dense_docs: List[Dict[str, Any]],
+        sparse_hits: List[tuple],
+        k: int,
+        include_embeddings: bool
+    ) -> List[Dict[str, Any]]:
+        """
+        Reciprocal-rank fusion of the dense and BM25 rankings: each list adds
+        1 / (RRF_K + rank) per chunk. 'score' is that sum scaled so a chunk
+        ranked first by both is 1.0; 'dense_score' and 'bm25_score' keep the
+        original scores.
+        """
+        fused: Dict[str, float] = {}
+        for rank, doc in enumerate(dense_docs, 1):
+            fused[doc['id']] = fused.get(doc['id'], 0.0) + 1 / (self.rrf_k + rank)
+        for rank, (doc_id, _) in enumerate(sparse_hits, 1):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1 / (self.rrf_k + rank)
+        top_ids = sorted(fused, key=fused.get, reverse=True)[:k]
+
+        docs = {doc['id']: doc for doc in dense_docs}
+        # Keyword-only hits were not returned by the dense query
+        missing = [doc_id for doc_id in top_ids if doc_id not in docs]
+        if missing:
+            for doc in self.get_documents(missing, include_embeddings):
+                docs[doc['id']] = doc
+
+        sparse_scores = dict(sparse_hits)
+        max_score = 2 / (self.rrf_k + 1)
+        results = []
+        for doc_id in top_ids:
+            if doc_id not in docs:
+                continue
+            doc = docs[doc_id]
+            results.append({
+                **doc,
+                'score': fused[doc_id] / max_score,
+                'dense_score': doc.get('score'),
+                'bm25_score': sparse_scores.get(doc_id)
+            })
+        return results
+
+    @staticmethod
+    def _format_results(results: Dict[str, Any], query_index: int) -> List[Dict[str, Any]]:
+        documents = []
+        for i in range(len(results['documents'][query_index])):
+            documents.append({
+                'id': results['ids'][query_index][i],
+                'content': results['documents'][query_index][i],
+                'metadata': results['metadatas'][query_index][i],
+                'score': 1 - results['distances'][query_index][i]  # Convert distance to similarity
+            })
+            if results.get('embeddings') is not None:
+                documents[-1]['embedding'] = results['embeddings'][query_index][i]
         
         return documents
     
     def delete_collection(self):
-        if self.collection:
-            self.client.delete_collection(self.collection_name)
-            self.collection = None
\ No newline at end of file
+        if self.collection is None:
+            self.initialize_collection()
+        self.client.delete_collection(self.collection_name)
+        self.collection = None
+        self.revision += 1
+        with self._dense_lock:
+            if self.dense_index is not None:
+                self.dense_index.delete_files()
+                self.dense_index = None
+            else:
+                self._invalidate_saved_dense_index()
+        with self._sparse_lock:
+            self.sparse_index = None
+        # The ingest manifest describes the deleted collection
+        if os.path.exists(self.manifest_path):
+            os.remove(self.manifest_path)
\ No newline at end of file
@@ -0,0 +1,36 @@
+import asyncio
+from typing import Any, Awaitable
+
+
+class ClientDisconnected(Exception):
+    """The HTTP client went away before the response was ready."""
+
+
+async def cancel_on_disconnect(request, awaitable: Awaitable[Any], poll_interval: float = 0.5) -> Any:
+    """
+    Await `awaitable`, cancelling it if the client of `request` disconnects.
+
+    Non-streaming handlers are not cancelled by the server when the client
+    goes away, so without this an abandoned request keeps its batch slot
+    until the whole answer is generated.
+
+    Args:
+        request: The starlette/FastAPI Request being served
+        awaitable: Coroutine producing the response data
+        poll_interval: Seconds between disconnect checks
+
+    Raises:
+        ClientDisconnected: if the client disconnected first
+    """
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll_interval)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                task.cancel()
+                raise ClientDisconnected()
+    finally:
+        if not task.done():
+            task.cancel()
@@ -1,6 +1,9 @@
 import os
+import re
 import sys
-from typing import List, Dict, Any
+from bisect import bisect_right
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Tuple
 from pathlib import Path
 import pypdf
 from docx import Document
@@ -13,7 +16,39 @@ try:
 except ImportError:
     HAS_WIN32COM = False
 
+# Candidate chunk ends, strongest first: paragraph break, sentence end, line break
+_BOUNDARY_PATTERNS = [
+    re.compile(r'\n\s*\n'),
+    re.compile(r'[.!?](?=\s|$)'),
+    re.compile(r'\n'),
+]
+
 class DocumentProcessor:
+    SUPPORTED_EXTENSIONS = {'.txt', '.pdf', '.docx', '.doc', '.html', '.htm'}
+
+    def __init__(self, chunk_unit: Optional[str] = None, tokenizer_name: Optional[str] = None):
+        """
+        Args:
+            chunk_unit: "chars" or "tokens" - what chunk_size/overlap are measured in
+                (defaults to CHUNK_UNIT in .env, else "chars")
+            tokenizer_name: HuggingFace tokenizer used for "tokens" (defaults to
+                CHUNK_TOKENIZER in .env, else the embedding model's tokenizer)
+        """
+        self.chunk_unit = chunk_unit or os.getenv("CHUNK_UNIT", "chars")
+        if self.chunk_unit not in ("chars", "tokens"):
+            raise ValueError(f"Unsupported chunk unit: {self.chunk_unit}")
+        self.tokenizer_name = tokenizer_name or os.getenv(
+            "CHUNK_TOKENIZER", "sentence-transformers/all-MiniLM-L6-v2"
+        )
+        self._tokenizer = None
+
+    @property
+    def tokenizer(self):
+        if self._tokenizer is None:
+            from transformers import AutoTokenizer
+            self._tokenizer = AutoTokenizer.from_pretrained(self.tokenizer_name, use_fast=True)
+        return self._tokenizer
+
     @staticmethod
     def read_text_file(file_path: str) -> str:
         with open(file_path, 'r', encoding='utf-8') as file:
@@ -105,57 +140,199 @@ class DocumentProcessor:
             raise Exception(f"Error processing file {file_path}: {str(e)}")
     
     def chunk_text(self, text: str, chunk_size: int = 1000, overlap: int = 200) -> List[str]:
-        if len(text) <= chunk_size:
-            return [text]
-        
-        chunks = []
+        return [text[start:end] for start, end in self.chunk_spans(text, chunk_size, overlap)]
+
+    def chunk_spans(self, text: str, chunk_size: int = 1000, overlap: int = 200) -> List[Tuple[int, int]]:
+        """
+        Split text into (start, end) character offsets of overlapping chunks.
+
+        chunk_size and overlap are measured in self.chunk_unit. Each chunk is
+        cut at the strongest boundary (paragraph, sentence, line) found in its
+        last 20%, falling back to a hard cut. Boundaries are located in one
+        pass over the text and looked up by bisection, so the cost is linear
+        in the text length and no intermediate substrings are created.
+        """
+        if self.chunk_unit == "tokens":
+            encoding = self.tokenizer(
+                text, add_special_tokens=False, return_offsets_mapping=True, verbose=False
+            )
+            offsets = encoding['offset_mapping']
+            unit_starts = [start for start, _ in offsets]
+            unit_ends = [end for _, end in offsets]
+        else:
+            unit_starts = unit_ends = None
+
+        n_units = len(unit_ends) if unit_ends is not None else len(text)
+        if n_units <= chunk_size:
+            return [(0, len(text))]
+
+        def char_start(unit):
+            return unit_starts[unit] if unit_starts is not None else unit
+
+        def char_end(unit):
+            # Character offset just past the unit-th unit
+            return unit_ends[unit - 1] if unit_ends is not None else unit
+
+        def units_before(char):
+            # Number of whole units that end at or before char
+            return bisect_right(unit_ends, char) if unit_ends is not None else char
+
+        boundaries = [
+            [match.end() for match in pattern.finditer(text)]
+            for pattern in _BOUNDARY_PATTERNS
+        ]
+
+        # Never step back so far that a chunk would not advance
+        overlap = min(overlap, chunk_size - 1)
+        spans = []
         start = 0
-        
-        while start < len(text):
+
+        while start < n_units:
             end = start + chunk_size
-            
-            if end >= len(text):
-                chunks.append(text[start:])
+
+            if end >= n_units:
+                spans.append((char_start(start), len(text)))
                 break
-            
-            # Try to end at a sentence boundary
-            chunk = text[start:end]
-            last_period = chunk.rfind('.')
-            last_newline = chunk.rfind('\n')
-            
-            if last_period > len(chunk) * 0.8:
-                end = start + last_period + 1
-            elif last_newline > len(chunk) * 0.8:
-                end = start + last_newline + 1
-            
-            chunks.append(text[start:end])
-            start = end - overlap
-        
-        return chunks
+
+            # Try to end at a boundary within the last 20% of the window
+            window_low = char_end(start + int(chunk_size * 0.8))
+            window_high = char_end(end)
+            for positions in boundaries:
+                i = bisect_right(positions, window_high) - 1
+                if i >= 0 and positions[i] > window_low:
+                    boundary_end = units_before(positions[i])
+                    if boundary_end > start:
+                        end = boundary_end
+                    break
+
+            spans.append((char_start(start), char_end(end)))
+            start = max(end - overlap, start + 1)
+
+        return spans
     
-    def process_directory(self, directory_path: str, chunk_size: int = 1000) -> List[Dict[str, Any]]:
-        directory_path = Path(directory_path)
+    def process_file_chunks(self, file_path: str, chunk_size: int = 1000, overlap: int = 200) -> List[Dict[str, Any]]:
+        """Read one file and split it into chunk dicts with per-chunk metadata."""
+        doc_data = self.process_file(file_path)
+        content = doc_data['content']
+        spans = self.chunk_spans(content, chunk_size, overlap)
+
         documents = []
+        for i, (start, end) in enumerate(spans):
+            chunk_metadata = doc_data['metadata'].copy()
+            chunk_metadata['chunk_id'] = i
+            chunk_metadata['total_chunks'] = len(spans)
+            chunk_metadata['chunk_size'] = chunk_size
+            chunk_metadata['chunk_overlap'] = overlap
+            chunk_metadata['chunk_unit'] = self.chunk_unit
+            chunk_metadata['start_char'] = start
+            chunk_metadata['end_char'] = end
+
+            documents.append({
+                'id': f"{chunk_metadata['source']}_{i}",
+                'content': content[start:end],
+                'metadata': chunk_metadata
+            })
+        return documents
+
+    def find_files(self, directory_path: str) -> List[Path]:
+        return [
+            file_path for file_path in Path(directory_path).rglob('*')
+            if file_path.suffix.lower() in self.SUPPORTED_EXTENSIONS
+        ]
 
-        supported_extensions = {'.txt', '.pdf', '.docx', '.doc', '.html', '.htm'}
+    def iter_file_chunks(
+        self,
+        file_paths: Iterable[Path],
+        chunk_size: int = 1000,
+        overlap: int = 200,
+        workers: Optional[int] = None
+    ) -> Iterator[Tuple[Path, Optional[List[Dict[str, Any]]], Optional[Exception]]]:
+        """
+        Parse and chunk files, yielding (file_path, chunks, error) per file.
 
-        for file_path in directory_path.rglob('*'):
-            if file_path.suffix.lower() in supported_extensions:
+        With more than one worker, files are fanned out over a process pool
+        (PDF/HTML extraction is CPU-bound) and results are yielded in
+        completion order. Only about two files per worker are in flight, so
+        parsed chunks never pile up ahead of a slower consumer (embedding).
+        Exactly one of chunks/error is set.
+        """
+        workers = workers or int(os.getenv("INGEST_WORKERS", "1"))
+        file_paths = list(file_paths)
+
+        if workers <= 1 or len(file_paths) <= 1:
+            for file_path in file_paths:
                 try:
-                    doc_data = self.process_file(str(file_path))
-                    chunks = self.chunk_text(doc_data['content'], chunk_size)
-                    
-                    for i, chunk in enumerate(chunks):
-                        chunk_metadata = doc_data['metadata'].copy()
-                        chunk_metadata['chunk_id'] = i
-                        chunk_metadata['total_chunks'] = len(chunks)
-                        
-                        documents.append({
-                            'content': chunk,
-                            'metadata': chunk_metadata
-                        })
+                    yield file_path, self.process_file_chunks(str(file_path), chunk_size, overlap), None
                 except Exception as e:
-                    print(f"Warning: Failed to process {file_path}: {str(e)}")
-                    continue
-        
-        return documents
\ No newline at end of file
+                    yield file_path, None, e
+            return
+
+        workers = min(workers, len(file_paths))
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(self.chunk_unit, self.tokenizer_name)
+        ) as executor:
+            remaining = iter(file_paths)
+            futures = {}
+
+            def submit_next():
+                file_path = next(remaining, None)
+                if file_path is not None:
+                    futures[executor.submit(_process_file_chunks, str(file_path), chunk_size, overlap)] = file_path
+
+            for _ in range(2 * workers):
+                submit_next()
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    file_path = futures.pop(future)
+                    try:
+                        chunks, error = future.result(), None
+                    except Exception as e:
+                        chunks, error = None, e
+                    yield file_path, chunks, error
+                    # The consumer is done with the previous file: start the next one
+                    submit_next()
+
+    def iter_directory_chunks(
+        self,
+        directory_path: str,
+        chunk_size: int = 1000,
+        overlap: int = 200,
+        workers: Optional[int] = None
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Yield chunk dicts for every supported file under directory_path, one
+        file at a time, without materializing the whole corpus.
+        """
+        files = self.find_files(directory_path)
+        for file_path, chunks, error in self.iter_file_chunks(files, chunk_size, overlap, workers):
+            if error is not None:
+                print(f"Warning: Failed to process {file_path}: {str(error)}")
+                continue
+            yield from chunks
+
+    def process_directory(
+        self,
+        directory_path: str,
+        chunk_size: int = 1000,
+        overlap: int = 200,
+        workers: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        return list(self.iter_directory_chunks(directory_path, chunk_size, overlap, workers))
+
+
+# The DocumentProcessor of each ingest worker process, created once by the
+# pool initializer so a "tokens" tokenizer is loaded once per process rather
+# than once per file
+_worker_processor: Optional[DocumentProcessor] = None
+
+
+def _init_worker(chunk_unit: str, tokenizer_name: str):
+    global _worker_processor
+    _worker_processor = DocumentProcessor(chunk_unit, tokenizer_name)
+
+
+def _process_file_chunks(file_path: str, chunk_size: int, overlap: int) -> List[Dict[str, Any]]:
+    return _worker_processor.process_file_chunks(file_path, chunk_size, overlap)
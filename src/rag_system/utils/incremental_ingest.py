@@ -0,0 +1,157 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from .document_processor import DocumentProcessor
+from ..retrieval.vector_store import VectorStore
+
+
+class IngestManifest:
+    """
+    Record of what has been ingested into a collection, one entry per source file:
+    mtime, size, content hash, chunking parameters and the chunk IDs written.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def file_hash(file_path: str) -> str:
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+
+def chunk_ids_for(documents: List[Dict[str, Any]]) -> List[str]:
+    return [doc['id'] for doc in documents]
+
+
+def incremental_ingest(
+    directory_path: str,
+    vector_store: VectorStore,
+    document_processor: Optional[DocumentProcessor] = None,
+    chunk_size: int = 1000,
+    overlap: int = 200,
+    workers: Optional[int] = None,
+    verbose: bool = False
+) -> Dict[str, int]:
+    """
+    Bring the collection in line with the files under directory_path.
+
+    Unchanged files (same mtime/size, or same content hash, and same chunking
+    parameters) are skipped. Changed files are re-chunked (in parallel when
+    workers > 1) and upserted, then any other chunk IDs stored for that source
+    (e.g. from an older chunk size) are deleted. Sources recorded in the
+    manifest whose files were removed from the directory have all their chunks
+    deleted.
+
+    Returns counts of files added/updated/unchanged/removed/failed and chunks
+    written/deleted.
+    """
+    document_processor = document_processor or DocumentProcessor()
+    manifest = IngestManifest(vector_store.manifest_path)
+    directory = Path(directory_path)
+    params = {
+        'chunk_size': chunk_size,
+        'chunk_overlap': overlap,
+        'chunk_unit': document_processor.chunk_unit
+    }
+
+    stats = {
+        'added': 0, 'updated': 0, 'unchanged': 0, 'removed': 0, 'failed': 0,
+        'chunks_written': 0, 'chunks_deleted': 0
+    }
+    seen_sources = set()
+    pending = {}  # source -> (stat, content hash) for files that need re-chunking
+
+    for file_path in document_processor.find_files(str(directory)):
+        source = str(file_path)
+        seen_sources.add(source)
+        stat = file_path.stat()
+        entry = manifest.entries.get(source)
+
+        if entry is not None and all(entry.get(key) == value for key, value in params.items()):
+            if entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size:
+                stats['unchanged'] += 1
+                continue
+            content_hash = IngestManifest.file_hash(source)
+            if entry['sha256'] == content_hash:
+                # Touched but not modified
+                entry['mtime'], entry['size'] = stat.st_mtime, stat.st_size
+                stats['unchanged'] += 1
+                continue
+        else:
+            content_hash = IngestManifest.file_hash(source)
+
+        pending[source] = (stat, content_hash)
+
+    results = document_processor.iter_file_chunks(
+        [Path(source) for source in pending], chunk_size, overlap, workers
+    )
+    for file_path, documents, error in results:
+        source = str(file_path)
+        if error is not None:
+            print(f"Warning: Failed to process {file_path}: {str(error)}")
+            stats['failed'] += 1
+            continue
+
+        ids = chunk_ids_for(documents)
+        if documents:
+            vector_store.upsert_documents(
+                [doc['content'] for doc in documents],
+                [doc['metadata'] for doc in documents],
+                ids
+            )
+
+        # Anything else stored for this source is stale (older chunkings, duplicates)
+        new_ids = set(ids)
+        stale_ids = [chunk_id for chunk_id in vector_store.get_ids(where={'source': source})
+                     if chunk_id not in new_ids]
+        vector_store.delete_ids(stale_ids)
+
+        stats['updated' if source in manifest.entries else 'added'] += 1
+        stats['chunks_written'] += len(ids)
+        stats['chunks_deleted'] += len(stale_ids)
+        if verbose:
+            print(f"  - {source}: {len(ids)} chunks written, {len(stale_ids)} stale chunks deleted")
+
+        stat, content_hash = pending[source]
+        manifest.entries[source] = {
+            'mtime': stat.st_mtime,
+            'size': stat.st_size,
+            'sha256': content_hash,
+            **params,
+            'chunk_ids': ids
+        }
+
+    # Files that disappeared from this directory since the last ingest
+    for source in list(manifest.entries):
+        if source in seen_sources or directory not in Path(source).parents:
+            continue
+        stale_ids = vector_store.get_ids(where={'source': source})
+        vector_store.delete_ids(stale_ids)
+        del manifest.entries[source]
+        stats['removed'] += 1
+        stats['chunks_deleted'] += len(stale_ids)
+        if verbose:
+            print(f"  - {source}: removed ({len(stale_ids)} chunks deleted)")
+
+    # Once per run: saving after every file rewrites the whole index each time
+    vector_store.save_dense_index()
+    manifest.save()
+    return stats
@@ -3,6 +3,7 @@
 import argparse
 import os
 import sys
+from collections import Counter
 from pathlib import Path
 
 # Add src to path
@@ -10,11 +11,19 @@ sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../..'))
 
 from src.rag_system.generation.rag_pipeline import RAGPipeline
 from src.rag_system.utils.document_processor import DocumentProcessor
+from src.rag_system.utils.incremental_ingest import incremental_ingest
 
 def main():
     parser = argparse.ArgumentParser(description="Ingest documents into the RAG system")
     parser.add_argument("--input", "-i", required=True, help="Input directory containing documents")
     parser.add_argument("--chunk-size", "-c", type=int, default=1000, help="Chunk size for text splitting")
+    parser.add_argument("--overlap", type=int, default=200, help="Overlap between consecutive chunks")
+    parser.add_argument("--chunk-unit", choices=["chars", "tokens"], default=None,
+                        help="Measure chunk size/overlap in characters or tokenizer tokens (default: CHUNK_UNIT or chars)")
+    parser.add_argument("--workers", "-w", type=int, default=None,
+                        help="Parse files in parallel with this many processes (default: INGEST_WORKERS or 1)")
+    parser.add_argument("--full", action="store_true",
+                        help="Write every chunk without consulting the ingest manifest (no change detection)")
     parser.add_argument("--verbose", "-v", action="store_true", help="Verbose output")
     
     args = parser.parse_args()
@@ -31,7 +40,7 @@ def main():
     
     print("Initializing RAG system...")
     rag_pipeline = RAGPipeline()
-    document_processor = DocumentProcessor()
+    document_processor = DocumentProcessor(chunk_unit=args.chunk_unit)
     
     try:
         rag_pipeline.initialize()
@@ -42,31 +51,59 @@ def main():
     
     print(f"\n[*] Processing documents from: {input_path}")
 
+    if not args.full:
+        try:
+            stats = incremental_ingest(
+                str(input_path),
+                rag_pipeline.vector_store,
+                document_processor,
+                chunk_size=args.chunk_size,
+                overlap=args.overlap,
+                workers=args.workers,
+                verbose=args.verbose
+            )
+        except Exception as e:
+            print(f"[ERROR] Error during document ingestion: {e}")
+            import traceback
+            traceback.print_exc()
+            return 1
+
+        print(f"[OK] Files: {stats['added']} added, {stats['updated']} updated, "
+              f"{stats['unchanged']} unchanged, {stats['removed']} removed, {stats['failed']} failed")
+        print(f"[OK] Chunks: {stats['chunks_written']} written, {stats['chunks_deleted']} stale deleted")
+        return 0
+
     try:
-        documents = document_processor.process_directory(str(input_path), chunk_size=args.chunk_size)
+        # Files -> chunks -> fixed-size embedding batches -> vector store writes,
+        # so memory use does not grow with the size of the corpus
+        chunks_per_source = Counter()
 
-        if not documents:
-            print("[WARNING] No supported documents found in the directory")
-            return 0
+        def counted(documents):
+            for doc in documents:
+                chunks_per_source[doc['metadata']['source']] += 1
+                yield doc
 
-        print(f"[*] Found {len(documents)} document chunks")
+        def report(total):
+            print(f"\r[*] Ingested {total} chunks...", end="", flush=True)
 
-        # Prepare data for vector store
-        texts = [doc['content'] for doc in documents]
-        metadatas = [doc['metadata'] for doc in documents]
-        ids = [f"{doc['metadata']['source']}_{doc['metadata']['chunk_id']}" for doc in documents]
+        documents = document_processor.iter_directory_chunks(
+            str(input_path), chunk_size=args.chunk_size, overlap=args.overlap, workers=args.workers
+        )
 
         print("[*] Adding documents to vector store...")
-        rag_pipeline.add_documents(texts, metadatas, ids)
+        total = rag_pipeline.vector_store.add_documents_stream(counted(documents), progress=report)
+        print()
+
+        if total == 0:
+            print("[WARNING] No supported documents found in the directory")
+            return 0
 
-        print("[OK] Documents successfully ingested!")
+        print(f"[OK] {total} document chunks successfully ingested!")
 
         if args.verbose:
             print("\nProcessed files:")
-            sources = set(doc['metadata']['source'] for doc in documents)
-            for source in sorted(sources):
-                chunks = sum(1 for doc in documents if doc['metadata']['source'] == source)
-                print(f"  - {source}: {chunks} chunks")
+            for source in sorted(chunks_per_source):
+                print(f"  - {source}: {chunks_per_source[source]} chunks")
 
         return 0
 
@@ -0,0 +1,39 @@
+import json
+from typing import Any, Dict, Iterator, Optional
+
+
+def format_sse(event: Dict[str, Any]) -> str:
+    """Encode a JSON event as a single server-sent-events message."""
+    return f"data: {json.dumps(event)}\n\n"
+
+
+def stream_answer_events(result: Dict[str, Any], session_id: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Turn a RAGPipeline.query_stream() result into a sequence of events:
+    one "sources" event (with the chat session ID, if any), a "token" event
+    per text delta, then "done" carrying the full answer, or "error" if the
+    answer timed out (REQUEST_TIMEOUT).
+
+    The answer stream is closed when this generator is, so a client that
+    disconnects stops the generation right away.
+    """
+    answer_stream = result["answer_stream"]
+    try:
+        first = {"type": "sources", "sources": result["sources"]}
+        if session_id is not None:
+            first["session_id"] = session_id
+        yield first
+
+        parts = []
+        try:
+            for delta in answer_stream:
+                parts.append(delta)
+                yield {"type": "token", "text": delta}
+        except TimeoutError:
+            yield {"type": "error", "detail": "Timed out waiting for the answer"}
+            return
+
+        yield {"type": "done", "answer": "".join(parts).strip()}
+    finally:
+        if hasattr(answer_stream, "close"):
+            answer_stream.close()
@@ -9,18 +9,19 @@ sys.path.insert(0, os.path.join(os.getcwd(), 'src'))
 
 from src.rag_system.generation.rag_pipeline import RAGPipeline
 
-def test_retrieval(question, k=5):
+def test_retrieval(question, k=5, retrieved_docs=None):
     """Test what chunks are being retrieved for a question"""
     print(f"\n{'='*80}")
     print(f"Question: {question}")
     print(f"{'='*80}\n")
 
-    # Initialize RAG
-    rag = RAGPipeline()
-    rag.vector_store.initialize_collection()
+    if retrieved_docs is None:
+        # Initialize RAG
+        rag = RAGPipeline()
+        rag.vector_store.initialize_collection()
 
-    # Get retrieved documents
-    retrieved_docs = rag.vector_store.similarity_search(question, k=k)
+        # Get retrieved documents
+        retrieved_docs = rag.vector_store.similarity_search(question, k=k)
 
     print(f"Retrieved {len(retrieved_docs)} chunks:\n")
 
@@ -68,9 +69,14 @@ if __name__ == "__main__":
     print("RAG DIAGNOSTICS - Retrieval Quality Test")
     print("="*80)
 
-    for q in questions:
+    # Retrieve for all questions in one batched search
+    rag = RAGPipeline()
+    rag.vector_store.initialize_collection()
+    all_retrieved = rag.vector_store.similarity_search_batch(questions, k=5)
+
+    for q, retrieved_docs in zip(questions, all_retrieved):
         # First, see what's being retrieved
-        test_retrieval(q, k=5)
+        test_retrieval(q, k=5, retrieved_docs=retrieved_docs)
 
         # Then see the full answer
         # test_full_rag(q, k=5)
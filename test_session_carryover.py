@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Test that a chat session keeps reusing its cached conversation prefix
+after the history has been trimmed (no model needed)
+"""
+
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'))
+
+from rag_system.generation.context_budget import ContextBudget
+from rag_system.generation.session_store import SessionStore, create_direct_prompt, format_history
+
+def count_tokens(text):
+    """Rough stand-in for the model tokenizer"""
+    return len(text) // 4
+
+def run_conversation(turns, **limits):
+    """
+    Chat `turns` times in one session in direct mode, keeping the prompt and
+    answer of each turn the way the model's session KV cache does.
+
+    Returns one entry per turn: whether the prompt started with the kept
+    prefix (KV carried over), and whether a stale prefix was still kept.
+    """
+    kept = {}
+    sessions = SessionStore(on_trim=lambda session_id: kept.pop(session_id, None), **limits)
+    session_id = SessionStore.new_session_id()
+    results = []
+    for i in range(turns):
+        history = sessions.history(session_id)
+        direct = create_direct_prompt(f"Question {i}?", history)
+        prefix = kept.get(session_id)
+        results.append({
+            "carried_over": prefix is not None and direct["prompt"].startswith(prefix),
+            "stale": prefix is not None and not direct["prompt"].startswith(prefix)
+        })
+        answer = f"Answer {i}. " * 20
+        kept[session_id] = direct["next_session_prefix"](answer)
+        sessions.append(session_id, {"user": f"Question {i}?", "assistant": answer})
+    return results
+
+def test_carryover_past_turn_limit():
+    results = run_conversation(20, max_turns=4)
+    assert not any(r["stale"] for r in results)
+    # Turn 0 has nothing cached yet; the first trim happens on turn 4.
+    # Each trim costs one turn without carry-over, the rest reuse the
+    # previous turn's prompt and answer.
+    misses = [i for i, r in enumerate(results) if not r["carried_over"]]
+    assert misses[:2] == [0, 5]
+    assert len(misses) <= 1 + 20 // 2
+    assert all(r["carried_over"] for r in results[1:5])
+
+def test_carryover_past_char_limit():
+    # Each turn is about 250 characters, so the text budget trims first
+    results = run_conversation(20, max_turns=100, max_chars=1000)
+    assert not any(r["stale"] for r in results)
+    assert sum(r["carried_over"] for r in results[8:]) >= 6
+
+def run_budgeted_conversation(turns, fit_history, session_prefix, create_prompt, max_turns=6):
+    """
+    Like run_conversation(), but each prompt's history is cut to the token
+    budget first, as RAG prompts are. Answers are about 450 tokens.
+    """
+    kept = {}
+    sessions = SessionStore(max_turns=max_turns, on_trim=lambda session_id: kept.pop(session_id, None))
+    session_id = SessionStore.new_session_id()
+    results = []
+    for i in range(turns):
+        question = f"Question {i}?"
+        history = fit_history(question, sessions.history(session_id))
+        prompt = create_prompt(question, history)
+        prefix = kept.get(session_id)
+        results.append({
+            "carried_over": prefix is not None and prompt.startswith(prefix),
+            "stale": prefix is not None and not prompt.startswith(prefix)
+        })
+        if history:
+            kept[session_id] = session_prefix(history)
+        sessions.append(session_id, {"user": question, "assistant": f"Answer {i}. " * 180})
+    return results
+
+def test_carryover_past_history_token_budget():
+    budget = ContextBudget(count_tokens, history_share=0.3, min_chunk_tokens=64)
+
+    def fit_history(question, history):
+        return budget.fit(4096, question, history, [], lambda i, doc: "")["history"]
+
+    results = run_budgeted_conversation(
+        24, fit_history,
+        session_prefix=lambda history: format_history(history),
+        create_prompt=lambda question, history: format_history(history) + question
+    )
+    # Cutting history to the budget must not move the prefix on every turn
+    assert sum(r["carried_over"] for r in results[2:]) >= len(results[2:]) // 2
+
+def test_carryover_through_fit_context():
+    try:
+        from rag_system.generation.rag_pipeline import RAGPipeline
+    except ImportError as e:
+        print(f"[*] Skipping fit_context case: {e}")
+        return
+
+    class TokenCounter:
+        def count_tokens(self, text):
+            return count_tokens(text)
+
+        def context_window(self):
+            return None
+
+    # Only what fit_context() and create_prompt() use
+    pipeline = RAGPipeline.__new__(RAGPipeline)
+    pipeline.llama_model = TokenCounter()
+    pipeline.max_tokens = 512
+    pipeline.prompt_token_budget = 4096
+    pipeline.context_budget = ContextBudget(count_tokens, history_share=0.3, min_chunk_tokens=64)
+    docs = [{"id": str(i), "content": "Chunk text. " * 100, "score": 1.0 / (i + 1), "metadata": {}} for i in range(8)]
+
+    def fit_history(question, history):
+        return pipeline.fit_context(question, history, docs)["history"]
+
+    def create_prompt(question, history):
+        context = pipeline.format_context(pipeline.fit_context(question, history, docs)["docs"])
+        return pipeline.create_prompt(question, context, history)
+
+    results = run_budgeted_conversation(24, fit_history, RAGPipeline.session_prefix, create_prompt)
+    assert sum(r["carried_over"] for r in results[2:]) >= len(results[2:]) // 2
+
+def test_trim_keeps_newest_turns():
+    sessions = SessionStore(max_turns=4)
+    for i in range(5):
+        sessions.append("s", {"user": str(i), "assistant": ""})
+    assert [t["user"] for t in sessions.history("s")] == ["3", "4"]
+
+if __name__ == "__main__":
+    test_carryover_past_turn_limit()
+    test_carryover_past_char_limit()
+    test_trim_keeps_newest_turns()
+    test_carryover_past_history_token_budget()
+    test_carryover_through_fit_context()
+    print("[OK] Session prefix carries over past the trim point")
@@ -5,75 +5,105 @@ Similar to ChatGPT/Claude interface
 """
 
 from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
+import asyncio
 import sys
 import os
+import threading
 import uvicorn
-from typing import List, Dict
+from typing import List, Dict, Optional
 
 # Add src to path
 sys.path.insert(0, os.path.join(os.getcwd(), 'src'))
 
 from crash_monitor import start_monitoring, log_step
 from windows_safe_config import WindowsSafeConfig
-from rag_system.models.llama import LlamaModel
 from rag_system.generation.rag_pipeline import RAGPipeline
+from rag_system.generation.session_store import SessionStore, create_direct_prompt
+from rag_system.models.errors import QueueFullError
+from rag_system.utils.disconnect import ClientDisconnected, cancel_on_disconnect
+from rag_system.utils.sse import format_sse, stream_answer_events
 
 app = FastAPI(title="Local LLM Chat")
 
-# Global instances
-model = None
+# Global instances; direct (non-RAG) chat also generates through the
+# pipeline, so every request shares its queue, limits and cancellation
 rag_pipeline = None
-chat_history = []
+_rag_lock = threading.Lock()
 use_rag = True  # Default to RAG mode
 
+def release_session(session_id: str):
+    """Free the KV cache kept for a session once its history leaves memory or is trimmed."""
+    if rag_pipeline is not None:
+        rag_pipeline.drop_session(session_id)
+
+# Bounded per-session chat history (limits in .env)
+sessions = SessionStore(on_evict=release_session, on_trim=release_session)
+
 class ChatMessage(BaseModel):
     message: str
     use_rag: bool = True  # Allow per-message override
+    session_id: Optional[str] = None  # Conversation to continue; a new one is started if missing
 
 class ChatResponse(BaseModel):
     response: str
     status: str
     sources: List[str] = []
     mode: str = "rag"  # "rag" or "direct"
+    session_id: Optional[str] = None
 
-def initialize_rag():
+def create_pipeline() -> RAGPipeline:
     global rag_pipeline
-    if rag_pipeline is None:
-        print("[*] Initializing RAG pipeline...")
-        monitor = start_monitoring()
-        WindowsSafeConfig.check_system_resources()
+    with _rag_lock:
+        if rag_pipeline is None:
+            print("[*] Initializing RAG pipeline...")
+            monitor = start_monitoring()
+            WindowsSafeConfig.check_system_resources()
+
+            log_step("Loading RAG pipeline")
+            # Published before loading so /status can report its startup stages
+            rag_pipeline = RAGPipeline()
+    return rag_pipeline
 
-        log_step("Loading RAG pipeline")
-        rag_pipeline = RAGPipeline()
+def initialize_rag():
+    create_pipeline()
+    if not rag_pipeline.model_loaded:
+        # Waits instead if another thread is already loading
         rag_pipeline.initialize()
         print("[OK] RAG pipeline ready!")
     return rag_pipeline
 
-def initialize_model():
-    global model
-    if model is None:
-        print("[*] Initializing direct model for web interface...")
-        monitor = start_monitoring()
-        WindowsSafeConfig.check_system_resources()
+def rag_ready() -> bool:
+    return rag_pipeline is not None and rag_pipeline.model_loaded
 
+def initialize_generation():
+    """Pipeline with at least the LLM loaded, enough for direct chat."""
+    create_pipeline()
+    if not rag_pipeline.generation_ready:
+        # Only the LLM, so direct chat works even if retrieval fails to load
         log_step("Loading model for web interface")
-        model = LlamaModel()
-        model.load_model()
+        rag_pipeline.initialize_generation()
         print("[OK] Direct model ready for web chat!")
-    return model
+    return rag_pipeline
 
-@app.on_event("startup")
-async def startup_event():
-    # Pre-load RAG pipeline on startup (includes model)
+def generation_ready() -> bool:
+    return rag_pipeline is not None and rag_pipeline.generation_ready
+
+def preload_rag():
     try:
         initialize_rag()
     except Exception as e:
         print(f"Warning: Could not pre-load RAG pipeline: {e}")
         print("[*] Will fall back to direct model mode")
 
+@app.on_event("startup")
+async def startup_event():
+    # Pre-load RAG pipeline (includes model) in the background, so the server
+    # answers /status and /health while the models load
+    asyncio.get_running_loop().run_in_executor(None, preload_rag)
+
 @app.get("/", response_class=HTMLResponse)
 async def get_chat_interface():
     html_content = """
@@ -366,6 +396,8 @@ async def get_chat_interface():
         const messageInput = document.getElementById('messageInput');
         const sendButton = document.getElementById('sendButton');
         const chatForm = document.getElementById('chatForm');
+        // Conversation ID assigned by the server on the first reply
+        let sessionId = null;
         
         // Auto-resize textarea
         messageInput.addEventListener('input', function() {
@@ -397,12 +429,7 @@ async def get_chat_interface():
             messageDiv.appendChild(contentDiv);
 
             // Add sources if available (RAG mode)
-            if (sources && sources.length > 0) {
-                const sourcesDiv = document.createElement('div');
-                sourcesDiv.className = 'sources';
-                sourcesDiv.innerHTML = `<strong>Sources:</strong>${sources.map(s => `<div>• ${s}</div>`).join('')}`;
-                messageDiv.appendChild(sourcesDiv);
-            }
+            addSources(messageDiv, sources);
 
             chatMessages.appendChild(messageDiv);
 
@@ -414,6 +441,38 @@ async def get_chat_interface():
 
             // Scroll to bottom
             chatMessages.scrollTop = chatMessages.scrollHeight;
+            return contentDiv;
+        }
+
+        function addSources(messageDiv, sources) {
+            if (sources && sources.length > 0) {
+                const sourcesDiv = document.createElement('div');
+                sourcesDiv.className = 'sources';
+                sourcesDiv.innerHTML = `<strong>Sources:</strong>${sources.map(s => `<div>• ${s}</div>`).join('')}`;
+                messageDiv.appendChild(sourcesDiv);
+            }
+        }
+
+        // Read a server-sent-events body and call onEvent for each JSON event
+        async function readEventStream(response, onEvent) {
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+
+            while (true) {
+                const { done, value } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+
+                let boundary;
+                while ((boundary = buffer.indexOf('\\n\\n')) !== -1) {
+                    const rawEvent = buffer.slice(0, boundary);
+                    buffer = buffer.slice(boundary + 2);
+                    if (rawEvent.startsWith('data: ')) {
+                        onEvent(JSON.parse(rawEvent.slice(6)));
+                    }
+                }
+            }
         }
         
         function showTypingIndicator() {
@@ -462,37 +521,65 @@ async def get_chat_interface():
             showTypingIndicator();
 
             try {
-                const response = await fetch('/chat', {
+                const response = await fetch('/chat/stream', {
                     method: 'POST',
                     headers: {
                         'Content-Type': 'application/json',
                     },
                     body: JSON.stringify({
                         message: message,
-                        use_rag: useRag
+                        use_rag: useRag,
+                        session_id: sessionId
                     }),
                 });
 
-                const data = await response.json();
+                if (!response.ok) {
+                    hideTypingIndicator();
+                    const busy = response.status === 429;
+                    addMessage(busy ? 'The assistant is busy right now. Please try again in a moment.'
+                                    : 'Sorry, I encountered an error. Please try again.', 'assistant');
+                    return;
+                }
+
+                let contentDiv = null;
+                let sources = [];
+
+                await readEventStream(response, (event) => {
+                    if (event.type === 'sources') {
+                        sources = event.sources || [];
+                        sessionId = event.session_id || sessionId;
+                    } else if (event.type === 'token') {
+                        if (!contentDiv) {
+                            // First token: swap the typing indicator for the answer
+                            hideTypingIndicator();
+                            contentDiv = addMessage('', 'assistant');
+                        }
+                        contentDiv.textContent += event.text;
+                        chatMessages.scrollTop = chatMessages.scrollHeight;
+                    } else if (event.type === 'done') {
+                        hideTypingIndicator();
+                        if (!contentDiv) {
+                            contentDiv = addMessage(event.answer, 'assistant');
+                        }
+                        addSources(contentDiv.parentElement, sources);
+                        chatMessages.scrollTop = chatMessages.scrollHeight;
+                    } else if (event.type === 'error') {
+                        hideTypingIndicator();
+                        addMessage('Sorry, I encountered an error. Please try again.', 'assistant');
+                    }
+                });
 
-                // Hide typing indicator
                 hideTypingIndicator();
-
-                if (data.status === 'success') {
-                    addMessage(data.response, 'assistant', data.sources || []);
-                } else {
-                    addMessage('Sorry, I encountered an error. Please try again.', 'assistant');
-                }
             } catch (error) {
                 hideTypingIndicator();
                 addMessage('Sorry, I encountered a connection error. Please try again.', 'assistant');
                 console.error('Error:', error);
+            } finally {
+                // Re-enable input
+                messageInput.disabled = false;
+                sendButton.disabled = false;
+                messageInput.focus();
             }
-
-            // Re-enable input
-            messageInput.disabled = false;
-            sendButton.disabled = false;
-            messageInput.focus();
         }
     </script>
 </body>
@@ -500,24 +587,42 @@ async def get_chat_interface():
     """
     return HTMLResponse(content=html_content)
 
+def busy_response() -> JSONResponse:
+    """429 telling the client the generation queue is full."""
+    return JSONResponse(
+        status_code=429,
+        content=ChatResponse(
+            response="The assistant is busy right now. Please try again in a moment.",
+            status="busy",
+            mode="error"
+        ).model_dump(),
+        headers={"Retry-After": "5"}
+    )
+
 @app.post("/chat", response_model=ChatResponse)
-async def chat(message: ChatMessage):
+async def chat(message: ChatMessage, request: Request):
     try:
-        global model, rag_pipeline, chat_history
+        global rag_pipeline
+
+        session_id = message.session_id or SessionStore.new_session_id()
+        history = sessions.history(session_id)
 
         if message.use_rag:
             # RAG mode
             log_step(f"RAG chat: {message.message[:30]}...")
 
             # Initialize RAG if not loaded
-            if rag_pipeline is None:
-                rag_pipeline = initialize_rag()
+            if not rag_ready():
+                rag_pipeline = await asyncio.to_thread(initialize_rag)
 
-            # Query using RAG (k=8 for more context)
-            result = rag_pipeline.query(message.message, k=8)
+            # Query using RAG (RAG_TOP_K chunks)
+            result = await cancel_on_disconnect(
+                request,
+                rag_pipeline.aquery(message.message, k=rag_pipeline.default_k, history=history, session_id=session_id)
+            )
 
             # Store in history
-            chat_history.append({
+            sessions.append(session_id, {
                 "user": message.message,
                 "assistant": result["answer"],
                 "sources": result["sources"],
@@ -528,7 +633,8 @@ async def chat(message: ChatMessage):
                 response=result["answer"],
                 status="success",
                 sources=result["sources"],
-                mode="rag"
+                mode="rag",
+                session_id=session_id
             )
 
         else:
@@ -536,21 +642,24 @@ async def chat(message: ChatMessage):
             log_step(f"Direct chat: {message.message[:30]}...")
 
             # Initialize model if not loaded
-            if model is None:
-                model = initialize_model()
-
-            # Create simple prompt
-            prompt = f"<|begin_of_text|><|start_header_id|>user<|end_header_id|>\n\n{message.message}<|eot_id|><|start_header_id|>assistant<|end_header_id|>\n\n"
-
-            # Generate response
-            response = model.generate_response(
-                prompt=prompt,
-                max_tokens=512,
-                temperature=0.7
+            if not generation_ready():
+                rag_pipeline = await asyncio.to_thread(initialize_generation)
+
+            # Create simple prompt, replaying the conversation so far
+            direct = create_direct_prompt(message.message, history)
+
+            # Queued like RAG answers (429 when full, REQUEST_TIMEOUT, stopped on disconnect)
+            response = await cancel_on_disconnect(
+                request,
+                rag_pipeline.agenerate(
+                    direct["prompt"],
+                    session_id=session_id,
+                    session_prefix=direct["next_session_prefix"]
+                )
             )
 
             # Store in history
-            chat_history.append({
+            sessions.append(session_id, {
                 "user": message.message,
                 "assistant": response,
                 "mode": "direct"
@@ -559,9 +668,24 @@ async def chat(message: ChatMessage):
             return ChatResponse(
                 response=response,
                 status="success",
-                mode="direct"
+                mode="direct",
+                session_id=session_id
             )
 
+    except ClientDisconnected:
+        # Nobody is listening any more; the generation was cancelled
+        return Response(status_code=499)
+    except QueueFullError:
+        return busy_response()
+    except asyncio.TimeoutError:
+        return JSONResponse(
+            status_code=504,
+            content=ChatResponse(
+                response="Sorry, generating the answer took too long. Please try again.",
+                status="error",
+                mode="error"
+            ).model_dump()
+        )
     except Exception as e:
         print(f"Chat error: {e}")
         import traceback
@@ -572,16 +696,95 @@ async def chat(message: ChatMessage):
             mode="error"
         )
 
+@app.post("/chat/stream")
+async def chat_stream(message: ChatMessage):
+    """Same as /chat, but streams the answer as server-sent events."""
+    session_id = message.session_id or SessionStore.new_session_id()
+
+    def start_stream():
+        global rag_pipeline
+        history = sessions.history(session_id)
+
+        if message.use_rag:
+            log_step(f"RAG stream: {message.message[:30]}...")
+
+            if not rag_ready():
+                rag_pipeline = initialize_rag()
+
+            result = rag_pipeline.query_stream(message.message, k=rag_pipeline.default_k, history=history, session_id=session_id)
+            return result, "rag"
+
+        log_step(f"Direct stream: {message.message[:30]}...")
+
+        if not generation_ready():
+            rag_pipeline = initialize_generation()
+
+        direct = create_direct_prompt(message.message, history)
+        result = {
+            "answer_stream": rag_pipeline.stream_generation(
+                direct["prompt"],
+                session_id=session_id,
+                session_prefix=direct["next_session_prefix"]
+            ),
+            "sources": []
+        }
+        return result, "direct"
+
+    # Retrieve and queue before the response starts, so a full queue is a 429
+    error = None
+    try:
+        result, mode = await asyncio.to_thread(start_stream)
+    except QueueFullError:
+        return busy_response()
+    except Exception as e:
+        print(f"Chat stream error: {e}")
+        import traceback
+        traceback.print_exc()
+        result, mode, error = None, "error", str(e)
+
+    def event_stream():
+        if result is None:
+            yield format_sse({"type": "error", "detail": error})
+            return
+
+        try:
+            for event in stream_answer_events(result, session_id=session_id):
+                if event["type"] == "done":
+                    sessions.append(session_id, {
+                        "user": message.message,
+                        "assistant": event["answer"],
+                        "sources": result["sources"],
+                        "mode": mode
+                    })
+                yield format_sse(event)
+
+        except Exception as e:
+            print(f"Chat stream error: {e}")
+            import traceback
+            traceback.print_exc()
+            yield format_sse({"type": "error", "detail": str(e)})
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
 @app.get("/status")
 async def get_status():
-    global model, rag_pipeline
+    global rag_pipeline
     return {
-        "model_loaded": model is not None,
-        "rag_loaded": rag_pipeline is not None,
-        "chat_count": len(chat_history),
-        "status": "ready" if (model or rag_pipeline) else "loading"
+        "model_loaded": generation_ready(),
+        "rag_loaded": rag_ready(),
+        "chat_count": sessions.turn_count(),
+        "sessions": sessions.stats(),
+        "caches": rag_pipeline.cache_stats() if rag_pipeline else None,
+        "queue": rag_pipeline.queue_stats() if rag_pipeline else None,
+        "generation": rag_pipeline.generation_stats() if rag_pipeline else None,
+        "startup": rag_pipeline.readiness() if rag_pipeline else None,
+        "status": "ready" if generation_ready() else "loading"
     }
 
+@app.get("/health")
+async def health_check():
+    return {"status": "healthy"}
+
 if __name__ == "__main__":
     print("Starting web chat interface...")
     print("Open your browser to: http://localhost:8080")
@@ -4,44 +4,66 @@ Web chat interface for the RAG system - RunPod compatible
 Similar to ChatGPT/Claude interface
 """
 
-from fastapi import FastAPI
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, Request
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
+import asyncio
 import sys
 import os
 import uvicorn
-from typing import List
+from typing import List, Optional
 
 # Add src to path for module imports
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'src'))
 
 from rag_system.generation.rag_pipeline import RAGPipeline
+from rag_system.generation.session_store import SessionStore
+from rag_system.models.errors import QueueFullError
+from rag_system.utils.disconnect import ClientDisconnected, cancel_on_disconnect
+from rag_system.utils.sse import format_sse, stream_answer_events
 
 app = FastAPI(title="RAG Chat Interface")
 
 # Global instances
 rag_pipeline = None
-chat_history = []
+
+def release_session(session_id: str):
+    """Free the KV cache kept for a session once its history leaves memory or is trimmed."""
+    if rag_pipeline is not None:
+        rag_pipeline.drop_session(session_id)
+
+# Bounded per-session chat history (limits in .env)
+sessions = SessionStore(on_evict=release_session, on_trim=release_session)
 
 class ChatMessage(BaseModel):
     message: str
+    session_id: Optional[str] = None  # Conversation to continue; a new one is started if missing
 
 class ChatResponse(BaseModel):
     response: str
     status: str
     sources: List[str] = []
+    session_id: Optional[str] = None
 
-@app.on_event("startup")
-async def startup_event():
-    global rag_pipeline
+def rag_ready() -> bool:
+    return rag_pipeline is not None and rag_pipeline.model_loaded
+
+def load_rag_pipeline():
     try:
         print("[*] Initializing RAG pipeline...")
-        rag_pipeline = RAGPipeline()
         rag_pipeline.initialize()
         print("[OK] RAG pipeline ready!")
     except Exception as e:
         print(f"Warning: Could not initialize RAG pipeline: {e}")
 
+@app.on_event("startup")
+async def startup_event():
+    global rag_pipeline
+    # Constructing the pipeline is cheap; the models load in the background so
+    # /status and /health answer (and report progress) during a cold start
+    rag_pipeline = RAGPipeline()
+    asyncio.get_running_loop().run_in_executor(None, load_rag_pipeline)
+
 @app.get("/", response_class=HTMLResponse)
 async def get_chat_interface():
     html_content = """
@@ -267,6 +289,8 @@ async def get_chat_interface():
         const messageInput = document.getElementById('messageInput');
         const sendButton = document.getElementById('sendButton');
         const chatForm = document.getElementById('chatForm');
+        // Conversation ID assigned by the server on the first reply
+        let sessionId = null;
 
         // Auto-resize textarea
         messageInput.addEventListener('input', function() {
@@ -298,12 +322,7 @@ async def get_chat_interface():
             messageDiv.appendChild(contentDiv);
 
             // Add sources if available
-            if (sources && sources.length > 0) {
-                const sourcesDiv = document.createElement('div');
-                sourcesDiv.className = 'sources';
-                sourcesDiv.innerHTML = `<strong>📚 Sources:</strong>${sources.map(s => `<div>• ${s}</div>`).join('')}`;
-                contentDiv.appendChild(sourcesDiv);
-            }
+            addSources(contentDiv, sources);
 
             chatMessages.appendChild(messageDiv);
 
@@ -315,6 +334,38 @@ async def get_chat_interface():
 
             // Scroll to bottom
             chatMessages.scrollTop = chatMessages.scrollHeight;
+            return contentDiv;
+        }
+
+        function addSources(contentDiv, sources) {
+            if (sources && sources.length > 0) {
+                const sourcesDiv = document.createElement('div');
+                sourcesDiv.className = 'sources';
+                sourcesDiv.innerHTML = `<strong>📚 Sources:</strong>${sources.map(s => `<div>• ${s}</div>`).join('')}`;
+                contentDiv.appendChild(sourcesDiv);
+            }
+        }
+
+        // Read a server-sent-events body and call onEvent for each JSON event
+        async function readEventStream(response, onEvent) {
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+
+            while (true) {
+                const { done, value } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+
+                let boundary;
+                while ((boundary = buffer.indexOf('\\n\\n')) !== -1) {
+                    const rawEvent = buffer.slice(0, boundary);
+                    buffer = buffer.slice(boundary + 2);
+                    if (rawEvent.startsWith('data: ')) {
+                        onEvent(JSON.parse(rawEvent.slice(6)));
+                    }
+                }
+            }
         }
 
         function showTypingIndicator() {
@@ -360,36 +411,64 @@ async def get_chat_interface():
             showTypingIndicator();
 
             try {
-                const response = await fetch('/chat', {
+                const response = await fetch('/chat/stream', {
                     method: 'POST',
                     headers: {
                         'Content-Type': 'application/json',
                     },
                     body: JSON.stringify({
-                        message: message
+                        message: message,
+                        session_id: sessionId
                     }),
                 });
 
-                const data = await response.json();
+                if (!response.ok) {
+                    hideTypingIndicator();
+                    const busy = response.status === 429;
+                    addMessage(busy ? 'The assistant is busy right now. Please try again in a moment.'
+                                    : 'Sorry, I encountered an error. Please try again.', 'assistant');
+                    return;
+                }
 
-                // Hide typing indicator
-                hideTypingIndicator();
+                let contentDiv = null;
+                let sources = [];
+
+                await readEventStream(response, (event) => {
+                    if (event.type === 'sources') {
+                        sources = event.sources || [];
+                        sessionId = event.session_id || sessionId;
+                    } else if (event.type === 'token') {
+                        if (!contentDiv) {
+                            // First token: swap the typing indicator for the answer
+                            hideTypingIndicator();
+                            contentDiv = addMessage('', 'assistant');
+                        }
+                        contentDiv.textContent += event.text;
+                        chatMessages.scrollTop = chatMessages.scrollHeight;
+                    } else if (event.type === 'done') {
+                        hideTypingIndicator();
+                        if (!contentDiv) {
+                            contentDiv = addMessage(event.answer, 'assistant');
+                        }
+                        addSources(contentDiv, sources);
+                        chatMessages.scrollTop = chatMessages.scrollHeight;
+                    } else if (event.type === 'error') {
+                        hideTypingIndicator();
+                        addMessage(event.detail || 'Sorry, I encountered an error. Please try again.', 'assistant');
+                    }
+                });
 
-                if (data.status === 'success') {
-                    addMessage(data.response, 'assistant', data.sources || []);
-                } else {
-                    addMessage('Sorry, I encountered an error. Please try again.', 'assistant');
-                }
+                hideTypingIndicator();
             } catch (error) {
                 hideTypingIndicator();
                 addMessage('Sorry, I encountered a connection error. Please try again.', 'assistant');
                 console.error('Error:', error);
+            } finally {
+                // Re-enable input
+                messageInput.disabled = false;
+                sendButton.disabled = false;
+                messageInput.focus();
             }
-
-            // Re-enable input
-            messageInput.disabled = false;
-            sendButton.disabled = false;
-            messageInput.focus();
         }
     </script>
 </body>
@@ -397,24 +476,42 @@ async def get_chat_interface():
     """
     return HTMLResponse(content=html_content)
 
+def busy_response() -> JSONResponse:
+    """429 telling the client the generation queue is full."""
+    return JSONResponse(
+        status_code=429,
+        content=ChatResponse(
+            response="The assistant is busy right now. Please try again in a moment.",
+            status="busy",
+            sources=[]
+        ).model_dump(),
+        headers={"Retry-After": "5"}
+    )
+
 @app.post("/chat", response_model=ChatResponse)
-async def chat(message: ChatMessage):
+async def chat(message: ChatMessage, request: Request):
     try:
-        global rag_pipeline, chat_history
+        global rag_pipeline
 
         # Initialize RAG if not loaded
-        if rag_pipeline is None:
+        if not rag_ready():
             return ChatResponse(
                 response="System is still initializing. Please wait a moment and try again.",
                 status="error",
                 sources=[]
             )
 
-        # Query using RAG
-        result = rag_pipeline.query(message.message, k=8)
+        session_id = message.session_id or SessionStore.new_session_id()
+        history = sessions.history(session_id)
+
+        # Query using RAG without blocking the event loop
+        result = await cancel_on_disconnect(
+            request,
+            rag_pipeline.aquery(message.message, k=rag_pipeline.default_k, history=history, session_id=session_id)
+        )
 
         # Store in history
-        chat_history.append({
+        sessions.append(session_id, {
             "user": message.message,
             "assistant": result["answer"],
             "sources": result["sources"]
@@ -423,9 +520,24 @@ async def chat(message: ChatMessage):
         return ChatResponse(
             response=result["answer"],
             status="success",
-            sources=result["sources"]
+            sources=result["sources"],
+            session_id=session_id
         )
 
+    except ClientDisconnected:
+        # Nobody is listening any more; the generation was cancelled
+        return Response(status_code=499)
+    except QueueFullError:
+        return busy_response()
+    except asyncio.TimeoutError:
+        return JSONResponse(
+            status_code=504,
+            content=ChatResponse(
+                response="Sorry, generating the answer took too long. Please try again.",
+                status="error",
+                sources=[]
+            ).model_dump()
+        )
     except Exception as e:
         print(f"Chat error: {e}")
         import traceback
@@ -436,13 +548,71 @@ async def chat(message: ChatMessage):
             sources=[]
         )
 
+@app.post("/chat/stream")
+async def chat_stream(message: ChatMessage):
+    """Same as /chat, but streams the answer as server-sent events."""
+    session_id = message.session_id or SessionStore.new_session_id()
+
+    def error_stream(detail: str):
+        yield format_sse({"type": "error", "detail": detail})
+
+    if not rag_ready():
+        return StreamingResponse(
+            error_stream("System is still initializing. Please wait a moment and try again."),
+            media_type="text/event-stream"
+        )
+
+    # Retrieve and queue before the response starts, so a full queue is a 429
+    try:
+        history = sessions.history(session_id)
+        result = await asyncio.to_thread(
+            rag_pipeline.query_stream, message.message, k=rag_pipeline.default_k, history=history, session_id=session_id
+        )
+    except QueueFullError:
+        return busy_response()
+    except Exception as e:
+        print(f"Chat stream error: {e}")
+        import traceback
+        traceback.print_exc()
+        return StreamingResponse(
+            error_stream("I'm sorry, I encountered an error processing your request."),
+            media_type="text/event-stream"
+        )
+
+    def event_stream():
+        try:
+            for event in stream_answer_events(result, session_id=session_id):
+                if event["type"] == "done":
+                    sessions.append(session_id, {
+                        "user": message.message,
+                        "assistant": event["answer"],
+                        "sources": result["sources"]
+                    })
+                yield format_sse(event)
+
+        except Exception as e:
+            print(f"Chat stream error: {e}")
+            import traceback
+            traceback.print_exc()
+            yield format_sse({
+                "type": "error",
+                "detail": "I'm sorry, I encountered an error processing your request."
+            })
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
 @app.get("/status")
 async def get_status():
     global rag_pipeline
     return {
-        "rag_loaded": rag_pipeline is not None,
-        "chat_count": len(chat_history),
-        "status": "ready" if rag_pipeline else "loading"
+        "rag_loaded": rag_ready(),
+        "chat_count": sessions.turn_count(),
+        "sessions": sessions.stats(),
+        "caches": rag_pipeline.cache_stats() if rag_pipeline else None,
+        "queue": rag_pipeline.queue_stats() if rag_pipeline else None,
+        "generation": rag_pipeline.generation_stats() if rag_pipeline else None,
+        "startup": rag_pipeline.readiness() if rag_pipeline else None,
+        "status": "ready" if rag_ready() else "loading"
     }
 
 @app.get("/health")
@@ -1,14 +1,16 @@
 # Windows-Safe Configuration for RAG System
 # This prevents system crashes by adding safety checks
 
-import torch
 import psutil
 import os
 
+# torch is imported inside each check so importing this module stays cheap
+
 class WindowsSafeConfig:
     @staticmethod
     def check_system_resources():
         """Check if system has enough resources before loading model"""
+        import torch
         # Check available RAM (need at least 12GB for safety)
         ram_gb = psutil.virtual_memory().total / (1024**3)
         if ram_gb < 12:
@@ -24,6 +26,7 @@ class WindowsSafeConfig:
     @staticmethod
     def get_safe_model_config():
         """Return Windows-safe model configuration"""
+        import torch
         return {
             "load_in_4bit": True,
             "bnb_4bit_compute_dtype": torch.float16,
@@ -38,6 +41,7 @@ class WindowsSafeConfig:
     @staticmethod
     def monitor_memory():
         """Monitor system memory during operation"""
+        import torch
         ram_percent = psutil.virtual_memory().percent
         if ram_percent > 85:
             print(f"WARNING: High RAM usage: {ram_percent}%")